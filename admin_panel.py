@@ -4,14 +4,31 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramAPIError
 import asyncio
-from typing import List, Dict
+import base64
+import html
+import calendar
+import tempfile
+import time
+from typing import List, Dict, Optional
 import pandas as pd
 from datetime import datetime
 import os
 
 from database import db
-from config import ADMIN_IDS, DEFAULT_TEXTS
-from stats import StatsManager
+from config import (ADMIN_IDS, DEFAULT_TEXTS, USERS_PER_PAGE, COHORT_SCREEN_ROWS, GROWTH_CHART_DAYS,
+                    IMPORT_BATCH_SIZE, IMPORT_MAX_FILE_MB)
+from stats import stats_manager
+from timeseries import get_active_users
+from outbound import outbound_dispatcher
+from middlewares import throttling_middleware
+from leaderboard import leaderboard
+from ledger import verify_balances, parse_point_changes, preview_point_changes, pending_point_batches
+from referral_graph import referral_graph
+from funnel import build_report
+from charts import chart_renderer
+from importer import import_users
+from broadcast import (SEGMENTS, pending_segments, parse_segment_value, describe_segment, resolve_segment,
+                       start_broadcast, get_running_jobs, parse_schedule, active_broadcasts)
 
 # Router for admin handlers
 admin_router = Router()
@@ -36,6 +53,12 @@ class AdminStates(StatesGroup):
     broadcast_message = State()
     single_message = State()
     single_message_target = State()
+    segment_value = State()
+    segment_message = State()
+    schedule_text = State()
+    schedule_time = State()
+    user_import = State()
+    bulk_points = State()
 
 def create_admin_main_keyboard() -> InlineKeyboardMarkup:
     """Create admin main panel keyboard"""
@@ -59,7 +82,9 @@ def create_user_management_keyboard() -> InlineKeyboardMarkup:
          InlineKeyboardButton(text="📋 Ro'yxat", callback_data="user_list")],
         [InlineKeyboardButton(text="📊 Faol foydalanuvchilar", callback_data="active_users"),
          InlineKeyboardButton(text="📈 Yangi foydalanuvchilar", callback_data="new_users")],
-        [InlineKeyboardButton(text="📄 Excel eksport", callback_data="export_users")],
+        [InlineKeyboardButton(text="🗂 Barcha foydalanuvchilar", callback_data="ul:b"),
+         InlineKeyboardButton(text="📄 Excel eksport", callback_data="export_users")],
+        [InlineKeyboardButton(text="📥 Import (CSV/Excel)", callback_data="import_users")],
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_panel")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -73,6 +98,8 @@ def create_stats_keyboard() -> InlineKeyboardMarkup:
          InlineKeyboardButton(text="📊 Umumiy", callback_data="stats_all")],
         [InlineKeyboardButton(text="👆 Top referrallar", callback_data="top_referrers"),
          InlineKeyboardButton(text="📈 O'sish dinamikasi", callback_data="growth_stats")],
+        [InlineKeyboardButton(text="🌳 Referal tarmoqlari", callback_data="referral_networks"),
+         InlineKeyboardButton(text="🔻 Voronka va kogortalar", callback_data="funnel_report")],
         [InlineKeyboardButton(text="📄 Excel yuklab olish", callback_data="export_stats")],
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_panel")]
     ]
@@ -83,7 +110,10 @@ def create_messaging_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="📢 Hammaga yuborish", callback_data="broadcast_all"),
          InlineKeyboardButton(text="👤 Bitta foydalanuvchi", callback_data="message_single")],
-        [InlineKeyboardButton(text="📊 Yuborilgan xabarlar", callback_data="message_stats")],
+        [InlineKeyboardButton(text="🎯 Segment bo'yicha", callback_data="broadcast_segment"),
+         InlineKeyboardButton(text="⏰ Rejalashtirilgan", callback_data="scheduled_list")],
+        [InlineKeyboardButton(text="📡 Jarayonlar", callback_data="broadcast_watch"),
+         InlineKeyboardButton(text="📊 Yuborilgan xabarlar", callback_data="message_stats")],
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_panel")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -105,7 +135,10 @@ def create_contest_keyboard() -> InlineKeyboardMarkup:
          InlineKeyboardButton(text="⏹ To'xtatish", callback_data="stop_contest")],
         [InlineKeyboardButton(text="🔄 Ballarni nollash", callback_data="reset_balances"),
          InlineKeyboardButton(text="🏆 Top 20 g'olib", callback_data="contest_winners")],
-        [InlineKeyboardButton(text="📊 Konkurs statistikasi", callback_data="contest_stats")],
+        [InlineKeyboardButton(text="📊 Konkurs statistikasi", callback_data="contest_stats"),
+         InlineKeyboardButton(text="📜 O'tgan mavsumlar", callback_data="season_history")],
+        [InlineKeyboardButton(text="🧮 Ballarni tekshirish", callback_data="verify_balances"),
+         InlineKeyboardButton(text="📥 Ballar fayldan", callback_data="bulk_points")],
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_panel")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -155,14 +188,12 @@ async def callback_user_management(callback: CallbackQuery, state: FSMContext):
     """Show user management panel"""
     await callback.answer()
     
-    total_users = db.get_total_users()
-    active_today = db.get_active_users_count(1)
-    active_week = db.get_active_users_count(7)
+    dashboard = await stats_manager.get_dashboard()
     
     text = f"👥 **FOYDALANUVCHILAR BOSHQARUVI**\n\n"
-    text += f"📊 Umumiy foydalanuvchilar: {total_users}\n"
-    text += f"🟢 Bugun faol: {active_today}\n"
-    text += f"📅 Hafta davomida faol: {active_week}\n\n"
+    text += f"📊 Umumiy foydalanuvchilar: {dashboard['total_users']}\n"
+    text += f"🟢 Bugun faol: {dashboard['active_today']}\n"
+    text += f"📅 Hafta davomida faol: {dashboard['active_week']}\n\n"
     text += "Quyidagi amallardan birini tanlang:"
     
     keyboard = create_user_management_keyboard()
@@ -174,9 +205,9 @@ async def callback_statistics(callback: CallbackQuery, state: FSMContext):
     """Show statistics panel"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    today_stats = stats_manager.get_daily_stats()
-    week_stats = stats_manager.get_weekly_stats()
+    dashboard = await stats_manager.get_dashboard()
+    today_stats = dashboard['today']
+    week_stats = dashboard['week']
     
     text = f"📊 **STATISTIKA**\n\n"
     text += f"📅 **Bugun:**\n"
@@ -238,9 +269,8 @@ async def callback_contest_management(callback: CallbackQuery, state: FSMContext
     """Show contest management panel"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    contest_stats = stats_manager.get_contest_statistics()
-    contest_active = stats_manager.is_contest_active()
+    contest_stats = await stats_manager.get_contest_statistics()
+    contest_active = contest_stats['contest_active']
     
     text = f"🏆 **KONKURS BOSHQARUVI**\n\n"
     text += f"📊 **Hozirgi holat:**\n"
@@ -317,8 +347,16 @@ async def callback_user_list(callback: CallbackQuery):
     """Show user list"""
     await callback.answer()
     
-    users = db.get_top_users(20)
+    text = leaderboard.render('user_list', render_user_list)
     
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_users")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+
+def render_user_list(users: List[Dict]) -> str:
+    """User list screen text for the top users"""
     text = "📋 **FOYDALANUVCHILAR RO'YXATI (TOP 20)**\n\n"
     
     if users:
@@ -331,26 +369,132 @@ async def callback_user_list(callback: CallbackQuery):
     else:
         text += "❌ Foydalanuvchilar topilmadi"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_users")]
-    ])
+    return text
+
+# User browser sorts: callback code -> (database sort, button title)
+USER_BROWSER_SORTS = {
+    'b': ('balance', "💰 Ball"),
+    'r': ('registration', "🆕 Ro'yxatdan o'tish"),
+    'a': ('activity', "🕒 Faollik"),
+}
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _to_base36(number: int) -> str:
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    sign, number = ('-', -number) if number < 0 else ('', number)
+    encoded = ''
+    while True:
+        number, digit = divmod(number, 36)
+        encoded = digits[digit] + encoded
+        if not number:
+            return sign + encoded
+
+# Longest raw date kept in a cursor; callback data is limited to 64 bytes
+MAX_RAW_CURSOR_DATE = 27
+
+def _encode_timestamp(value: Optional[str]) -> str:
+    """Date as base36 seconds; '-' for NULL, '~' + base64 of the raw text when it does not round-trip"""
+    if value is None:
+        return '-'
+    try:
+        seconds = calendar.timegm(time.strptime(value, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        # Fractions, other formats or garbage: keep the exact text so the seek stays exact
+        raw = base64.urlsafe_b64encode(str(value)[:MAX_RAW_CURSOR_DATE].encode()).rstrip(b'=')
+        return '~' + raw.decode()
+    return _to_base36(seconds)
+
+def _decode_timestamp(value: str) -> Optional[str]:
+    if value == '-':
+        return None
+    if value.startswith('~'):
+        raw = value[1:]
+        return base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4)).decode()
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(int(value, 36)))
+
+def encode_user_cursor(sort_code: str, user: Dict) -> str:
+    """Compact cursor of a boundary row, base36 numbers joined by dots"""
+    if sort_code == 'b':
+        parts = [user['balance'], None, user['user_id']]
+        date = user['registration_date']
+    else:
+        parts = [None, user['user_id']]
+        date = user['registration_date'] if sort_code == 'r' else user['last_activity']
+    return '.'.join(_encode_timestamp(date) if part is None else _to_base36(part) for part in parts)
+
+def decode_user_cursor(sort_code: str, cursor: str) -> tuple:
+    parts = cursor.split('.')
+    if sort_code == 'b':
+        return int(parts[0], 36), _decode_timestamp(parts[1]), int(parts[2], 36)
+    return _decode_timestamp(parts[0]), int(parts[1], 36)
+
+@admin_router.callback_query(F.data.startswith("ul:"))
+async def callback_user_browser(callback: CallbackQuery):
+    """Browse all users page by page.
+
+    Callback data is "ul:<sort>[:<n|p>:<cursor>]": next or previous page
+    relative to the boundary row encoded in the cursor.
+    """
+    await callback.answer()
     
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    parts = callback.data.split(':')
+    sort_code = parts[1] if len(parts) > 1 and parts[1] in USER_BROWSER_SORTS else 'b'
+    backward = len(parts) > 3 and parts[2] == 'p'
+    try:
+        cursor = decode_user_cursor(sort_code, parts[3]) if len(parts) > 3 else None
+    except (IndexError, ValueError):
+        cursor, backward = None, False  # Malformed cursor: start from the first page
+    sort, sort_title = USER_BROWSER_SORTS[sort_code]
+    
+    users, has_more = db.get_users_page(sort, cursor, backward, USERS_PER_PAGE)
+    
+    text = f"🗂 FOYDALANUVCHILAR ({sort_title})\n\n"
+    for user in users:
+        name = user['first_name'] or user['username'] or f"User {user['user_id']}"
+        if user['last_name']:
+            name += f" {user['last_name']}"
+        text += f"• {html.escape(name)} — {user['balance']} ball\n"
+        if sort == 'balance':
+            text += f"   ID: {user['user_id']}\n"
+        else:
+            date = user['registration_date'] if sort == 'registration' else user['last_activity']
+            text += f"   ID: {user['user_id']} | {html.escape((date or '')[:16])}\n"
+    if not users:
+        text += "❌ Foydalanuvchilar topilmadi"
+    
+    # Previous page exists when we came forward from a cursor or more rows lie behind
+    has_previous = has_more if backward else cursor is not None
+    has_next = True if backward else has_more
+    
+    navigation = []
+    if users and has_previous:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Oldingi", callback_data=f"ul:{sort_code}:p:{encode_user_cursor(sort_code, users[0])}"))
+    if users and has_next:
+        navigation.append(InlineKeyboardButton(
+            text="Keyingi ➡️", callback_data=f"ul:{sort_code}:n:{encode_user_cursor(sort_code, users[-1])}"))
+    
+    keyboard = [
+        [InlineKeyboardButton(text=("✅ " if code == sort_code else "") + title, callback_data=f"ul:{code}")
+         for code, (_, title) in USER_BROWSER_SORTS.items()]
+    ]
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_users")])
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
 
 @admin_router.callback_query(F.data == "active_users")
 async def callback_active_users(callback: CallbackQuery):
     """Show active users"""
     await callback.answer()
     
-    active_today = db.get_active_users_count(1)
-    active_week = db.get_active_users_count(7)
-    active_month = db.get_active_users_count(30)
-    
     text = f"📊 **FAOL FOYDALANUVCHILAR**\n\n"
-    text += f"🟢 Bugun faol: {active_today}\n"
-    text += f"📅 Bu hafta faol: {active_week}\n"
-    text += f"📆 Bu oy faol: {active_month}\n\n"
-    text += "Bu ma'lumotlar so'nggi faollik vaqtiga asoslangan."
+    text += f"🟢 Bugun faol: {get_active_users(1)}\n"
+    text += f"📅 So'nggi 7 kun: {get_active_users(7)}\n"
+    text += f"📆 So'nggi 30 kun: {get_active_users(30)}\n\n"
+    text += "Kunlik HyperLogLog eskizlaridan taxminiy hisob (~1% xatolik)."
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_users")]
@@ -363,8 +507,7 @@ async def callback_new_users(callback: CallbackQuery):
     """Show new users statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    activity_stats = stats_manager.get_user_activity_stats()
+    activity_stats = await stats_manager.get_dashboard()
     
     text = f"📈 **YANGI FOYDALANUVCHILAR**\n\n"
     text += f"📅 Bugun ro'yxatdan o'tgan: {activity_stats['today_registrations']}\n"
@@ -383,8 +526,7 @@ async def callback_stats_today(callback: CallbackQuery):
     """Show today's statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    stats = stats_manager.get_daily_stats()
+    stats = (await stats_manager.get_dashboard())['today']
     
     text = f"📅 **BUGUNGI STATISTIKA**\n\n"
     text += f"📊 Sana: {stats['date']}\n\n"
@@ -404,8 +546,7 @@ async def callback_stats_week(callback: CallbackQuery):
     """Show weekly statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    stats = stats_manager.get_weekly_stats()
+    stats = (await stats_manager.get_dashboard())['week']
     
     text = f"📅 **BU HAFTA STATISTIKASI**\n\n"
     text += f"👤 Yangi foydalanuvchilar: {stats['new_users']}\n"
@@ -424,8 +565,7 @@ async def callback_stats_month(callback: CallbackQuery):
     """Show monthly statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    stats = stats_manager.get_monthly_stats()
+    stats = (await stats_manager.get_dashboard())['month']
     
     text = f"📅 **BU OY STATISTIKASI**\n\n"
     text += f"👤 Yangi foydalanuvchilar: {stats['new_users']}\n"
@@ -444,8 +584,7 @@ async def callback_stats_all(callback: CallbackQuery):
     """Show all-time statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    stats = stats_manager.get_all_time_stats()
+    stats = await stats_manager.get_dashboard()
     
     text = f"📊 **UMUMIY STATISTIKA**\n\n"
     text += f"👥 Jami foydalanuvchilar: {stats['total_users']}\n"
@@ -479,18 +618,81 @@ async def callback_top_referrers(callback: CallbackQuery):
     else:
         text += "❌ Referrallar topilmadi"
     
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔁 Qayta sanash", callback_data="recount_referrals")],
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_stats")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+
+@admin_router.callback_query(F.data == "referral_networks")
+async def callback_referral_networks(callback: CallbackQuery):
+    """Show the largest multi-level referral networks"""
+    await callback.answer()
+    
+    def load_networks():
+        networks = referral_graph.get_top_networks(10)
+        return networks, db.get_user_names([network['user_id'] for network in networks])
+    
+    networks, names = await asyncio.get_running_loop().run_in_executor(None, load_networks)
+    
+    text = "🌳 <b>REFERAL TARMOQLARI (TOP 10)</b>\n\n"
+    
+    if networks:
+        for i, network in enumerate(networks, 1):
+            name = names.get(network['user_id']) or f"User {network['user_id']}"
+            text += f"{i}. {html.escape(name)} — {network['size']} ta (chuqurlik: {network['depth']})\n"
+            levels = " / ".join(str(count) for count in network['levels'][:5])
+            if len(network['levels']) > 5:
+                levels += " / ..."
+            text += f"   Darajalar: {levels}\n\n"
+    else:
+        text += "❌ Referal tarmoqlari topilmadi"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_stats")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+@admin_router.callback_query(F.data == "funnel_report")
+async def callback_funnel_report(callback: CallbackQuery):
+    """Show the registration funnel and weekly cohort retention"""
+    await callback.answer("⏳ Hisoblanmoqda...")
+    
+    report = await asyncio.get_running_loop().run_in_executor(None, build_report)
+    
+    text = "🔻 **RO'YXATDAN O'TISH VORONKASI**\n\n"
+    for stage in report['funnel']:
+        text += f"{stage['title']}: {stage['users']} ({stage['of_started']}%, oldingidan {stage['of_previous']}%)\n"
+    
+    cohorts = report['cohorts'].head(COHORT_SCREEN_ROWS)
+    if len(cohorts):
+        weeks = [column for column in cohorts.columns if column.startswith('w')][:4]
+        text += "\n📅 **Haftalik kogortalar (qolganlar, %)**\n```\n"
+        text += "Hafta  Soni  " + " ".join(f"{column.upper():>5}" for column in weeks) + "\n"
+        for cohort, row in cohorts.iterrows():
+            cells = " ".join("    -" if pd.isna(row[column]) else f"{row[column]:5.1f}" for column in weeks)
+            text += f"{cohort:%m-%d} {int(row['users']):>5}  {cells}\n"
+        text += "```\nTo'liq jadval Excel hisobotida."
+    
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_stats")]
     ])
     
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
 
+@admin_router.callback_query(F.data == "recount_referrals")
+async def callback_recount_referrals(callback: CallbackQuery):
+    """Fix drift of the per-user referral counters"""
+    fixed = await asyncio.get_running_loop().run_in_executor(None, db.recount_referrals)
+    await callback.answer(f"✅ Qayta sanaldi, tuzatildi: {fixed}", show_alert=True)
+
 @admin_router.callback_query(F.data == "growth_stats")
 async def callback_growth_stats(callback: CallbackQuery):
     """Show growth statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
     growth_data = stats_manager.get_growth_dynamics(7)  # Last 7 days
     
     text = "📈 **O'SISH DINAMIKASI (So'nggi 7 kun)**\n\n"
@@ -505,26 +707,46 @@ async def callback_growth_stats(callback: CallbackQuery):
         text += "❌ Ma'lumotlar topilmadi"
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"🖼 Grafik ({GROWTH_CHART_DAYS} kun)", callback_data="growth_chart")],
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_stats")]
     ])
     
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
 
+@admin_router.callback_query(F.data == "growth_chart")
+async def callback_growth_chart(callback: CallbackQuery, bot: Bot):
+    """Send the growth chart image"""
+    growth_data = stats_manager.get_growth_dynamics(GROWTH_CHART_DAYS)
+    if not growth_data:
+        await callback.answer("❌ Ma'lumotlar topilmadi", show_alert=True)
+        return
+    
+    await callback.answer("🖼 Grafik tayyorlanmoqda...")
+    
+    try:
+        await chart_renderer.send_growth_chart(
+            bot,
+            callback.from_user.id,
+            growth_data,
+            title=f"O'sish dinamikasi: {growth_data[0]['date']} — {growth_data[-1]['date']}",
+            caption=f"📈 So'nggi {GROWTH_CHART_DAYS} kun: yangi, faol va jami o'sish"
+        )
+    except Exception as e:
+        print(f"Error sending growth chart: {e}")
+        await callback.message.answer("❌ Grafik yaratishda xatolik yuz berdi.")
+
 @admin_router.callback_query(F.data == "export_stats")
 async def callback_export_stats(callback: CallbackQuery, bot: Bot):
     """Export statistics to Excel"""
     await callback.answer("📄 Statistika fayli tayyorlanmoqda...")
     
     try:
-        stats_manager = StatsManager()
-        file_path = await stats_manager.export_statistics_to_excel()
-        
-        with open(file_path, 'rb') as file:
-            await bot.send_document(
-                callback.from_user.id,
-                document=file,
-                caption="📊 Statistika hisoboti\n📅 Sanasi: " + datetime.now().strftime("%d.%m.%Y %H:%M")
-            )
+        await stats_manager.send_export(
+            bot,
+            callback.from_user.id,
+            'statistics',
+            caption="📊 Statistika hisoboti\n📅 Sanasi: " + datetime.now().strftime("%d.%m.%Y %H:%M")
+        )
         
         await callback.message.answer("✅ Statistika fayli muvaffaqiyatli yuborildi!")
         
@@ -618,9 +840,13 @@ async def callback_start_contest(callback: CallbackQuery):
     await callback.answer()
     
     db.set_setting('contest_active', 'true')
+    season_id = db.start_season()
     
     text = "▶️ **KONKURS BOSHLANDI!**\n\n"
     text += "✅ Konkurs faol holga o'tkazildi.\n"
+    if season_id:
+        text += f"🗓 Mavsum: #{season_id}\n"
+    text += "💰 Joriy ballar saqlanib qoladi. Yangi mavsum uchun \"Ballarni nollash\" tugmasidan foydalaning.\n"
     text += "Foydalanuvchilar endi to'liq ishtirok eta olishadi!"
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -635,9 +861,12 @@ async def callback_stop_contest(callback: CallbackQuery):
     await callback.answer()
     
     db.set_setting('contest_active', 'false')
+    season_id = db.end_season()
     
     text = "⏹ **KONKURS TO'XTATILDI!**\n\n"
     text += "✅ Konkurs to'xtatildi.\n"
+    if season_id:
+        text += f"📸 Mavsum #{season_id} yakuniy reytingi saqlandi.\n"
     text += "Foydalanuvchilar balllarini ko'rishlari mumkin, lekin yangi ball to'play olmaydilar."
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -651,9 +880,17 @@ async def callback_contest_winners(callback: CallbackQuery):
     """Show contest winners"""
     await callback.answer()
     
-    winners = db.get_top_users(20)
+    text = leaderboard.render('winners', render_winners)
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Konkurs menyusi", callback_data="admin_contest")]
+    ])
     
-    text = "🏆 **KONKURS G'OLIBLARI (TOP 20)**\n\n"
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+
+def render_winners(winners: List[Dict], title: str = "KONKURS G'OLIBLARI (TOP 20)") -> str:
+    """Contest winners screen text for the top users"""
+    text = f"🏆 **{title}**\n\n"
     
     if winners:
         for i, winner in enumerate(winners, 1):
@@ -674,19 +911,181 @@ async def callback_contest_winners(callback: CallbackQuery):
     else:
         text += "❌ G'oliblar topilmadi"
     
+    return text
+
+@admin_router.callback_query(F.data == "season_history")
+async def callback_season_history(callback: CallbackQuery):
+    """Show closed contest seasons"""
+    await callback.answer()
+    
+    seasons = db.get_seasons(10)
+    
+    text = "📜 **O'TGAN MAVSUMLAR**\n\n"
+    keyboard = []
+    if seasons:
+        for season in seasons:
+            text += f"🗓 #{season['id']}: {season['started_at'][:10]} — {season['ended_at'][:10]}\n"
+            text += f"   👥 {season['participants']} ishtirokchi, 🎁 {season['total_points']} ball\n\n"
+            keyboard.append([InlineKeyboardButton(text=f"🏆 Mavsum #{season['id']} g'oliblari",
+                                                  callback_data=f"season_view_{season['id']}")])
+    else:
+        text += "❌ Hali yakunlangan mavsumlar yo'q"
+    keyboard.append([InlineKeyboardButton(text="🔙 Konkurs menyusi", callback_data="admin_contest")])
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+                                     parse_mode="Markdown")
+
+@admin_router.callback_query(F.data.startswith("season_view_"))
+async def callback_season_view(callback: CallbackQuery):
+    """Show winners of a closed season"""
+    await callback.answer()
+    
+    season_id = int(callback.data.split("_")[-1])
+    winners = db.get_season_results(season_id, 20)
+    
+    text = render_winners(winners, f"MAVSUM #{season_id} G'OLIBLARI")
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Mavsumlar", callback_data="season_history")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+
+@admin_router.callback_query(F.data.in_({"verify_balances", "repair_balances"}))
+async def callback_verify_balances(callback: CallbackQuery):
+    """Check balances against the points ledger, optionally repairing them"""
+    await callback.answer()
+    
+    repair = callback.data == "repair_balances"
+    try:
+        report = await asyncio.get_running_loop().run_in_executor(None, verify_balances, repair)
+    except Exception as e:
+        print(f"Error verifying balances: {e}")
+        await callback.message.edit_text("❌ Tekshirishda xatolik yuz berdi.")
+        return
+    
+    text = "🧮 **BALLAR TEKSHIRUVI**\n\n"
+    text += f"👥 Foydalanuvchilar: {report['users']}\n"
+    text += f"🧾 Yozuvlar: {report['transactions']}\n"
+    text += f"⚠️ Mos kelmagan ballar: {report['mismatches']} (farq: {report['difference']})\n"
+    for user_id, balance, expected in report['examples']:
+        text += f"  {user_id}: {balance} ≠ {expected}\n"
+    if report['repaired']:
+        text += f"\n🛠 Tuzatildi: {report['repaired']}\n"
+    
+    keyboard = []
+    if report['mismatches'] and not report['repaired']:
+        keyboard.append([InlineKeyboardButton(text="🛠 Tuzatish", callback_data="repair_balances")])
+    keyboard.append([InlineKeyboardButton(text="🔙 Konkurs menyusi", callback_data="admin_contest")])
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+                                     parse_mode="Markdown")
+
+@admin_router.callback_query(F.data == "bulk_points")
+async def callback_bulk_points(callback: CallbackQuery, state: FSMContext):
+    """Ask for a CSV of point changes"""
+    await callback.answer()
+    
+    text = "📥 **BALLARNI FAYLDAN QO'SHISH**\n\n"
+    text += "CSV fayl yuboring, har bir qator: `user_id,amount,reason`\n\n"
+    text += "• Manfiy `amount` ballarni ayiradi\n"
+    text += "• `reason` bo'sh bo'lsa - admin tuzatishi\n"
+    text += "• Avval natija ko'rsatiladi, tasdiqlangandan keyin qo'llanadi\n"
+    text += "• Bir xil fayl ikki marta qo'llanmaydi"
+    
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Konkurs menyusi", callback_data="admin_contest")]
     ])
     
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    await state.set_state(AdminStates.bulk_points)
+
+@admin_router.message(AdminStates.bulk_points, F.document)
+async def handle_bulk_points_file(message: Message, state: FSMContext, bot: Bot):
+    """Parse an uploaded point changes CSV and show a dry-run preview"""
+    admin_id = message.from_user.id
+    if not db.is_admin(admin_id) and admin_id not in ADMIN_IDS:
+        await message.answer("❌ Sizda admin huquqlari yo'q!")
+        return
+    
+    document = message.document
+    if not (document.file_name or '').lower().endswith('.csv'):
+        await message.answer("❌ Faqat .csv fayl yuboring.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_MB * 1024 * 1024:
+        await message.answer(f"❌ Fayl juda katta. Maksimal hajm: {IMPORT_MAX_FILE_MB} MB.")
+        return
+    
+    loop = asyncio.get_running_loop()
+    try:
+        data = (await bot.download(document)).getvalue()
+        parsed = await loop.run_in_executor(None, parse_point_changes, data)
+        preview = await loop.run_in_executor(None, preview_point_changes, parsed['changes'], parsed['batch_id'])
+    except Exception as e:
+        print(f"Error reading point changes: {e}")
+        await message.answer(f"❌ Faylni o'qishda xatolik: {html.escape(str(e))}")
+        return
+    
+    await state.set_state(AdminStates.contest_management)
+    
+    text = "🧾 OLDINDAN KO'RISH (hali qo'llanmagan)\n\n"
+    text += f"📄 Qatorlar: {preview['rows']}\n"
+    text += f"👥 Foydalanuvchilar: {preview['users']}\n"
+    text += f"➕ Qo'shiladi: {preview['added']} ball\n"
+    text += f"➖ Ayiriladi: {preview['deducted']} ball\n"
+    text += f"📊 Jami o'zgarish: {preview['added'] - preview['deducted']:+d} ball\n"
+    if preview['unknown_users']:
+        text += f"❓ Bazada yo'q foydalanuvchilar (o'tkazib yuboriladi): {preview['unknown_users']}\n"
+    if preview['negative_balances']:
+        text += f"⚠️ Balansi manfiy bo'ladiganlar: {preview['negative_balances']}\n"
+    if parsed['invalid']:
+        text += f"⚠️ Xato qatorlar: {parsed['invalid']}\n"
+        for line, error in parsed['errors']:
+            text += f"• {line}-qator: {html.escape(error)}\n"
+    
+    keyboard = []
+    if preview['applied']:
+        text += f"\n✅ Bu fayl {preview['applied']['applied_at'][:16]} da allaqachon qo'llangan."
+    elif preview['users']:
+        pending_point_batches[admin_id] = (parsed['batch_id'], parsed['changes'])
+        keyboard.append([InlineKeyboardButton(text="✅ Qo'llash", callback_data="bp_apply"),
+                         InlineKeyboardButton(text="❌ Bekor qilish", callback_data="bp_cancel")])
+    keyboard.append([InlineKeyboardButton(text="🔙 Konkurs menyusi", callback_data="admin_contest")])
+    
+    await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+
+@admin_router.callback_query(F.data.in_({"bp_apply", "bp_cancel"}))
+async def callback_apply_bulk_points(callback: CallbackQuery):
+    """Apply or drop the previewed point changes"""
+    await callback.answer()
+    
+    pending = pending_point_batches.pop(callback.from_user.id, None)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Konkurs menyusi", callback_data="admin_contest")]
+    ])
+    if callback.data == "bp_cancel" or pending is None:
+        text = "❌ Bekor qilindi." if pending else "❌ Kutilayotgan fayl yo'q. Faylni qayta yuboring."
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        return
+    
+    batch_id, changes = pending
+    loop = asyncio.get_running_loop()
+    changed = await loop.run_in_executor(None, db.apply_point_changes, changes, batch_id, False)
+    batch = db.get_point_batch(batch_id)
+    if changed:
+        text = f"✅ Ballar qo'llandi: {changed} foydalanuvchi, jami {batch['total']:+d} ball."
+    elif batch:
+        text = f"ℹ️ Bu fayl {batch['applied_at'][:16]} da allaqachon qo'llangan."
+    else:
+        text = "❌ Ballarni qo'llashda xatolik yuz berdi."
+    await callback.message.edit_text(text, reply_markup=keyboard)
 
 @admin_router.callback_query(F.data == "contest_stats")
 async def callback_contest_stats(callback: CallbackQuery):
     """Show contest statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    contest_stats = stats_manager.get_contest_statistics()
+    contest_stats = await stats_manager.get_contest_statistics()
     
     text = f"📊 **KONKURS STATISTIKASI**\n\n"
     text += f"👥 Jami ishtirokchilar: {contest_stats['total_participants']}\n"
@@ -818,18 +1217,376 @@ async def callback_message_single(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
     await state.set_state(AdminStates.single_message_target)
 
+@admin_router.callback_query(F.data == "broadcast_segment")
+async def callback_broadcast_segment(callback: CallbackQuery, state: FSMContext):
+    """Choose broadcast segment"""
+    await callback.answer()
+    
+    text = "🎯 **SEGMENT BO'YICHA YUBORISH**\n\n"
+    text += "Xabar qaysi foydalanuvchilarga yuborilsin?"
+    
+    keyboard = [
+        [InlineKeyboardButton(text=title, callback_data=f"segment_{key}")]
+        for key, (title, _) in SEGMENTS.items()
+    ]
+    keyboard.append([InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_messaging")])
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="Markdown")
+    await state.set_state(AdminStates.messaging)
+
+@admin_router.callback_query(F.data.in_({f"segment_{key}" for key in SEGMENTS}))
+async def callback_segment_choice(callback: CallbackQuery, state: FSMContext):
+    """Ask for segment parameter"""
+    await callback.answer()
+    
+    segment = callback.data[len("segment_"):]
+    title, prompt = SEGMENTS[segment]
+    
+    back_keyboard = [[InlineKeyboardButton(text="🔙 Orqaga", callback_data="broadcast_segment")]]
+    
+    if segment == 'not_subscribed':
+        subscriptions = db.get_mandatory_subscriptions()
+        if not subscriptions:
+            await callback.message.edit_text(
+                "❌ Hech qanday majburiy obuna yo'q",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=back_keyboard)
+            )
+            return
+        
+        keyboard = []
+        for sub in subscriptions:
+            channel_name = sub['channel_title'] or sub['channel_username'] or f"ID: {sub['channel_id']}"
+            keyboard.append([InlineKeyboardButton(text=f"📢 {channel_name}", callback_data=f"segch_{sub['id']}")])
+        keyboard += back_keyboard
+        
+        await callback.message.edit_text(
+            f"🎯 **{title}**\n\nKanalni tanlang:",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+            parse_mode="Markdown"
+        )
+        return
+    
+    await state.update_data(segment=segment)
+    await callback.message.edit_text(
+        f"🎯 **{title}**\n\n{prompt}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=back_keyboard),
+        parse_mode="Markdown"
+    )
+    await state.set_state(AdminStates.segment_value)
+
+async def show_segment_size(message: Message, admin_id: int, segment: str, value, edit: bool = False):
+    """Materialize segment and show its size before confirmation"""
+    description = describe_segment(segment, value)
+    user_ids = resolve_segment(segment, value)
+    pending_segments[admin_id] = (segment, value, description, user_ids)
+    
+    # Sent as HTML: channel ids like @my_channel break Markdown entities
+    text = f"🎯 <b>SEGMENT</b>\n\n"
+    text += f"📋 {html.escape(description)}\n"
+    text += f"👥 Foydalanuvchilar soni: {len(user_ids)}\n\n"
+    
+    if user_ids:
+        text += "Davom etilsinmi?"
+        keyboard = [[InlineKeyboardButton(text="✅ Davom etish", callback_data="segment_confirm"),
+                     InlineKeyboardButton(text="⏰ Rejalashtirish", callback_data="segment_schedule")],
+                    [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="broadcast_segment")]]
+    else:
+        text += "❌ Bu segmentda foydalanuvchi yo'q"
+        keyboard = [[InlineKeyboardButton(text="🔙 Orqaga", callback_data="broadcast_segment")]]
+    
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    if edit:
+        await message.edit_text(text, reply_markup=markup)
+    else:
+        await message.answer(text, reply_markup=markup)
+
+@admin_router.callback_query(F.data.startswith("segch_"))
+async def callback_segment_channel(callback: CallbackQuery, state: FSMContext):
+    """Materialize 'not subscribed to channel' segment"""
+    await callback.answer()
+    
+    sub_id = int(callback.data.split("_")[-1])
+    subscription = next((sub for sub in db.get_mandatory_subscriptions() if sub['id'] == sub_id), None)
+    
+    if not subscription:
+        await callback.message.edit_text("❌ Obuna topilmadi")
+        return
+    
+    await show_segment_size(callback.message, callback.from_user.id, 'not_subscribed', subscription['channel_id'], edit=True)
+    await state.set_state(AdminStates.messaging)
+
+@admin_router.message(AdminStates.segment_value)
+async def handle_segment_value(message: Message, state: FSMContext):
+    """Handle segment parameter input"""
+    data = await state.get_data()
+    segment = data.get('segment')
+    
+    try:
+        value = parse_segment_value(segment, message.text or "")
+    except ValueError:
+        await message.answer("❌ Noto'g'ri qiymat! Iltimos, qayta kiriting.")
+        return
+    
+    await show_segment_size(message, message.from_user.id, segment, value)
+    await state.set_state(AdminStates.messaging)
+
+@admin_router.callback_query(F.data == "segment_confirm")
+async def callback_segment_confirm(callback: CallbackQuery, state: FSMContext):
+    """Ask for the segment broadcast text"""
+    await callback.answer()
+    
+    if callback.from_user.id not in pending_segments:
+        await callback.message.edit_text("❌ Segment topilmadi. Qaytadan tanlang.")
+        return
+    
+    _, _, description, user_ids = pending_segments[callback.from_user.id]
+    
+    text = "📢 <b>SEGMENTGA XABAR YUBORISH</b>\n\n"
+    text += f"📋 {html.escape(description)}\n"
+    text += f"👥 Foydalanuvchilar soni: {len(user_ids)}\n\n"
+    text += "Yubormoqchi bo'lgan xabaringizni yozing:"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="broadcast_segment")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await state.set_state(AdminStates.segment_message)
+
+@admin_router.message(AdminStates.segment_message)
+async def handle_segment_message(message: Message, state: FSMContext, bot: Bot):
+    """Send broadcast to the materialized segment"""
+    pending = pending_segments.pop(message.from_user.id, None)
+    
+    if not pending:
+        await message.answer("❌ Segment topilmadi. Qaytadan tanlang.")
+        await state.set_state(AdminStates.main_panel)
+        return
+    
+    if not message.text:
+        pending_segments[message.from_user.id] = pending
+        await message.answer("❌ Faqat matnli xabar yuborish mumkin. Matn yuboring.")
+        return
+    
+    _, _, description, user_ids = pending
+    progress_msg = await message.answer(f"📤 Xabar yuborilmoqda...\n\n📋 {html.escape(description)}\n📊 Jami: {len(user_ids)}\n✅ Yuborildi: 0\n❌ Xatolik: 0")
+    
+    start_broadcast(bot, progress_msg, user_ids, message.text, description, message.from_user.id)
+    await state.set_state(AdminStates.main_panel)
+
+@admin_router.callback_query(F.data == "broadcast_watch")
+async def callback_broadcast_watch(callback: CallbackQuery):
+    """List broadcasts running in any worker"""
+    await callback.answer()
+    
+    text = "📡 <b>YUBORILAYOTGAN XABARLAR</b>\n\n"
+    keyboard = []
+    jobs = get_running_jobs()
+    
+    if jobs:
+        for job in jobs:
+            done = job['sent'] + job['failed']
+            text += f"#{job['id']} — {html.escape(job['description'] or '')}: {done}/{job['total']}\n"
+            keyboard.append([InlineKeyboardButton(text=f"👁 #{job['id']} kuzatish", callback_data=f"watch_{job['id']}"),
+                             InlineKeyboardButton(text=f"⏹ #{job['id']} to'xtatish", callback_data=f"bstop_{job['id']}")])
+    else:
+        text += "❌ Hozir yuborilayotgan xabar yo'q"
+    
+    keyboard.append([InlineKeyboardButton(text="🔄 Yangilash", callback_data="broadcast_watch")])
+    keyboard.append([InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_messaging")])
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+
+@admin_router.callback_query(F.data.startswith("watch_"))
+async def callback_watch_broadcast(callback: CallbackQuery):
+    """Follow a running broadcast: live edits from this worker, a snapshot from another one"""
+    await callback.answer()
+    
+    job_id = int(callback.data.split("_")[-1])
+    progress = active_broadcasts.get(job_id)
+    if progress:
+        await callback.message.edit_text(progress.render())
+        progress.add_watcher(callback.message)
+        return
+    
+    job = db.get_broadcast_job(job_id)
+    if not job or job['finished_at']:
+        await callback.message.edit_text("✅ Bu xabar yuborish allaqachon yakunlangan.")
+        return
+    
+    # Sent by another worker, which cannot edit this message; show its last saved progress
+    done = job['sent'] + job['failed']
+    text = f"📤 Xabar yuborilmoqda... (#{job_id})\n\n"
+    text += f"📋 {html.escape(job['description'] or '')}\n"
+    text += f"📊 Jami: {job['total']}\n"
+    text += f"✅ Yuborildi: {job['sent']}\n"
+    text += f"❌ Xatolik: {job['failed']}\n"
+    text += f"📈 Jarayon: {(done/max(job['total'], 1)*100):.1f}%\n"
+    if job['cancel_requested']:
+        text += "\n⏹ To'xtatish so'raldi"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Yangilash", callback_data=f"watch_{job_id}"),
+         InlineKeyboardButton(text="⏹ To'xtatish", callback_data=f"bstop_{job_id}")],
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="broadcast_watch")]
+    ])
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramAPIError:
+        pass  # Nothing changed since the last refresh
+
+@admin_router.callback_query(F.data.startswith("bstop_"))
+async def callback_stop_broadcast(callback: CallbackQuery):
+    """Ask the worker sending a broadcast to stop it"""
+    job_id = int(callback.data.split("_")[-1])
+    if db.request_broadcast_cancel(job_id):
+        await callback.answer(f"⏹ #{job_id} bir necha soniyada to'xtatiladi", show_alert=True)
+    else:
+        await callback.answer("✅ Bu xabar yuborish allaqachon yakunlangan.", show_alert=True)
+
+# Scheduled broadcast handlers
+@admin_router.callback_query(F.data == "scheduled_list")
+async def callback_scheduled_list(callback: CallbackQuery, state: FSMContext):
+    """Show scheduled broadcasts"""
+    await callback.answer()
+    
+    jobs = db.get_scheduled_broadcasts()
+    
+    text = "⏰ <b>REJALASHTIRILGAN XABARLAR</b>\n\n"
+    keyboard = []
+    
+    if jobs:
+        for job in jobs:
+            repeat = f"har {job['interval_hours']} soatda" if job['interval_hours'] else "bir marta"
+            preview = job['message_text'][:40].replace("\n", " ")
+            text += f"#{job['id']} — {job['run_at'][:16]} ({repeat})\n"
+            text += f"   📋 {html.escape(describe_segment(job['segment'], job['segment_value']))}\n"
+            text += f"   💬 {html.escape(preview)}\n\n"
+            keyboard.append([InlineKeyboardButton(text=f"🗑 #{job['id']} bekor qilish", callback_data=f"sched_cancel_{job['id']}")])
+    else:
+        text += "❌ Rejalashtirilgan xabarlar yo'q\n"
+    
+    keyboard.append([InlineKeyboardButton(text="➕ Hammaga rejalashtirish", callback_data="schedule_new")])
+    keyboard.append([InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_messaging")])
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    await state.set_state(AdminStates.messaging)
+
+@admin_router.callback_query(F.data.startswith("sched_cancel_"))
+async def callback_cancel_scheduled(callback: CallbackQuery):
+    """Cancel scheduled broadcast"""
+    await callback.answer()
+    
+    job_id = int(callback.data.split("_")[-1])
+    
+    if db.cancel_scheduled_broadcast(job_id):
+        text = f"✅ Rejalashtirilgan xabar #{job_id} bekor qilindi!"
+    else:
+        text = f"❌ Xabar #{job_id} ni bekor qilishda xatolik yuz berdi."
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="scheduled_list")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+@admin_router.callback_query(F.data.in_({"schedule_new", "segment_schedule"}))
+async def callback_schedule_new(callback: CallbackQuery, state: FSMContext):
+    """Start scheduling a broadcast for all users or the chosen segment"""
+    await callback.answer()
+    
+    if callback.data == "segment_schedule":
+        pending = pending_segments.pop(callback.from_user.id, None)
+        if not pending:
+            await callback.message.edit_text("❌ Segment topilmadi. Qaytadan tanlang.")
+            return
+        segment, value, description, _ = pending
+    else:
+        segment, value, description = 'all', None, describe_segment('all')
+    
+    await state.update_data(schedule_segment=segment, schedule_value=value)
+    
+    text = "⏰ <b>XABARNI REJALASHTIRISH</b>\n\n"
+    text += f"📋 {html.escape(description)}\n\n"
+    text += "Yubormoqchi bo'lgan xabaringizni yozing:"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="scheduled_list")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await state.set_state(AdminStates.schedule_text)
+
+@admin_router.message(AdminStates.schedule_text)
+async def handle_schedule_text(message: Message, state: FSMContext):
+    """Handle scheduled broadcast text"""
+    if not message.text:
+        await message.answer("❌ Faqat matnli xabar rejalashtirish mumkin. Matn yuboring.")
+        return
+    await state.update_data(schedule_text=message.text)
+    
+    text = "⏰ Yuborish vaqtini kiriting (YYYY-MM-DD HH:MM).\n"
+    text += "Takrorlash uchun oxiriga soatlar oralig'ini qo'shing.\n\n"
+    text += "Masalan: 2024-06-01 09:00\n"
+    text += "yoki har kuni: 2024-06-01 09:00 24"
+    
+    await message.answer(text)
+    await state.set_state(AdminStates.schedule_time)
+
+@admin_router.message(AdminStates.schedule_time)
+async def handle_schedule_time(message: Message, state: FSMContext):
+    """Store scheduled broadcast"""
+    try:
+        run_at, interval_hours = parse_schedule(message.text or "")
+    except ValueError:
+        await message.answer("❌ Noto'g'ri vaqt! Masalan: 2024-06-01 09:00 yoki 2024-06-01 09:00 24")
+        return
+    
+    data = await state.get_data()
+    job_id = db.add_scheduled_broadcast(
+        message_text=data['schedule_text'],
+        run_at=run_at.strftime('%Y-%m-%d %H:%M:%S'),
+        interval_hours=interval_hours,
+        segment=data.get('schedule_segment', 'all'),
+        segment_value=data.get('schedule_value'),
+        created_by=message.from_user.id
+    )
+    
+    text = f"✅ Xabar #{job_id} rejalashtirildi!\n\n"
+    text += f"📅 Vaqt: {run_at.strftime('%d.%m.%Y %H:%M')}\n"
+    if interval_hours:
+        text += f"🔁 Har {interval_hours} soatda takrorlanadi"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⏰ Rejalashtirilganlar", callback_data="scheduled_list"),
+         InlineKeyboardButton(text="🔙 Admin panel", callback_data="admin_panel")]
+    ])
+    
+    await message.answer(text, reply_markup=keyboard)
+    await state.set_state(AdminStates.main_panel)
+
 @admin_router.callback_query(F.data == "message_stats")
 async def callback_message_stats(callback: CallbackQuery):
     """Show message statistics"""
     await callback.answer()
     
-    stats_manager = StatsManager()
-    all_stats = stats_manager.get_all_time_stats()
+    all_stats = await stats_manager.get_dashboard()
     
     text = f"📊 **XABAR STATISTIKASI**\n\n"
     text += f"💬 Jami yuborilgan xabarlar: {all_stats['total_messages']}\n"
     text += f"👥 Jami foydalanuvchilar: {all_stats['total_users']}\n"
-    text += f"📈 O'rtacha: {all_stats['total_messages'] // max(all_stats['total_users'], 1)} xabar/foydalanuvchi\n"
+    text += f"📈 O'rtacha: {all_stats['total_messages'] // max(all_stats['total_users'], 1)} xabar/foydalanuvchi\n\n"
+    
+    metrics = outbound_dispatcher.get_metrics()
+    text += f"🚦 **Navbatlar (hozir / maksimal):**\n"
+    for lane_name, depth in metrics['queue_depth'].items():
+        text += f"  {lane_name}: {depth} / {metrics['max_queue_depth'][lane_name]} (yuborildi: {metrics['sent'][lane_name]})\n"
+    text += f"⏳ RetryAfter: {metrics['retry_after']} marta\n"
+    
+    throttling = throttling_middleware.get_metrics()
+    text += f"\n🛡 **Cheklangan so'rovlar:** {throttling['total']}\n"
+    for key, count in sorted(throttling['throttled'].items()):
+        text += f"  {key}: {count}\n"
+    text += f"👤 Kuzatilayotgan foydalanuvchilar: {throttling['tracked']}\n"
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_messaging")]
@@ -843,15 +1600,12 @@ async def callback_export_users(callback: CallbackQuery, bot: Bot):
     await callback.answer("📄 Excel fayl tayyorlanmoqda...")
     
     try:
-        stats_manager = StatsManager()
-        file_path = await stats_manager.export_users_to_excel()
-        
-        with open(file_path, 'rb') as file:
-            await bot.send_document(
-                callback.from_user.id,
-                document=file,
-                caption="📄 Foydalanuvchilar ro'yxati\n📅 Sanasi: " + datetime.now().strftime("%d.%m.%Y %H:%M")
-            )
+        await stats_manager.send_export(
+            bot,
+            callback.from_user.id,
+            'users',
+            caption="📄 Foydalanuvchilar ro'yxati\n📅 Sanasi: " + datetime.now().strftime("%d.%m.%Y %H:%M")
+        )
         
         await callback.message.answer("✅ Excel fayl muvaffaqiyatli yuborildi!")
         
@@ -859,6 +1613,89 @@ async def callback_export_users(callback: CallbackQuery, bot: Bot):
         print(f"Error exporting users: {e}")
         await callback.message.answer("❌ Excel fayl yaratishda xatolik yuz berdi.")
 
+@admin_router.callback_query(F.data == "import_users")
+async def callback_import_users(callback: CallbackQuery, state: FSMContext):
+    """Ask for a users file to import"""
+    await callback.answer()
+    
+    text = "📥 **FOYDALANUVCHILARNI IMPORT QILISH**\n\n"
+    text += "CSV yoki Excel (.xlsx) faylni yuboring. Birinchi qator - ustun nomlari:\n"
+    text += "`user_id`, `username`, `first_name`, `last_name`, `phone_number`, `registration_date`\n\n"
+    text += "• Faqat `user_id` majburiy\n"
+    text += "• Telefon raqamlar +998 formatida bo'lishi kerak\n"
+    text += "• Bazada bor foydalanuvchilar o'zgartirilmaydi\n"
+    text += f"• Fayl hajmi {IMPORT_MAX_FILE_MB} MB dan oshmasin"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="admin_users")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    await state.set_state(AdminStates.user_import)
+
+@admin_router.message(AdminStates.user_import, F.document)
+async def handle_user_import(message: Message, state: FSMContext, bot: Bot):
+    """Import users from an uploaded CSV or XLSX file"""
+    if not db.is_admin(message.from_user.id) and message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Sizda admin huquqlari yo'q!")
+        return
+    
+    document = message.document
+    extension = os.path.splitext(document.file_name or '')[1].lower()
+    if extension not in ('.csv', '.xlsx'):
+        await message.answer("❌ Faqat .csv yoki .xlsx fayl yuboring.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_MB * 1024 * 1024:
+        await message.answer(f"❌ Fayl juda katta. Maksimal hajm: {IMPORT_MAX_FILE_MB} MB.")
+        return
+    
+    await state.set_state(AdminStates.main_panel)
+    status = await message.answer("⏳ Fayl yuklanmoqda...")
+    fd, path = tempfile.mkstemp(suffix=extension)
+    os.close(fd)
+    loop = asyncio.get_running_loop()
+    last_update = 0.0
+    pending_edit = None
+    
+    def show_progress(totals: Dict):
+        # Runs in the import thread; edits are throttled to one per 3 seconds
+        nonlocal last_update, pending_edit
+        if time.monotonic() - last_update < 3:
+            return
+        last_update = time.monotonic()
+        text = f"⏳ Import qilinmoqda...\n\n📄 O'qilgan qatorlar: {totals['rows']}\n✅ Qo'shilgan: {totals['inserted']}"
+        pending_edit = asyncio.run_coroutine_threadsafe(status.edit_text(text), loop)
+    
+    try:
+        await bot.download(document, destination=path)
+        result = await loop.run_in_executor(None, import_users, path, IMPORT_BATCH_SIZE, show_progress)
+    except Exception as e:
+        print(f"Error importing users: {e}")
+        await status.edit_text(f"❌ Import qilishda xatolik: {html.escape(str(e))}")
+        return
+    finally:
+        os.remove(path)
+    
+    if pending_edit:
+        # Let the last progress edit land before the summary replaces it
+        await asyncio.gather(asyncio.wrap_future(pending_edit), return_exceptions=True)
+    
+    text = "✅ IMPORT YAKUNLANDI\n\n"
+    text += f"📄 Qatorlar: {result['rows']}\n"
+    text += f"➕ Yangi foydalanuvchilar: {result['inserted']}\n"
+    text += f"👤 Bazada bor edi: {result['existing']}\n"
+    text += f"🔁 Takroriy ID: {result['duplicates']}\n"
+    text += f"⚠️ Xato qatorlar: {result['invalid']}\n"
+    if result['errors']:
+        text += "\n"
+        for line, error in result['errors']:
+            text += f"• {line}-qator: {html.escape(error)}\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Foydalanuvchilar", callback_data="admin_users")]
+    ])
+    await status.edit_text(text, reply_markup=keyboard)
+
 @admin_router.callback_query(F.data == "reset_balances")
 async def callback_reset_balances(callback: CallbackQuery):
     """Reset all user balances"""
@@ -866,6 +1703,7 @@ async def callback_reset_balances(callback: CallbackQuery):
     
     text = "⚠️ **BALLARNI NOLLASH**\n\n"
     text += "Haqiqatan ham barcha foydalanuvchilarning ballarini nollamoqchimisiz?\n\n"
+    text += "📸 Joriy reyting mavsumlar tarixiga saqlanadi va yangi mavsum boshlanadi.\n"
     text += "❗️ Bu amal qaytarib bo'lmaydi!"
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -901,56 +1739,16 @@ async def callback_confirm_reset_balances(callback: CallbackQuery):
 async def handle_broadcast_message(message: Message, state: FSMContext, bot: Bot):
     """Handle broadcast message text"""
     text = message.text
+    if not text:
+        await message.answer("❌ Faqat matnli xabar yuborish mumkin. Matn yuboring.")
+        return
     
     # Get all users
-    all_users_data = db.get_users_for_export()
-    user_ids = [user['user_id'] for user in all_users_data]
-    
-    sent_count = 0
-    failed_count = 0
+    user_ids = resolve_segment('all')
     
     progress_msg = await message.answer(f"📤 Xabar yuborilmoqda...\n\n📊 Jami: {len(user_ids)}\n✅ Yuborildi: 0\n❌ Xatolik: 0")
     
-    # Send message to all users
-    for i, user_id in enumerate(user_ids):
-        try:
-            await bot.send_message(user_id, text)
-            sent_count += 1
-            
-            # Update progress every 50 messages
-            if (i + 1) % 50 == 0:
-                try:
-                    await progress_msg.edit_text(
-                        f"📤 Xabar yuborilmoqda...\n\n"
-                        f"📊 Jami: {len(user_ids)}\n"
-                        f"✅ Yuborildi: {sent_count}\n"
-                        f"❌ Xatolik: {failed_count}\n"
-                        f"📈 Jarayon: {((i+1)/len(user_ids)*100):.1f}%"
-                    )
-                except:
-                    pass
-            
-            # Small delay to avoid rate limiting
-            await asyncio.sleep(0.05)
-            
-        except Exception as e:
-            failed_count += 1
-            print(f"Failed to send message to {user_id}: {e}")
-    
-    # Final result
-    final_text = (
-        f"✅ **XABAR YUBORISH YAKUNLANDI**\n\n"
-        f"📊 Jami foydalanuvchilar: {len(user_ids)}\n"
-        f"✅ Muvaffaqiyatli yuborildi: {sent_count}\n"
-        f"❌ Xatolik: {failed_count}\n"
-        f"📈 Muvaffaqiyat: {(sent_count/len(user_ids)*100):.1f}%"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Admin panel", callback_data="admin_panel")]
-    ])
-    
-    await progress_msg.edit_text(final_text, reply_markup=keyboard, parse_mode="Markdown")
+    start_broadcast(bot, progress_msg, user_ids, text, describe_segment('all'), message.from_user.id)
     await state.set_state(AdminStates.main_panel)
 
 # Text editing handlers
@@ -0,0 +1,65 @@
+"""Compare FSM storage latency and memory: MemoryStorage vs SQLiteStorage.
+
+Run from the project root:
+
+    python -m benchmarks.fsm_storage --users 100000 --ops 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import SQLiteStorage
+
+BOT_ID = 42
+
+async def run(storage, users: int, ops: int):
+    """Simulate handler traffic: read state, read data, write state on a random user"""
+    latencies = []
+    for _ in range(ops):
+        user_id = random.randint(1, users)
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+        start = time.perf_counter()
+        await storage.get_state(key)
+        await storage.get_data(key)
+        await storage.set_state(key, 'UserStates:main_menu')
+        await storage.update_data(key, {'last': user_id})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def report(name: str, latencies, peak_memory: int):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print(f"{name:<16} p50 {p50:8.1f} us   p99 {p99:8.1f} us   peak memory {peak_memory / 1024 / 1024:8.1f} MB")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--cache-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    latencies = await run(MemoryStorage(), args.users, args.ops)
+    report('MemoryStorage', latencies, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracemalloc.start()
+        storage = SQLiteStorage(os.path.join(tmp, 'fsm.db'), cache_size=args.cache_size)
+        latencies = await run(storage, args.users, args.ops)
+        report('SQLiteStorage', latencies, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        await storage.close()
+
+if __name__ == '__main__':
+    asyncio.run(main())
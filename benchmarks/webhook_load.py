@@ -0,0 +1,130 @@
+"""Load harness for webhook mode: POST synthetic updates, report throughput and latency.
+
+Against a running bot (measures acknowledgement latency only):
+
+    python -m benchmarks.webhook_load --url http://127.0.0.1:8080/webhook --secret $WEBHOOK_SECRET
+
+Without --url an in-process webhook server with a no-op handler is started, and
+end-to-end latency (POST sent -> handler finished) is measured as well:
+
+    python -m benchmarks.webhook_load --updates 20000 --concurrency 100
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+LOCAL_PORT = 8099
+LOCAL_PATH = '/webhook'
+LOCAL_SECRET = 'benchmark-secret'
+
+_update_ids = itertools.count(1)
+
+def make_update(user_id: int, text: str) -> Dict:
+    """Synthetic private-chat message update"""
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Load'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+        }
+    }
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
+
+async def start_local_server(finished: Dict[int, float]) -> web.AppRunner:
+    """In-process webhook server whose handler only records completion time"""
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        finished[message.message_id] = time.perf_counter()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token='42:BENCHMARK')
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True,
+                         secret_token=LOCAL_SECRET).register(app, path=LOCAL_PATH)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', LOCAL_PORT).start()
+    return runner
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', help='Webhook URL of a running bot')
+    parser.add_argument('--secret', default='', help='X-Telegram-Bot-Api-Secret-Token value')
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--text', default="📊 Reyting")
+    args = parser.parse_args()
+
+    finished: Dict[int, float] = {}
+    runner: Optional[web.AppRunner] = None
+    url, secret = args.url, args.secret
+    if not url:
+        runner = await start_local_server(finished)
+        url, secret = f"http://127.0.0.1:{LOCAL_PORT}{LOCAL_PATH}", LOCAL_SECRET
+
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    updates = [make_update(i % args.users + 1, args.text) for i in range(args.updates)]
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    sent_at: Dict[int, float] = {}
+    ack_latencies: List[float] = []
+    errors = 0
+
+    async def worker(session: ClientSession):
+        nonlocal errors
+        while not queue.empty():
+            update = queue.get_nowait()
+            start = time.perf_counter()
+            sent_at[update['message']['message_id']] = start
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            ack_latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+
+    if runner:
+        # Wait for background handlers to drain
+        while len(finished) < len(updates) - errors and time.perf_counter() - started < 60:
+            await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    print(f"Updates: {len(updates)}  errors: {errors}  concurrency: {args.concurrency}")
+    print(f"Throughput: {len(updates) / elapsed:.0f} updates/s")
+    print(f"Ack latency   p50 {statistics.median(ack_latencies) * 1000:.2f} ms"
+          f"   p99 {percentile(ack_latencies, 0.99) * 1000:.2f} ms")
+
+    if runner:
+        e2e = [finished[message_id] - sent_at[message_id] for message_id in finished]
+        if e2e:
+            print(f"End-to-end    p50 {statistics.median(e2e) * 1000:.2f} ms"
+                  f"   p99 {percentile(e2e, 0.99) * 1000:.2f} ms")
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    asyncio.run(main())
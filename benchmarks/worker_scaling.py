@@ -0,0 +1,95 @@
+"""Throughput of sharded update processing for a growing number of worker processes.
+
+Each update runs the SQLite queries of a "📊 Reyting" click (profile, rank,
+top list) against a seeded database. Run from the project root:
+
+    python -m benchmarks.worker_scaling --updates 20000 --users 50000 --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from database import Database
+from workers import ShardRouter, serve_queue
+
+def seed(db_path: str, users: int):
+    db = Database(db_path)
+    rows = [(user_id, f'User {user_id}', '+998900000000', random.randint(0, 500)) for user_id in range(1, users + 1)]
+    with sqlite3.connect(db.db_path) as conn:
+        conn.executemany('INSERT INTO users (user_id, first_name, phone_number, balance) VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+
+def make_update(update_id: int, user_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': "📊 Reyting",
+        }
+    }
+
+def worker_main(db_path: str, worker_queue, done_queue):
+    db = Database(db_path)
+    handled = 0
+
+    async def handle(update: dict):
+        nonlocal handled
+        user_id = update['message']['from']['id']
+        db.get_user(user_id)
+        db.get_user_rank(user_id)
+        db.get_top_users(20)
+        handled += 1
+
+    asyncio.run(serve_queue(worker_queue, handle))
+    done_queue.put(handled)
+
+def run(db_path: str, workers: int, updates: list) -> float:
+    context = multiprocessing.get_context('fork')
+    queues = [context.Queue() for _ in range(workers)]
+    done_queue = context.Queue()
+    processes = [context.Process(target=worker_main, args=(db_path, q, done_queue)) for q in queues]
+    for process in processes:
+        process.start()
+
+    router = ShardRouter(queues)
+    started = time.perf_counter()
+    for update in updates:
+        router.route(update)
+    router.stop()
+    handled = sum(done_queue.get() for _ in processes)
+    elapsed = time.perf_counter() - started
+
+    for process in processes:
+        process.join()
+    assert handled == len(updates), f"{handled} of {len(updates)} updates handled"
+    return len(updates) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        seed(db_path, args.users)
+        updates = [make_update(i, random.randint(1, args.users)) for i in range(1, args.updates + 1)]
+
+        print(f"CPU cores: {os.cpu_count()}  updates: {args.updates}  users: {args.users}")
+        baseline = None
+        for workers in sorted(set(args.workers)):
+            throughput = run(db_path, workers, updates)
+            baseline = baseline or throughput
+            print(f"{workers:>3} workers   {throughput:8.0f} updates/s   x{throughput / baseline:.2f}")
+
+if __name__ == '__main__':
+    main()
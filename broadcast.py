@@ -0,0 +1,301 @@
+import asyncio
+import html
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+
+from database import db
+from config import (BROADCAST_DELAY, BROADCAST_MAX_DELAY, BROADCAST_BUSY_UPDATES_PER_SECOND,
+                    SCHEDULER_CHECK_INTERVAL, PROGRESS_UPDATE_INTERVAL, BROADCAST_STALE_AFTER)
+from middlewares import traffic_monitor
+from outbound import lane, LANE_ADMIN, LANE_BULK
+
+# Broadcast segments: key -> (button title, parameter prompt)
+SEGMENTS = {
+    'active': (
+        "🟢 Faol foydalanuvchilar",
+        "Oxirgi necha kun ichida faol bo'lganlarga yuborilsin?\n\nMasalan: 7"
+    ),
+    'registered': (
+        "📅 Ro'yxatdan o'tgan sana",
+        "Sana oralig'ini kiriting (YYYY-MM-DD YYYY-MM-DD):\n\nMasalan: 2024-01-01 2024-01-31"
+    ),
+    'balance': (
+        "💰 Ball bo'yicha",
+        "Balli qaysi qiymatdan yuqori bo'lganlarga yuborilsin?\n\nMasalan: 10"
+    ),
+    'top_referrers': (
+        "👆 Top referallar",
+        "Eng ko'p referal olib kelgan nechta foydalanuvchiga yuborilsin?\n\nMasalan: 50"
+    ),
+    'not_subscribed': (
+        "📢 Kanalga obuna bo'lmaganlar",
+        None  # Channel is chosen with buttons
+    ),
+}
+
+# Materialized segments waiting for admin confirmation: admin_id -> (segment, value, description, user_ids).
+# Kept per process: updates are sharded by user, so an admin's confirmation reaches the worker holding it.
+pending_segments: Dict[int, Tuple[str, object, str, List[int]]] = {}
+
+SCHEDULE_FORMAT = '%Y-%m-%d %H:%M'
+
+def parse_segment_value(segment: str, text: str):
+    """Parse admin input for a segment parameter, raise ValueError if invalid"""
+    text = text.strip()
+
+    if segment in ('active', 'balance', 'top_referrers'):
+        value = int(text)
+        if value < 0 or (segment != 'balance' and value == 0):
+            raise ValueError("Value must be positive")
+        return value
+
+    if segment == 'registered':
+        parts = text.split()
+        if len(parts) != 2:
+            raise ValueError("Two dates required")
+        for part in parts:
+            datetime.strptime(part, '%Y-%m-%d')
+        return parts[0], parts[1]
+
+    return text
+
+def describe_segment(segment: str, value=None) -> str:
+    """Human readable segment description"""
+    if segment == 'all':
+        return "Barcha foydalanuvchilar"
+    if segment == 'active':
+        return f"Oxirgi {value} kunda faol bo'lganlar"
+    if segment == 'registered':
+        return f"{value[0]} — {value[1]} oralig'ida ro'yxatdan o'tganlar"
+    if segment == 'balance':
+        return f"Balli {value} dan yuqori bo'lganlar"
+    if segment == 'top_referrers':
+        return f"Top {value} referal egalari"
+    if segment == 'not_subscribed':
+        return f"{value} kanaliga obuna bo'lmaganlar"
+    return segment
+
+def resolve_segment(segment: str, value=None) -> List[int]:
+    """Materialize segment into a list of user IDs"""
+    return db.get_segment_user_ids(segment, value)
+
+def parse_schedule(text: str) -> Tuple[datetime, int]:
+    """Parse 'YYYY-MM-DD HH:MM [interval_hours]', raise ValueError if invalid"""
+    parts = text.strip().split()
+    if len(parts) not in (2, 3):
+        raise ValueError("Expected date, time and optional interval")
+
+    run_at = datetime.strptime(f"{parts[0]} {parts[1]}", SCHEDULE_FORMAT)
+    interval_hours = int(parts[2]) if len(parts) == 3 else 0
+    if interval_hours < 0:
+        raise ValueError("Interval must not be negative")
+    if run_at < datetime.now() and not interval_hours:
+        raise ValueError("Time is in the past")
+    return run_at, interval_hours
+
+def broadcast_delay() -> float:
+    """Delay between bulk sends, growing with interactive traffic"""
+    rate = traffic_monitor.updates_per_second()
+    if rate <= BROADCAST_BUSY_UPDATES_PER_SECOND:
+        return BROADCAST_DELAY
+    return min(BROADCAST_DELAY * rate / BROADCAST_BUSY_UPDATES_PER_SECOND, BROADCAST_MAX_DELAY)
+
+class BroadcastProgress:
+    """Progress of one broadcast job, published to every watching admin.
+
+    Watcher messages can only be edited by the process sending the job, so
+    counters are also written to broadcast_jobs on every publish. Admins
+    served by other workers list and stop the job from there, and a stop
+    request is picked up on the next publish.
+    """
+
+    def __init__(self, job_id: int, description: str, total: int):
+        self.job_id = job_id
+        self.description = description
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.last_publish = 0.0
+        self.watchers: List[Message] = []
+        self.last_texts: Dict[Tuple[int, int], str] = {}
+        self.cancelled = False
+
+    def add_watcher(self, message: Message):
+        self.watchers.append(message)
+
+    def render(self) -> str:
+        """Progress text with throughput and ETA"""
+        done = self.sent + self.failed
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        rate = done / elapsed
+
+        text = f"📤 Xabar yuborilmoqda... (#{self.job_id})\n\n"
+        if self.description:
+            text += f"📋 {html.escape(self.description)}\n"
+        text += f"📊 Jami: {self.total}\n"
+        text += f"✅ Yuborildi: {self.sent}\n"
+        text += f"❌ Xatolik: {self.failed}\n"
+        text += f"📈 Jarayon: {(done/max(self.total, 1)*100):.1f}%\n"
+        text += f"⚡ Tezlik: {rate:.1f} xabar/s\n"
+        if rate > 0:
+            text += f"⏳ Qolgan vaqt: {format_duration((self.total - done) / rate)}"
+        return text
+
+    async def publish(self, text: str = None, reply_markup: InlineKeyboardMarkup = None,
+                      parse_mode: str = None, force: bool = False):
+        """Edit watcher messages at most every PROGRESS_UPDATE_INTERVAL seconds"""
+        now = time.monotonic()
+        if not force and now - self.last_publish < PROGRESS_UPDATE_INTERVAL:
+            return
+        self.last_publish = now
+
+        if not force:
+            try:
+                self.cancelled = db.update_broadcast_job(self.job_id, self.sent, self.failed)
+            except Exception as e:
+                print(f"Error saving broadcast progress: {e}")
+
+        text = text or self.render()
+        for message in list(self.watchers):
+            key = (message.chat.id, message.message_id)
+            if self.last_texts.get(key) == text:
+                continue
+            try:
+                with lane(LANE_ADMIN):
+                    await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+                self.last_texts[key] = text
+            except Exception as e:
+                print(f"Error updating broadcast progress: {e}")
+
+# Broadcasts sent by this process: job_id -> progress
+active_broadcasts: Dict[int, BroadcastProgress] = {}
+
+# Detached broadcast tasks, referenced until they finish
+broadcast_tasks = set()
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as 'X soat Y daq Z s'"""
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours} soat {minutes} daq"
+    if minutes:
+        return f"{minutes} daq {seconds} s"
+    return f"{seconds} s"
+
+async def run_broadcast(bot: Bot, progress_msg: Message, user_ids: List[int], text: str,
+                        description: str = "", created_by: int = None) -> Tuple[int, int]:
+    """Send text to the given users, reporting progress to progress_msg and other watchers"""
+    job_id = db.create_broadcast_job(description, len(user_ids), created_by)
+    progress = BroadcastProgress(job_id, description, len(user_ids))
+    progress.add_watcher(progress_msg)
+    active_broadcasts[progress.job_id] = progress
+
+    try:
+        # Send message to all users
+        for user_id in user_ids:
+            if progress.cancelled:
+                break
+            try:
+                with lane(LANE_BULK):
+                    await bot.send_message(user_id, text)
+                progress.sent += 1
+            except Exception as e:
+                progress.failed += 1
+                print(f"Failed to send message to {user_id}: {e}")
+
+            await progress.publish()
+
+            # Delay to avoid rate limiting, longer while users are active
+            await asyncio.sleep(broadcast_delay())
+    finally:
+        del active_broadcasts[progress.job_id]
+        db.finish_broadcast_job(progress.job_id, progress.sent, progress.failed)
+
+    # Final result
+    heading = "⏹ <b>XABAR YUBORISH TO'XTATILDI</b>" if progress.cancelled else "✅ <b>XABAR YUBORISH YAKUNLANDI</b>"
+    final_text = (
+        f"{heading} (#{progress.job_id})\n\n"
+        f"📊 Jami foydalanuvchilar: {progress.total}\n"
+        f"✅ Muvaffaqiyatli yuborildi: {progress.sent}\n"
+        f"❌ Xatolik: {progress.failed}\n"
+        f"📈 Muvaffaqiyat: {(progress.sent/max(progress.total, 1)*100):.1f}%\n"
+        f"⏱ Davomiyligi: {format_duration(time.monotonic() - progress.started)}"
+    )
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Admin panel", callback_data="admin_panel")]
+    ])
+
+    await progress.publish(final_text, reply_markup=keyboard, force=True)
+    return progress.sent, progress.failed
+
+def start_broadcast(bot: Bot, progress_msg: Message, user_ids: List[int], text: str,
+                    description: str = "", created_by: int = None) -> asyncio.Task:
+    """Run a broadcast in the background, so the admin's later updates are not queued behind it"""
+    async def run():
+        try:
+            await run_broadcast(bot, progress_msg, user_ids, text, description, created_by)
+        except Exception as e:
+            print(f"Error in broadcast: {e}")
+
+    task = asyncio.create_task(run())
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_tasks.discard)
+    return task
+
+def get_running_jobs() -> List[Dict]:
+    """Broadcasts running in any worker process"""
+    return db.get_running_broadcast_jobs(BROADCAST_STALE_AFTER)
+
+def next_run_time(run_at: datetime, interval_hours: int) -> Optional[datetime]:
+    """Next run of a recurring broadcast strictly in the future"""
+    if not interval_hours:
+        return None
+    step = timedelta(hours=interval_hours)
+    now = datetime.now()
+    while run_at <= now:
+        run_at += step
+    return run_at
+
+async def run_scheduled_broadcast(bot: Bot, job: Dict):
+    """Execute one due scheduled broadcast"""
+    run_at = datetime.strptime(job['run_at'], '%Y-%m-%d %H:%M:%S')
+    next_run = next_run_time(run_at, job['interval_hours'])
+
+    # Persist the next run first so a crash mid-send never repeats the job
+    db.mark_scheduled_broadcast_run(
+        job['id'],
+        next_run.strftime('%Y-%m-%d %H:%M:%S') if next_run else None
+    )
+
+    user_ids = resolve_segment(job['segment'], job['segment_value'])
+    description = describe_segment(job['segment'], job['segment_value'])
+
+    with lane(LANE_ADMIN):
+        progress_msg = await bot.send_message(
+            job['created_by'],
+            f"⏰ Rejalashtirilgan xabar #{job['id']} yuborilmoqda...\n\n📋 {html.escape(description)}\n📊 Jami: {len(user_ids)}"
+        )
+    await run_broadcast(bot, progress_msg, user_ids, job['message_text'], description, job['created_by'])
+
+async def broadcast_scheduler(bot: Bot):
+    """Background loop running due scheduled broadcasts one at a time"""
+    while True:
+        try:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for job in db.get_scheduled_broadcasts(due_before=now):
+                try:
+                    await run_scheduled_broadcast(bot, job)
+                except Exception as e:
+                    print(f"Error running scheduled broadcast {job['id']}: {e}")
+        except Exception as e:
+            print(f"Error in broadcast scheduler: {e}")
+
+        await asyncio.sleep(SCHEDULER_CHECK_INTERVAL)
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import BufferedInputFile
+
+from cache import LRUCache
+from config import CHART_CACHE_SIZE
+
+def render_growth_png(dynamics: List[Dict], title: str) -> bytes:
+    """Draw new, active and cumulative users per bucket; runs in the chart process"""
+    # Imported here so matplotlib is only loaded in the chart process
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    dates = [row['date'] for row in dynamics]
+    positions = range(len(dates))
+    figure, (daily, total) = plt.subplots(2, 1, figsize=(9, 6), dpi=110, sharex=True,
+                                          gridspec_kw={'height_ratios': [3, 2]})
+
+    daily.bar(positions, [row['new_users'] for row in dynamics], color='#4c9be8', label="Yangi")
+    daily.plot(positions, [row['active_users'] for row in dynamics], color='#f28e2b', marker='o', label="Faol")
+    daily.set_title(title)
+    daily.legend(loc='upper left')
+    daily.grid(axis='y', alpha=0.3)
+
+    cumulative = [row['cumulative_users'] for row in dynamics]
+    total.plot(positions, cumulative, color='#59a14f', label="Jami o'sish")
+    total.fill_between(positions, cumulative, color='#59a14f', alpha=0.2)
+    total.legend(loc='upper left')
+    total.grid(axis='y', alpha=0.3)
+
+    # At most ~10 date labels
+    step = max(1, len(dates) // 10)
+    total.set_xticks(list(positions)[::step])
+    total.set_xticklabels(dates[::step], rotation=45, ha='right')
+
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    plt.close(figure)
+    return buffer.getvalue()
+
+class ChartRenderer:
+    """Growth charts rendered in a separate process and cached.
+
+    The cache key is the date range plus a hash of the plotted values, so
+    any change in the data gives a new key. Rendered PNGs are kept, and so
+    is the Telegram file_id of each sent chart: opening the same chart again
+    resends the file_id without rendering or uploading.
+    """
+
+    def __init__(self, cache_size: int = CHART_CACHE_SIZE):
+        self.images = LRUCache(cache_size)
+        self.file_ids = LRUCache(cache_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned, not forked: the bot process runs an event loop and threads
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    @staticmethod
+    def cache_key(name: str, dynamics: List[Dict]) -> str:
+        values = [(row['date'], row['new_users'], row['active_users'], row['cumulative_users']) for row in dynamics]
+        version = hashlib.sha1(repr(values).encode()).hexdigest()[:16]
+        return f"{name}:{dynamics[0]['date']}:{dynamics[-1]['date']}:{version}"
+
+    async def growth_png(self, dynamics: List[Dict], title: str) -> bytes:
+        key = self.cache_key('growth', dynamics)
+        png = self.images.get(key)
+        if png is None:
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(self._pool(), render_growth_png, dynamics, title)
+            self.images.set(key, png)
+        return png
+
+    async def send_growth_chart(self, bot: Bot, chat_id: int, dynamics: List[Dict], title: str,
+                                caption: Optional[str] = None):
+        """Send the chart, reusing the file_id of an earlier upload of the same data"""
+        key = self.cache_key('growth', dynamics)
+        file_id = self.file_ids.get(key)
+        if file_id:
+            try:
+                await bot.send_photo(chat_id, file_id, caption=caption)
+                return
+            except TelegramAPIError:
+                self.file_ids.pop(key)  # Expired on Telegram's side, upload again
+
+        png = await self.growth_png(dynamics, title)
+        message = await bot.send_photo(chat_id, BufferedInputFile(png, filename='growth.png'), caption=caption)
+        self.file_ids.set(key, message.photo[-1].file_id)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Global chart renderer instance
+chart_renderer = ChartRenderer()
@@ -1,9 +1,22 @@
 import os
+import secrets
 from typing import List
 
 # Bot Configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 
+# Webhook Configuration (long polling is used when disabled)
+USE_WEBHOOK = os.getenv('USE_WEBHOOK', 'false').lower() == 'true'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Checked on every webhook request; without one a random secret is generated per start and sent to set_webhook
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+
+# Update processing: with more than one worker, updates are sharded by user_id across processes
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '1'))
+
 # Admin Configuration
 ADMIN_IDS: List[int] = [
     5997189940,  # Main admin
@@ -12,6 +25,10 @@ ADMIN_IDS: List[int] = [
 # Database Configuration
 DATABASE_PATH = 'bot_database.db'
 
+# FSM storage settings
+FSM_CACHE_SIZE = 10000  # FSM records kept in memory
+FSM_FLUSH_INTERVAL = 2  # seconds between batched writes of changed records
+
 # Bot Messages
 MESSAGES = {
     'start_welcome': """👋 Salom! Konkursga xush kelibsiz!
@@ -107,23 +124,89 @@ DEFAULT_TEXTS = {
 ⚠️ Qoidabuzarlik aniqlansa, diskvalifikatsiya qilinadi."""
 }
 
+# Accepted phone numbers: Uzbekistan only
+PHONE_PATTERN = r'^\+998\d{9}$'
+
 # Registration bonus
 REGISTRATION_BONUS = 2
 REFERRAL_BONUS = 2
 
+# Points ledger reasons and how they are shown to users
+POINT_REASONS = {
+    'registration': "Ro'yxatdan o'tish bonusi",
+    'referral': "Referal bonusi",
+    'admin_adjustment': "Admin tuzatishi",
+    'opening_balance': "Boshlang'ich ball",
+}
+
 # Subscription check settings
 CHECK_SUBSCRIPTIONS = True
 SUBSCRIPTION_CHECK_INTERVAL = 300  # 5 minutes
 
 # Rate limiting
-MAX_MESSAGES_PER_MINUTE = 30
+MAX_MESSAGES_PER_MINUTE = 30  # default per-user budget for incoming messages and callbacks
+THROTTLE_DEFAULT_BURST = 5
+THROTTLE_CACHE_SIZE = 100000  # users with throttling state kept in memory
+THROTTLE_STATE_TTL = 60  # seconds of inactivity before a user's buckets are forgotten
+THROTTLE_ADMIN_CACHE_TTL = 60  # seconds; admin changes made in other worker processes show up after this
+
+# Rendered referral link texts kept per user
+REFERRAL_TEXT_CACHE_SIZE = 10000
+REFERRAL_TEXT_TTL = 300  # seconds, bounds staleness across worker processes
+
+# Broadcast settings
+BROADCAST_DELAY = 0.05  # Delay between bulk sends when the bot is quiet
+BROADCAST_MAX_DELAY = 1.0  # Upper bound for the adaptive delay
+BROADCAST_BUSY_UPDATES_PER_SECOND = 5  # Interactive traffic above this slows bulk sends down
+TRAFFIC_WINDOW_SECONDS = 10
+SCHEDULER_CHECK_INTERVAL = 30  # seconds
+PROGRESS_UPDATE_INTERVAL = 5  # seconds between broadcast progress edits
+BROADCAST_STALE_AFTER = 300  # seconds without progress before a running job is treated as dead
+
+# Outbound Bot API limits
+OUTBOUND_GLOBAL_RATE = 30  # messages per second across all chats
+OUTBOUND_GLOBAL_BURST = 30
+OUTBOUND_CHAT_RATE = 1  # messages per second in a private chat
+OUTBOUND_GROUP_RATE = 20 / 60  # messages per second in a group or channel
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_MAX_RETRIES = 3  # RetryAfter retries before giving up
 
 # Excel export settings
 EXCEL_MAX_ROWS = 100000
+EXPORT_DIR = 'exports'
+EXPORT_MAX_AGE_DAYS = 7  # older export files are deleted
+EXPORT_MAX_TOTAL_MB = 200  # oldest export files are deleted above this total
+EXPORT_STATS_MAX_AGE = 600  # seconds; the statistics export also has rolling "active in the last N days" counts
+
+# Bulk user import settings
+IMPORT_BATCH_SIZE = 50000  # rows per executemany transaction
+IMPORT_MAX_FILE_MB = 20  # largest file the Bot API lets a bot download
 
 # Pagination settings
 USERS_PER_PAGE = 20
 RATING_TOP_COUNT = 20
+LEADERBOARD_TTL = 10  # seconds, bounds staleness of balance changes made in other processes
+DASHBOARD_TTL = 5  # seconds an admin dashboard snapshot is served before a background refresh
+
+# Time-series statistics settings
+STATS_FLUSH_INTERVAL = 60  # seconds between writes of in-process event counters
+STATS_HOURLY_RETENTION_DAYS = 14
+STATS_DAILY_RETENTION_DAYS = 730  # monthly rows are kept forever
+TIMESERIES_MAX_POINTS = 200  # finest resolution with at most this many buckets is used
+
+# Activity event log settings
+EVENT_LOG_DIR = 'events'  # one SQLite file per day
+EVENT_LOG_FLUSH_INTERVAL = 5  # seconds
+EVENT_LOG_BATCH_SIZE = 1000  # buffered events that trigger an immediate write
+EVENT_LOG_RETENTION_DAYS = 90
+
+# Growth chart settings
+CHART_CACHE_SIZE = 32  # rendered images and Telegram file_ids kept
+GROWTH_CHART_DAYS = 30
+
+# Funnel and cohort report settings
+COHORT_WEEKS = 8  # retention columns, weeks after registration
+COHORT_SCREEN_ROWS = 8  # latest cohorts shown in the admin panel
 
 # Channel subscription messages
 SUBSCRIPTION_MESSAGES = {
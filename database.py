@@ -1,13 +1,37 @@
 import sqlite3
 import asyncio
-from typing import List, Dict, Optional, Tuple
+import json
+from typing import Callable, List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 import threading
 
+from hyperloglog import HyperLogLog
+
+# Additive counters of the time-series tables
+TIMESERIES_COUNTERS = ('updates', 'messages', 'callbacks', 'new_users', 'referrals')
+
+# Resolution -> (table, bucket column, active users column)
+TIMESERIES_TABLES = {
+    'hour': ('stats_hourly', 'hour', 'active_users'),
+    'day': ('stats_daily', 'day', 'active_users'),
+    'month': ('stats_monthly', 'month', 'peak_daily_active'),
+}
+
+# Table -> data_versions row bumped on every write to it
+DATA_VERSION_TABLES = {
+    'users': 'users',
+    'referrals': 'referrals',
+    'bot_statistics': 'statistics',
+}
+
 class Database:
     def __init__(self, db_path: str = 'bot_database.db'):
         self.db_path = db_path
         self.lock = threading.Lock()
+        # Called with {user_id: new_balance}, or None when any balance may have changed
+        self.balance_listeners: List[Callable[[Optional[Dict[int, int]]], None]] = []
+        # Called after an admin is added or removed
+        self.admin_listeners: List[Callable[[], None]] = []
         self.init_db()
 
     def init_db(self):
@@ -15,6 +39,9 @@ class Database:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             
+            # Let worker processes read while another one writes
+            cursor.execute('PRAGMA journal_mode=WAL')
+            
             # Users table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -27,10 +54,28 @@ class Database:
                     referrer_id INTEGER,
                     registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     is_active BOOLEAN DEFAULT TRUE,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    referral_count INTEGER DEFAULT 0,
+                    subscribed_at TIMESTAMP
                 )
             ''')
             
+            # Columns added after the first release
+            cursor.execute('PRAGMA table_info(users)')
+            user_columns = {row[1] for row in cursor.fetchall()}
+            if 'referral_count' not in user_columns:
+                cursor.execute('ALTER TABLE users ADD COLUMN referral_count INTEGER DEFAULT 0')
+                cursor.execute('''
+                    UPDATE users SET referral_count = (
+                        SELECT COUNT(*) FROM referrals WHERE referrer_id = users.user_id
+                    )
+                    WHERE user_id IN (SELECT referrer_id FROM referrals)
+                ''')
+            if 'subscribed_at' not in user_columns:
+                # Registered users passed the subscription check, at the latest when they registered
+                cursor.execute('ALTER TABLE users ADD COLUMN subscribed_at TIMESTAMP')
+                cursor.execute('UPDATE users SET subscribed_at = registration_date WHERE phone_number IS NOT NULL')
+            
             # Admins table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS admins (
@@ -111,7 +156,228 @@ class Database:
                     referrals_made INTEGER DEFAULT 0
                 )
             ''')
-            
+
+            # Time-series statistics: hourly counters rolled up into days and months
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_hourly (
+                    hour TEXT PRIMARY KEY,
+                    updates INTEGER DEFAULT 0,
+                    messages INTEGER DEFAULT 0,
+                    callbacks INTEGER DEFAULT 0,
+                    new_users INTEGER DEFAULT 0,
+                    referrals INTEGER DEFAULT 0,
+                    active_users INTEGER DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    day TEXT PRIMARY KEY,
+                    updates INTEGER DEFAULT 0,
+                    messages INTEGER DEFAULT 0,
+                    callbacks INTEGER DEFAULT 0,
+                    new_users INTEGER DEFAULT 0,
+                    referrals INTEGER DEFAULT 0,
+                    active_users INTEGER DEFAULT 0,
+                    peak_hourly_active INTEGER DEFAULT 0,
+                    active_sketch BLOB
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_monthly (
+                    month TEXT PRIMARY KEY,
+                    updates INTEGER DEFAULT 0,
+                    messages INTEGER DEFAULT 0,
+                    callbacks INTEGER DEFAULT 0,
+                    new_users INTEGER DEFAULT 0,
+                    referrals INTEGER DEFAULT 0,
+                    peak_daily_active INTEGER DEFAULT 0
+                )
+            ''')
+            # History kept in bot_statistics before the time-series tables existed
+            cursor.execute('SELECT 1 FROM stats_daily LIMIT 1')
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    INSERT INTO stats_daily (day, messages, new_users, referrals, active_users, peak_hourly_active)
+                    SELECT date, messages_sent, new_users, referrals_made, active_users, active_users
+                    FROM bot_statistics
+                ''')
+            cursor.execute('SELECT 1 FROM stats_monthly LIMIT 1')
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    INSERT INTO stats_monthly (month, messages, new_users, referrals, peak_daily_active)
+                    SELECT substr(date, 1, 7), SUM(messages_sent), SUM(new_users), SUM(referrals_made), MAX(active_users)
+                    FROM bot_statistics GROUP BY 1
+                ''')
+
+            # Scheduled broadcasts table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_text TEXT NOT NULL,
+                    segment TEXT DEFAULT 'all',
+                    segment_value TEXT,
+                    run_at TIMESTAMP NOT NULL,
+                    interval_hours INTEGER DEFAULT 0,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    last_run TIMESTAMP,
+                    created_by INTEGER,
+                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_broadcasts_due ON scheduled_broadcasts (is_active, run_at)')
+
+            # Running and finished broadcasts, visible to every worker process
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    description TEXT,
+                    total INTEGER DEFAULT 0,
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    created_by INTEGER,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    cancel_requested BOOLEAN DEFAULT FALSE
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_running ON broadcast_jobs (finished_at)')
+
+            # Indexes for broadcast segments and leaderboard queries
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance DESC, registration_date ASC)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_registration_date ON users (registration_date)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id)')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_referral_count ON users (referral_count DESC)
+                WHERE referral_count > 0
+            ''')
+
+            # Active users per balance, kept in sync by triggers, so a rank is a sum over
+            # distinct balances instead of a count over users
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_histogram'")
+            histogram_exists = cursor.fetchone() is not None
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS balance_histogram (
+                    balance INTEGER PRIMARY KEY,
+                    users INTEGER NOT NULL
+                )
+            ''')
+            if not histogram_exists:
+                cursor.execute('''
+                    INSERT INTO balance_histogram (balance, users)
+                    SELECT balance, COUNT(*) FROM users WHERE is_active = TRUE GROUP BY balance
+                ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_balance_histogram_insert AFTER INSERT ON users
+                WHEN NEW.is_active
+                BEGIN
+                    INSERT INTO balance_histogram (balance, users) VALUES (NEW.balance, 1)
+                    ON CONFLICT (balance) DO UPDATE SET users = users + 1;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_balance_histogram_delete AFTER DELETE ON users
+                WHEN OLD.is_active
+                BEGIN
+                    UPDATE balance_histogram SET users = users - 1 WHERE balance = OLD.balance;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_balance_histogram_update AFTER UPDATE OF balance, is_active ON users
+                WHEN OLD.balance IS NOT NEW.balance OR OLD.is_active IS NOT NEW.is_active
+                BEGIN
+                    UPDATE balance_histogram SET users = users - 1 WHERE OLD.is_active AND balance = OLD.balance;
+                    INSERT INTO balance_histogram (balance, users) SELECT NEW.balance, 1 WHERE NEW.is_active
+                    ON CONFLICT (balance) DO UPDATE SET users = users + 1;
+                END
+            ''')
+
+            # Contest seasons and their final leaderboards
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS contest_seasons (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    ended_at TIMESTAMP,
+                    participants INTEGER DEFAULT 0,
+                    total_points INTEGER DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS season_results (
+                    season_id INTEGER,
+                    rank INTEGER,
+                    user_id INTEGER,
+                    first_name TEXT,
+                    last_name TEXT,
+                    username TEXT,
+                    balance INTEGER,
+                    PRIMARY KEY (season_id, rank)
+                ) WITHOUT ROWID
+            ''')
+
+            # Append-only points ledger; users.balance is the sum of the current season's entries
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'point_transactions'")
+            ledger_exists = cursor.fetchone() is not None
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS point_transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    season_id INTEGER,
+                    amount INTEGER NOT NULL,
+                    reason TEXT NOT NULL,
+                    batch_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_point_transactions_user ON point_transactions (user_id, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_point_transactions_season ON point_transactions (season_id)')
+
+            # Applied point batches, so the same batch is never applied twice
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS point_batches (
+                    batch_id TEXT PRIMARY KEY,
+                    changes INTEGER NOT NULL,
+                    total INTEGER NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            if not ledger_exists:
+                # Balances collected before the ledger existed
+                cursor.execute('''
+                    INSERT INTO point_transactions (user_id, season_id, amount, reason)
+                    SELECT user_id, (SELECT MAX(id) FROM contest_seasons), balance, 'opening_balance'
+                    FROM users WHERE balance <> 0
+                ''')
+
+            # Write counters per group of tables, bumped by triggers in the writing transaction
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            for table, group in DATA_VERSION_TABLES.items():
+                cursor.execute('INSERT OR IGNORE INTO data_versions (name) VALUES (?)', (group,))
+                for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                    cursor.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{operation.lower()} AFTER {operation} ON {table}
+                        BEGIN
+                            UPDATE data_versions SET version = version + 1 WHERE name = '{group}';
+                        END
+                    ''')
+
+            # Latest generated file of each export and the data version it was built from
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS export_cache (
+                    kind TEXT PRIMARY KEY,
+                    data_version TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
             conn.commit()
 
     def execute_query(self, query: str, params: tuple = ()) -> List[tuple]:
@@ -150,34 +416,169 @@ class Database:
                 (user_id, username, first_name, last_name, phone_number, referrer_id, balance)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             '''
-            params = (user_id, username, first_name, last_name, phone_number, referrer_id, 2)
+            params = (user_id, username, first_name, last_name, phone_number, referrer_id, 0)
             return self.execute_insert(query, params) > 0
         except:
             return False
 
+    def import_users(self, rows: List[tuple]) -> int:
+        """Insert a batch of (user_id, username, first_name, last_name, phone_number, registration_date)
+        in one transaction and return how many were new; existing users are left untouched"""
+        query = '''
+            INSERT OR IGNORE INTO users
+            (user_id, username, first_name, last_name, phone_number, balance,
+             registration_date, last_activity, subscribed_at)
+            VALUES (?1, ?2, ?3, ?4, ?5, 0,
+                    COALESCE(?6, CURRENT_TIMESTAMP), COALESCE(?6, CURRENT_TIMESTAMP),
+                    CASE WHEN ?5 IS NOT NULL THEN COALESCE(?6, CURRENT_TIMESTAMP) END)
+        '''
+        with self.lock:
+            with sqlite3.connect(self.db_path, timeout=30) as conn:
+                cursor = conn.executemany(query, rows)
+                conn.commit()
+                return cursor.rowcount
+
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
         query = '''
             SELECT user_id, username, first_name, last_name, phone_number, 
-                   balance, referrer_id, registration_date, is_active, last_activity
+                   balance, referrer_id, registration_date, is_active, last_activity, subscribed_at
             FROM users WHERE user_id = ?
         '''
         result = self.execute_query(query, (user_id,))
         if result:
             columns = ['user_id', 'username', 'first_name', 'last_name', 'phone_number', 
-                      'balance', 'referrer_id', 'registration_date', 'is_active', 'last_activity']
+                      'balance', 'referrer_id', 'registration_date', 'is_active', 'last_activity', 'subscribed_at']
             return dict(zip(columns, result[0]))
         return None
 
+    def get_user_names(self, user_ids: List[int]) -> Dict[int, str]:
+        """First name, else username, of the given users in one query; users with neither are left out"""
+        if not user_ids:
+            return {}
+        query = f'''
+            SELECT user_id, COALESCE(NULLIF(first_name, ''), username) FROM users
+            WHERE user_id IN ({",".join("?" * len(user_ids))})
+        '''
+        return {user_id: name for user_id, name in self.execute_query(query, tuple(user_ids)) if name}
+
+    def mark_subscribed(self, user_id: int) -> bool:
+        """Remember when the user first passed the subscription check"""
+        query = 'UPDATE users SET subscribed_at = CURRENT_TIMESTAMP WHERE user_id = ? AND subscribed_at IS NULL'
+        return self.execute_update(query, (user_id,)) > 0
+
     def update_user_phone(self, user_id: int, phone_number: str) -> bool:
         """Update user phone number"""
         query = 'UPDATE users SET phone_number = ?, last_activity = CURRENT_TIMESTAMP WHERE user_id = ?'
         return self.execute_update(query, (phone_number, user_id)) > 0
 
-    def add_balance(self, user_id: int, amount: int) -> bool:
+    def add_balance(self, user_id: int, amount: int, reason: str = 'admin_adjustment') -> bool:
         """Add balance to user"""
-        query = 'UPDATE users SET balance = balance + ?, last_activity = CURRENT_TIMESTAMP WHERE user_id = ?'
-        return self.execute_update(query, (amount, user_id)) > 0
+        return self.apply_point_changes([(user_id, amount, reason)]) > 0
+
+    def apply_point_changes(self, changes: List[Tuple[int, int, str]], batch_id: str = None,
+                            touch_activity: bool = True) -> int:
+        """Record (user_id, amount, reason) changes in the ledger and apply them to balances.
+
+        Everything is written in one transaction: the ledger rows with one
+        executemany, then one balance update per user. Changes for unknown
+        users are skipped. With a batch_id the batch is recorded in
+        point_batches in the same transaction, and a batch that was applied
+        before changes nothing. Admin bulk adjustments pass touch_activity=False
+        so crediting a user does not count as the user being active. Returns
+        the number of users whose balance changed.
+        """
+        if not changes:
+            return 0
+        try:
+            with self.lock:
+                with sqlite3.connect(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    user_ids = list({user_id for user_id, _, _ in changes})
+                    existing = set()
+                    for i in range(0, len(user_ids), 500):
+                        chunk = user_ids[i:i + 500]
+                        cursor.execute(
+                            f'SELECT user_id FROM users WHERE user_id IN ({",".join("?" * len(chunk))})', chunk
+                        )
+                        existing.update(row[0] for row in cursor.fetchall())
+                    changes = [change for change in changes if change[0] in existing]
+                    if not changes:
+                        return 0
+
+                    if batch_id is not None:
+                        cursor.execute(
+                            'INSERT OR IGNORE INTO point_batches (batch_id, changes, total) VALUES (?, ?, ?)',
+                            (batch_id, len(changes), sum(amount for _, amount, _ in changes))
+                        )
+                        if cursor.rowcount == 0:
+                            return 0  # Applied before
+
+                    cursor.execute('SELECT MAX(id) FROM contest_seasons')
+                    season_id = cursor.fetchone()[0]
+                    cursor.executemany('''
+                        INSERT INTO point_transactions (user_id, season_id, amount, reason, batch_id)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', [(user_id, season_id, amount, reason, batch_id) for user_id, amount, reason in changes])
+
+                    totals: Dict[int, int] = {}
+                    for user_id, amount, _ in changes:
+                        totals[user_id] = totals.get(user_id, 0) + amount
+                    activity = ', last_activity = CURRENT_TIMESTAMP' if touch_activity else ''
+                    cursor.executemany(
+                        f'UPDATE users SET balance = balance + ?{activity} WHERE user_id = ?',
+                        [(amount, user_id) for user_id, amount in totals.items()]
+                    )
+
+                    balances = {}
+                    user_ids = list(totals)
+                    for i in range(0, len(user_ids), 500):
+                        chunk = user_ids[i:i + 500]
+                        cursor.execute(
+                            f'SELECT user_id, balance FROM users WHERE user_id IN ({",".join("?" * len(chunk))})', chunk
+                        )
+                        balances.update(cursor.fetchall())
+                    conn.commit()
+        except Exception as e:
+            print(f"Error applying point changes: {e}")
+            return 0
+
+        self.notify_balances(balances)
+        return len(balances)
+
+    def get_point_history(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Get the latest ledger entries of a user"""
+        query = '''
+            SELECT amount, reason, created_at FROM point_transactions
+            WHERE user_id = ? ORDER BY id DESC LIMIT ?
+        '''
+        results = self.execute_query(query, (user_id, limit))
+        return [{'amount': row[0], 'reason': row[1], 'created_at': row[2]} for row in results]
+
+    def get_point_batch(self, batch_id: str) -> Optional[Dict]:
+        """Applied point batch, or None if it was never applied"""
+        result = self.execute_query('SELECT changes, total, applied_at FROM point_batches WHERE batch_id = ?', (batch_id,))
+        if not result:
+            return None
+        return {'changes': result[0][0], 'total': result[0][1], 'applied_at': result[0][2]}
+
+    def get_balances(self, user_ids: List[int]) -> Dict[int, int]:
+        """Current balances of the given users; unknown ids are left out"""
+        balances = {}
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            balances.update(self.execute_query(
+                f'SELECT user_id, balance FROM users WHERE user_id IN ({",".join("?" * len(chunk))})', tuple(chunk)
+            ))
+        return balances
+
+    def notify_balances(self, changes: Optional[Dict[int, int]]):
+        """Tell balance listeners which balances changed"""
+        for listener in self.balance_listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                print(f"Error in balance listener: {e}")
 
     def get_user_balance(self, user_id: int) -> int:
         """Get user balance"""
@@ -188,12 +589,80 @@ class Database:
     def get_user_rank(self, user_id: int) -> int:
         """Get user rank by balance"""
         query = '''
-            SELECT COUNT(*) + 1 FROM users 
-            WHERE balance > (SELECT balance FROM users WHERE user_id = ?) AND is_active = TRUE
+            SELECT COALESCE(SUM(users), 0) + 1 FROM balance_histogram
+            WHERE balance > (SELECT balance FROM users WHERE user_id = ?)
         '''
         result = self.execute_query(query, (user_id,))
         return result[0][0] if result else 0
 
+    def get_users_around(self, user_id: int, count: int = 5) -> Optional[Dict]:
+        """Get users ranked just above and below a user.
+
+        Neighbours are found by keyset seeks on idx_users_balance from the
+        user's (balance, registration_date, user_id), ranks come from the
+        balance histogram. Users with equal balance share a rank.
+        """
+        result = self.execute_query(
+            'SELECT balance, registration_date FROM users WHERE user_id = ? AND is_active = TRUE', (user_id,)
+        )
+        if not result:
+            return None
+        balance, registration_date = result[0]
+
+        columns = 'user_id, first_name, last_name, username, balance, registration_date'
+        query = f'''
+            SELECT * FROM (
+                SELECT {columns} FROM users
+                WHERE is_active = TRUE AND balance = ? AND (registration_date, user_id) < (?, ?)
+                ORDER BY registration_date DESC, user_id DESC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT {columns} FROM users
+                WHERE is_active = TRUE AND balance > ?
+                ORDER BY balance ASC, registration_date DESC, user_id DESC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT {columns} FROM users
+                WHERE is_active = TRUE AND balance = ? AND (registration_date, user_id) >= (?, ?)
+                ORDER BY registration_date ASC, user_id ASC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT {columns} FROM users
+                WHERE is_active = TRUE AND balance < ?
+                ORDER BY balance DESC, registration_date ASC, user_id ASC LIMIT ?
+            )
+        '''
+        rows = self.execute_query(query, (
+            balance, registration_date, user_id, count,
+            balance, count,
+            balance, registration_date, user_id, count + 1,
+            balance, count
+        ))
+        # Leaderboard order: balance DESC, registration_date ASC, user_id ASC
+        rows.sort(key=lambda row: (-row[4], row[5], row[0]))
+        position = next(i for i, row in enumerate(rows) if row[0] == user_id)
+        window = rows[max(0, position - count):position + count + 1]
+
+        ranks = dict(self.execute_query('''
+            SELECT balance,
+                   COALESCE(SUM(users) OVER (ORDER BY balance DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) + 1
+            FROM balance_histogram WHERE balance >= ? AND users > 0
+        ''', (window[-1][4],)))
+
+        users = [{
+            'user_id': row[0],
+            'first_name': row[1],
+            'last_name': row[2],
+            'username': row[3],
+            'balance': row[4],
+            'rank': ranks.get(row[4], 0)
+        } for row in window]
+        me = next(i for i, user in enumerate(users) if user['user_id'] == user_id)
+        return {'above': users[:me], 'me': users[me], 'below': users[me + 1:]}
+
     def get_top_users(self, limit: int = 20) -> List[Dict]:
         """Get top users by balance"""
         query = '''
@@ -220,12 +689,27 @@ class Database:
     def add_admin(self, user_id: int, added_by: int = None) -> bool:
         """Add admin"""
         query = 'INSERT OR IGNORE INTO admins (user_id, added_by) VALUES (?, ?)'
-        return self.execute_insert(query, (user_id, added_by)) > 0
+        added = self.execute_insert(query, (user_id, added_by)) > 0
+        self.notify_admins()
+        return added
 
     def remove_admin(self, user_id: int) -> bool:
         """Remove admin"""
         query = 'DELETE FROM admins WHERE user_id = ?'
-        return self.execute_update(query, (user_id,)) > 0
+        removed = self.execute_update(query, (user_id,)) > 0
+        self.notify_admins()
+        return removed
+
+    def get_admin_ids(self) -> set:
+        return {row[0] for row in self.execute_query('SELECT user_id FROM admins')}
+
+    def notify_admins(self):
+        """Tell admin listeners that the admin list changed"""
+        for listener in self.admin_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error in admin listener: {e}")
 
     def is_admin(self, user_id: int) -> bool:
         """Check if user is admin"""
@@ -292,30 +776,56 @@ class Database:
         query = 'UPDATE mandatory_subscriptions SET is_active = FALSE WHERE id = ?'
         return self.execute_update(query, (subscription_id,)) > 0
 
+    def set_user_subscription(self, user_id: int, channel_id: str, is_joined: bool) -> bool:
+        """Record user's membership status in a channel"""
+        query = '''
+            INSERT OR REPLACE INTO user_subscriptions (user_id, channel_id, subscription_date, is_joined)
+            VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+        '''
+        return self.execute_insert(query, (user_id, channel_id, is_joined)) >= 0
+
     # Referral methods
     def add_referral(self, referrer_id: int, referred_id: int) -> bool:
-        """Add referral"""
-        query = 'INSERT OR IGNORE INTO referrals (referrer_id, referred_id, bonus_given) VALUES (?, ?, ?)'
+        """Add referral and bump the referrer's counter; the caller credits the bonus through apply_point_changes"""
         from config import REFERRAL_BONUS
-        success = self.execute_insert(query, (referrer_id, referred_id, REFERRAL_BONUS)) > 0
-        if success:
-            # Add bonus to referrer
-            self.add_balance(referrer_id, REFERRAL_BONUS)
-        return success
+        try:
+            with self.lock:
+                with sqlite3.connect(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO referrals (referrer_id, referred_id, bonus_given) VALUES (?, ?, ?)',
+                        (referrer_id, referred_id, REFERRAL_BONUS)
+                    )
+                    if cursor.rowcount <= 0:
+                        return False
+                    cursor.execute('UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ?',
+                                   (referrer_id,))
+                    conn.commit()
+                    return True
+        except Exception as e:
+            print(f"Error adding referral: {e}")
+            return False
 
     def get_referral_count(self, user_id: int) -> int:
         """Get referral count for user"""
-        query = 'SELECT COUNT(*) FROM referrals WHERE referrer_id = ?'
+        query = 'SELECT referral_count FROM users WHERE user_id = ?'
         result = self.execute_query(query, (user_id,))
-        return result[0][0] if result else 0
+        return result[0][0] or 0 if result else 0
+
+    def recount_referrals(self) -> int:
+        """Recompute referral counters from the referrals table; return how many were wrong"""
+        query = '''
+            UPDATE users SET referral_count = (SELECT COUNT(*) FROM referrals WHERE referrer_id = users.user_id)
+            WHERE referral_count IS NOT (SELECT COUNT(*) FROM referrals WHERE referrer_id = users.user_id)
+        '''
+        return self.execute_update(query)
 
     def get_top_referrers(self, limit: int = 10) -> List[Dict]:
         """Get top referrers"""
         query = '''
-            SELECT r.referrer_id, u.first_name, u.last_name, u.username, COUNT(*) as referral_count
-            FROM referrals r
-            LEFT JOIN users u ON r.referrer_id = u.user_id
-            GROUP BY r.referrer_id
+            SELECT user_id, first_name, last_name, username, referral_count
+            FROM users
+            WHERE referral_count > 0
             ORDER BY referral_count DESC
             LIMIT ?
         '''
@@ -362,6 +872,88 @@ class Database:
         '''
         self.execute_insert(query, (today, today, new_users, active_users, today, messages_sent, today, referrals_made))
 
+    def add_event_counts(self, hours: Dict[str, Dict[str, int]], day_sketches: Dict[str, HyperLogLog],
+                         hourly_retention_days: int, daily_retention_days: int) -> bool:
+        """Add hourly event counts and daily active user sketches, roll them up and apply retention.
+
+        `hours` maps 'YYYY-MM-DD HH:00' to counter increments, `day_sketches`
+        maps 'YYYY-MM-DD' to a HyperLogLog of users active that day; it is
+        merged into the stored sketch and active_users is its new estimate.
+        Days and months touched are recomputed from the finer table; old
+        hourly and daily rows are deleted after that, monthly rows are kept.
+        """
+        columns = ', '.join(TIMESERIES_COUNTERS)
+        sums = ', '.join(f'SUM({column})' for column in TIMESERIES_COUNTERS)
+        increments = ', '.join(f'{column} = {column} + excluded.{column}' for column in TIMESERIES_COUNTERS)
+        replaced = ', '.join(f'{column} = excluded.{column}' for column in TIMESERIES_COUNTERS)
+        days = sorted({hour[:10] for hour in hours} | set(day_sketches))
+        months = sorted({day[:7] for day in days})
+        now = datetime.now()
+        with self.lock:
+            try:
+                with sqlite3.connect(self.db_path) as conn:
+                    # Other processes merge into the same sketches
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.executemany(f'''
+                        INSERT INTO stats_hourly (hour, {columns}, active_users) VALUES (?{', ?' * len(TIMESERIES_COUNTERS)}, ?)
+                        ON CONFLICT(hour) DO UPDATE SET {increments}, active_users = active_users + excluded.active_users
+                    ''', [(hour, *(counts.get(column, 0) for column in TIMESERIES_COUNTERS), counts.get('active_users', 0))
+                          for hour, counts in hours.items()])
+                    for day, sketch in day_sketches.items():
+                        row = conn.execute('SELECT active_sketch FROM stats_daily WHERE day = ?', (day,)).fetchone()
+                        if row and row[0]:
+                            sketch = HyperLogLog.from_bytes(row[0]).merge(sketch)
+                        conn.execute('''
+                            INSERT INTO stats_daily (day, active_users, active_sketch) VALUES (?, ?, ?)
+                            ON CONFLICT(day) DO UPDATE SET active_users = excluded.active_users,
+                                                           active_sketch = excluded.active_sketch
+                        ''', (day, sketch.count(), sketch.to_bytes()))
+                    conn.executemany(f'''
+                        INSERT INTO stats_daily (day, {columns}, peak_hourly_active)
+                        SELECT substr(hour, 1, 10), {sums}, MAX(active_users) FROM stats_hourly
+                        WHERE hour BETWEEN ? AND ? GROUP BY 1
+                        ON CONFLICT(day) DO UPDATE SET {replaced}, peak_hourly_active = excluded.peak_hourly_active
+                    ''', [(f'{day} 00:00', f'{day} 23:59') for day in days])
+                    conn.executemany(f'''
+                        INSERT INTO stats_monthly (month, {columns}, peak_daily_active)
+                        SELECT substr(day, 1, 7), {sums}, MAX(active_users) FROM stats_daily
+                        WHERE day BETWEEN ? AND ? GROUP BY 1
+                        ON CONFLICT(month) DO UPDATE SET {replaced}, peak_daily_active = excluded.peak_daily_active
+                    ''', [(f'{month}-01', f'{month}-31') for month in months])
+                    conn.execute('DELETE FROM stats_hourly WHERE hour < ?',
+                                 ((now - timedelta(days=hourly_retention_days)).strftime('%Y-%m-%d %H:00'),))
+                    conn.execute('DELETE FROM stats_daily WHERE day < ?',
+                                 ((now - timedelta(days=daily_retention_days)).strftime('%Y-%m-%d'),))
+                    conn.commit()
+                    return True
+            except Exception as e:
+                print(f"Database event counts error: {e}")
+                return False
+
+    def get_active_sketch(self, start_day: str, end_day: str) -> HyperLogLog:
+        """Merged sketch of users active between two days, inclusive"""
+        merged = HyperLogLog()
+        query = 'SELECT active_sketch FROM stats_daily WHERE day BETWEEN ? AND ? AND active_sketch IS NOT NULL'
+        for row in self.execute_query(query, (start_day, end_day)):
+            merged.merge(HyperLogLog.from_bytes(row[0]))
+        return merged
+
+    def get_timeseries(self, resolution: str, start: str, end: str) -> List[Dict]:
+        """Get buckets of one resolution ('hour', 'day' or 'month') between two bucket keys.
+
+        For months `active_users` is the peak daily count, distinct users
+        are not additive across days.
+        """
+        table, key, active = TIMESERIES_TABLES[resolution]
+        query = f'''
+            SELECT {key}, {', '.join(TIMESERIES_COUNTERS)}, {active} FROM {table}
+            WHERE {key} BETWEEN ? AND ? ORDER BY {key}
+        '''
+        return [
+            {'bucket': row[0], **dict(zip(TIMESERIES_COUNTERS, row[1:-1])), 'active_users': row[-1]}
+            for row in self.execute_query(query, (start, end))
+        ]
+
     def get_stats_by_period(self, days: int) -> Dict:
         """Get statistics for specified period"""
         start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
@@ -397,6 +989,193 @@ class Database:
         result = self.execute_query(query, (cutoff_date,))
         return result[0][0] if result else 0
 
+    def get_dashboard_counts(self) -> Dict:
+        """Get all admin panel counters in one query: a single pass over users and bot_statistics"""
+        now = datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        week_start = (now - timedelta(days=7)).strftime('%Y-%m-%d')
+        month_start = (now - timedelta(days=30)).strftime('%Y-%m-%d')
+        active_cutoffs = [(now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S') for days in (1, 7, 30)]
+        query = '''
+            WITH u AS (
+                SELECT
+                    COALESCE(SUM(phone_number IS NOT NULL), 0),
+                    COALESCE(SUM(last_activity >= ?), 0),
+                    COALESCE(SUM(last_activity >= ?), 0),
+                    COALESCE(SUM(last_activity >= ?), 0),
+                    COALESCE(SUM(registration_date >= ?), 0),
+                    COALESCE(SUM(registration_date >= ?), 0),
+                    COALESCE(SUM(registration_date >= ?), 0),
+                    COALESCE(SUM(CASE WHEN balance > 0 THEN balance END), 0)
+                FROM users
+            ), s AS (
+                SELECT
+                    COALESCE(SUM(CASE WHEN date = ? THEN new_users END), 0),
+                    COALESCE(SUM(CASE WHEN date = ? THEN active_users END), 0),
+                    COALESCE(SUM(CASE WHEN date = ? THEN messages_sent END), 0),
+                    COALESCE(SUM(CASE WHEN date = ? THEN referrals_made END), 0),
+                    COALESCE(SUM(CASE WHEN date >= ? THEN new_users END), 0),
+                    COALESCE(SUM(CASE WHEN date >= ? THEN messages_sent END), 0),
+                    COALESCE(SUM(CASE WHEN date >= ? THEN referrals_made END), 0),
+                    COALESCE(AVG(CASE WHEN date >= ? THEN active_users END), 0),
+                    COALESCE(SUM(CASE WHEN date >= ? THEN new_users END), 0),
+                    COALESCE(SUM(CASE WHEN date >= ? THEN messages_sent END), 0),
+                    COALESCE(SUM(CASE WHEN date >= ? THEN referrals_made END), 0),
+                    COALESCE(AVG(CASE WHEN date >= ? THEN active_users END), 0),
+                    COALESCE(SUM(messages_sent), 0)
+                FROM bot_statistics
+            )
+            SELECT u.*, s.*, (SELECT COUNT(*) FROM referrals) FROM u, s
+        '''
+        params = (*active_cutoffs, today, week_start, month_start,
+                  today, today, today, today, *[week_start] * 4, *[month_start] * 4)
+        result = self.execute_query(query, params)
+        row = [int(value) for value in result[0]] if result else [0] * 22
+        
+        def period(offset: int) -> Dict:
+            return {
+                'new_users': row[offset],
+                'messages_sent': row[offset + 1],
+                'referrals_made': row[offset + 2],
+                'avg_active_users': row[offset + 3]
+            }
+        
+        return {
+            'today': {
+                'new_users': row[8],
+                'active_users': row[9],
+                'messages_sent': row[10],
+                'referrals_made': row[11],
+                'date': today
+            },
+            'week': period(12),
+            'month': period(16),
+            'total_users': row[0],
+            'active_today': row[1],
+            'active_week': row[2],
+            'active_month': row[3],
+            'today_registrations': row[4],
+            'week_registrations': row[5],
+            'month_registrations': row[6],
+            'total_points': row[7],
+            'total_messages': row[20],
+            'total_referrals': row[21]
+        }
+
+    def get_data_version(self, groups: Tuple[str, ...]) -> str:
+        """Combined write counter of table groups; changes whenever any of them is written"""
+        placeholders = ', '.join('?' * len(groups))
+        rows = dict(self.execute_query(f'SELECT name, version FROM data_versions WHERE name IN ({placeholders})', groups))
+        return ','.join(f'{group}={rows.get(group, 0)}' for group in groups)
+
+    def get_cached_export(self, kind: str) -> Optional[Dict]:
+        """Latest generated export of a kind"""
+        result = self.execute_query(
+            'SELECT data_version, file_path, file_id, created_at FROM export_cache WHERE kind = ?', (kind,)
+        )
+        if not result:
+            return None
+        data_version, file_path, file_id, created_at = result[0]
+        return {'data_version': data_version, 'file_path': file_path, 'file_id': file_id, 'created_at': created_at}
+
+    def save_cached_export(self, kind: str, data_version: str, file_path: str):
+        query = '''
+            INSERT INTO export_cache (kind, data_version, file_path, file_id, created_at)
+            VALUES (?, ?, ?, NULL, CURRENT_TIMESTAMP)
+            ON CONFLICT (kind) DO UPDATE SET
+                data_version = excluded.data_version, file_path = excluded.file_path,
+                file_id = NULL, created_at = excluded.created_at
+        '''
+        self.execute_update(query, (kind, data_version, file_path))
+
+    def set_export_file_id(self, kind: str, file_path: str, file_id: Optional[str]):
+        """Remember the Telegram file_id of a sent export, unless a newer file replaced it meanwhile"""
+        self.execute_update('UPDATE export_cache SET file_id = ? WHERE kind = ? AND file_path = ?',
+                            (file_id, kind, file_path))
+
+    def get_users_page(self, sort: str = 'balance', cursor: tuple = None, backward: bool = False,
+                       limit: int = 20) -> Tuple[List[Dict], bool]:
+        """Get one page of users next to a cursor, using keyset seeks instead of OFFSET.
+
+        Sorts: 'balance' (leaderboard order, cursor is (balance, registration_date,
+        user_id)), 'registration' and 'activity' (newest first, cursor is
+        (date, user_id)). The cursor is the boundary row of the current page;
+        without one the first page is returned. Also returns whether more rows
+        exist beyond the page in the requested direction.
+
+        NULL dates sort before every other date, as in SQLite. Row-value
+        comparisons never match NULL, so those rows are reached with separate
+        IS NULL seeks, and a cursor date may itself be None.
+        """
+        columns = 'user_id, first_name, last_name, username, balance, registration_date, last_activity'
+
+        def after(column: str, date, user_id: int, order: str, seek_limit: int, prefix: str = '', params=()):
+            """Rows after (date, user_id) in ascending (column, user_id) order, NULL dates first"""
+            if date is None:
+                return [
+                    (f'''SELECT {columns} FROM users WHERE {prefix}{column} IS NULL AND user_id > ?
+                         ORDER BY user_id ASC LIMIT ?''', (*params, user_id, seek_limit)),
+                    (f'''SELECT {columns} FROM users WHERE {prefix}{column} IS NOT NULL
+                         ORDER BY {order} LIMIT ?''', (*params, seek_limit)),
+                ]
+            return [(f'''SELECT {columns} FROM users WHERE {prefix}({column}, user_id) > (?, ?)
+                         ORDER BY {order} LIMIT ?''', (*params, date, user_id, seek_limit))]
+
+        def before(column: str, date, user_id: int, order: str, seek_limit: int, prefix: str = '', params=()):
+            """Rows before (date, user_id) in ascending (column, user_id) order, NULL dates first"""
+            if date is None:
+                return [(f'''SELECT {columns} FROM users WHERE {prefix}{column} IS NULL AND user_id < ?
+                             ORDER BY user_id DESC LIMIT ?''', (*params, user_id, seek_limit))]
+            return [
+                (f'''SELECT {columns} FROM users WHERE {prefix}({column}, user_id) < (?, ?)
+                     ORDER BY {order} LIMIT ?''', (*params, date, user_id, seek_limit)),
+                (f'''SELECT {columns} FROM users WHERE {prefix}{column} IS NULL
+                     ORDER BY user_id DESC LIMIT ?''', (*params, seek_limit)),
+            ]
+
+        if sort == 'balance':
+            if cursor is None:
+                queries = [(f'SELECT {columns} FROM users ORDER BY balance DESC, registration_date ASC, user_id ASC LIMIT ?',
+                            (limit + 1,))]
+            elif not backward:
+                balance, registration_date, user_id = cursor
+                queries = after('registration_date', registration_date, user_id,
+                                'registration_date ASC, user_id ASC', limit + 1, 'balance = ? AND ', (balance,))
+                queries.append((f'''SELECT {columns} FROM users WHERE balance < ?
+                                   ORDER BY balance DESC, registration_date ASC, user_id ASC LIMIT ?''',
+                                (balance, limit + 1)))
+            else:
+                balance, registration_date, user_id = cursor
+                queries = before('registration_date', registration_date, user_id,
+                                 'registration_date DESC, user_id DESC', limit + 1, 'balance = ? AND ', (balance,))
+                queries.append((f'''SELECT {columns} FROM users WHERE balance > ?
+                                   ORDER BY balance ASC, registration_date DESC, user_id DESC LIMIT ?''',
+                                (balance, limit + 1)))
+            sort_key, newest_first = (lambda row: (-row[4], row[5] or '', row[0])), False
+        elif sort in ('registration', 'activity'):
+            column = 'registration_date' if sort == 'registration' else 'last_activity'
+            if cursor is None:
+                queries = [(f'SELECT {columns} FROM users ORDER BY {column} DESC, user_id DESC LIMIT ?', (limit + 1,))]
+            elif not backward:
+                # Newest first: the next page holds the rows before the cursor
+                queries = before(column, cursor[0], cursor[1], f'{column} DESC, user_id DESC', limit + 1)
+            else:
+                queries = after(column, cursor[0], cursor[1], f'{column} ASC, user_id ASC', limit + 1)
+            index = 5 if sort == 'registration' else 6
+            sort_key, newest_first = (lambda row: (row[index] or '', row[0])), True
+        else:
+            raise ValueError(f"Unknown sort: {sort}")
+
+        rows = []
+        for query, params in queries:
+            rows.extend(self.execute_query(query, params))
+        rows.sort(key=sort_key, reverse=newest_first)
+
+        has_more = len(rows) > limit
+        rows = rows[-limit:] if backward else rows[:limit]
+        columns = ['user_id', 'first_name', 'last_name', 'username', 'balance', 'registration_date', 'last_activity']
+        return [dict(zip(columns, row)) for row in rows], has_more
+
     def search_user(self, search_term: str) -> List[Dict]:
         """Search users by ID, username, or name"""
         # Try to search by user ID first if it's a number
@@ -432,9 +1211,134 @@ class Database:
         return users
 
     def reset_all_balances(self) -> bool:
-        """Reset all user balances to 0"""
-        query = 'UPDATE users SET balance = 0'
-        return self.execute_update(query) >= 0
+        """Close the current season with a snapshot, reset balances and open a new season"""
+        self.end_season()
+        return self.new_season() is not None
+
+    # Contest season methods
+    def get_current_season(self) -> Optional[Dict]:
+        """Get the open season, if any"""
+        query = 'SELECT id, started_at FROM contest_seasons WHERE ended_at IS NULL ORDER BY id DESC LIMIT 1'
+        result = self.execute_query(query)
+        if result:
+            return {'id': result[0][0], 'started_at': result[0][1]}
+        return None
+
+    def start_season(self) -> Optional[int]:
+        """Open the contest season again and return its id; balances are kept.
+
+        An open season is returned as is, the last closed one is reopened and
+        its snapshot is taken again when it closes. Before any season exists
+        the first one is opened over the current balances.
+        """
+        try:
+            with self.lock:
+                with sqlite3.connect(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT id, ended_at FROM contest_seasons ORDER BY id DESC LIMIT 1')
+                    row = cursor.fetchone()
+                    if row and row[1] is None:
+                        return row[0]
+                    if row:
+                        season_id = row[0]
+                        cursor.execute('UPDATE contest_seasons SET ended_at = NULL WHERE id = ?', (season_id,))
+                    else:
+                        cursor.execute('INSERT INTO contest_seasons DEFAULT VALUES')
+                        season_id = cursor.lastrowid
+                        # Balances carried into the first season keep their ledger entries
+                        cursor.execute('UPDATE point_transactions SET season_id = ? WHERE season_id IS NULL', (season_id,))
+                    conn.commit()
+                    return season_id
+        except Exception as e:
+            print(f"Error starting season: {e}")
+            return None
+
+    def new_season(self) -> Optional[int]:
+        """Reset balances and open a fresh season; the caller closes the old one first.
+
+        Balances of the closed season are already in season_results. Only
+        users that have points are rewritten.
+        """
+        try:
+            with self.lock:
+                with sqlite3.connect(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT 1 FROM contest_seasons WHERE ended_at IS NULL LIMIT 1')
+                    if cursor.fetchone():
+                        return None  # The open season has to be closed and snapshotted first
+                    cursor.execute('UPDATE users SET balance = 0 WHERE balance <> 0')
+                    cursor.execute('INSERT INTO contest_seasons DEFAULT VALUES')
+                    season_id = cursor.lastrowid
+                    conn.commit()
+        except Exception as e:
+            print(f"Error opening new season: {e}")
+            return None
+
+        self.notify_balances(None)
+        return season_id
+
+    def end_season(self) -> Optional[int]:
+        """Snapshot the leaderboard of the open season and close it; return its id"""
+        try:
+            with self.lock:
+                with sqlite3.connect(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT id FROM contest_seasons WHERE ended_at IS NULL ORDER BY id DESC LIMIT 1')
+                    row = cursor.fetchone()
+                    if row:
+                        season_id = row[0]
+                    else:
+                        cursor.execute('SELECT 1 FROM contest_seasons LIMIT 1')
+                        if cursor.fetchone():
+                            return None  # Already closed and snapshotted
+                        # Balances collected before seasons existed still deserve a record
+                        cursor.execute('INSERT INTO contest_seasons DEFAULT VALUES')
+                        season_id = cursor.lastrowid
+                        cursor.execute('UPDATE point_transactions SET season_id = ? WHERE season_id IS NULL', (season_id,))
+
+                    # A reopened season is snapshotted again from scratch
+                    cursor.execute('DELETE FROM season_results WHERE season_id = ?', (season_id,))
+                    cursor.execute('''
+                        INSERT INTO season_results
+                            (season_id, rank, user_id, first_name, last_name, username, balance)
+                        SELECT ?, ROW_NUMBER() OVER (ORDER BY balance DESC, registration_date ASC, user_id ASC),
+                               user_id, first_name, last_name, username, balance
+                        FROM users WHERE is_active = TRUE AND balance > 0
+                    ''', (season_id,))
+                    cursor.execute('''
+                        UPDATE contest_seasons SET
+                            ended_at = CURRENT_TIMESTAMP,
+                            participants = (SELECT COUNT(*) FROM season_results WHERE season_id = ?),
+                            total_points = (SELECT COALESCE(SUM(balance), 0) FROM season_results WHERE season_id = ?)
+                        WHERE id = ?
+                    ''', (season_id, season_id, season_id))
+                    conn.commit()
+                    return season_id
+        except Exception as e:
+            print(f"Error ending season: {e}")
+            return None
+
+    def get_seasons(self, limit: int = 10) -> List[Dict]:
+        """Get closed seasons, newest first"""
+        query = '''
+            SELECT id, started_at, ended_at, participants, total_points
+            FROM contest_seasons WHERE ended_at IS NOT NULL
+            ORDER BY id DESC LIMIT ?
+        '''
+        results = self.execute_query(query, (limit,))
+        columns = ['id', 'started_at', 'ended_at', 'participants', 'total_points']
+        return [dict(zip(columns, row)) for row in results]
+
+    def get_season_results(self, season_id: int, limit: int = 20) -> List[Dict]:
+        """Get the final leaderboard of a season"""
+        query = '''
+            SELECT rank, user_id, first_name, last_name, username, balance
+            FROM season_results WHERE season_id = ?
+            ORDER BY rank LIMIT ?
+        '''
+        results = self.execute_query(query, (season_id, limit))
+        columns = ['rank', 'user_id', 'first_name', 'last_name', 'username', 'balance']
+        return [dict(zip(columns, row)) for row in results]
 
     def get_users_for_export(self, limit: int = None) -> List[Dict]:
         """Get users data for Excel export"""
@@ -478,5 +1382,166 @@ class Database:
             })
         return users
 
+    # Broadcast segment methods
+    def get_segment_user_ids(self, segment: str, value=None) -> List[int]:
+        """Materialize user IDs of a broadcast segment.
+
+        Every segment is a single index-backed query over registered users:
+        'all', 'active' (value: days), 'registered' (value: (start_date, end_date)),
+        'balance' (value: threshold), 'top_referrers' (value: K) and
+        'not_subscribed' (value: channel_id).
+        """
+        if segment == 'all':
+            query = 'SELECT user_id FROM users WHERE phone_number IS NOT NULL'
+            params = ()
+        elif segment == 'active':
+            cutoff_date = (datetime.now() - timedelta(days=int(value))).strftime('%Y-%m-%d %H:%M:%S')
+            query = '''
+                SELECT user_id FROM users
+                WHERE last_activity >= ? AND phone_number IS NOT NULL
+            '''
+            params = (cutoff_date,)
+        elif segment == 'registered':
+            start_date, end_date = value
+            end_date = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            query = '''
+                SELECT user_id FROM users
+                WHERE registration_date >= ? AND registration_date < ? AND phone_number IS NOT NULL
+            '''
+            params = (start_date, end_date)
+        elif segment == 'balance':
+            query = '''
+                SELECT user_id FROM users
+                WHERE balance > ? AND phone_number IS NOT NULL
+            '''
+            params = (int(value),)
+        elif segment == 'top_referrers':
+            query = '''
+                SELECT user_id FROM users
+                WHERE referral_count > 0
+                ORDER BY referral_count DESC
+                LIMIT ?
+            '''
+            params = (int(value),)
+        elif segment == 'not_subscribed':
+            query = '''
+                SELECT u.user_id FROM users u
+                WHERE u.phone_number IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM user_subscriptions s
+                    WHERE s.user_id = u.user_id AND s.channel_id = ? AND s.is_joined = TRUE
+                )
+            '''
+            params = (str(value),)
+        else:
+            raise ValueError(f"Unknown segment: {segment}")
+
+        return [row[0] for row in self.execute_query(query, params)]
+
+    # Scheduled broadcast methods
+    def add_scheduled_broadcast(self, message_text: str, run_at: str, interval_hours: int = 0,
+                                segment: str = 'all', segment_value=None, created_by: int = None) -> int:
+        """Store a scheduled (optionally recurring) broadcast"""
+        query = '''
+            INSERT INTO scheduled_broadcasts
+            (message_text, segment, segment_value, run_at, interval_hours, created_by)
+            VALUES (?, ?, ?, ?, ?, ?)
+        '''
+        value = json.dumps(segment_value) if segment_value is not None else None
+        return self.execute_insert(query, (message_text, segment, value, run_at, interval_hours, created_by))
+
+    def get_scheduled_broadcasts(self, due_before: str = None) -> List[Dict]:
+        """Get active scheduled broadcasts, optionally only those due before given time"""
+        query = '''
+            SELECT id, message_text, segment, segment_value, run_at, interval_hours, last_run, created_by
+            FROM scheduled_broadcasts WHERE is_active = TRUE
+        '''
+        params = ()
+        if due_before:
+            query += ' AND run_at <= ?'
+            params = (due_before,)
+        query += ' ORDER BY run_at ASC'
+
+        results = self.execute_query(query, params)
+        broadcasts = []
+        for row in results:
+            broadcasts.append({
+                'id': row[0],
+                'message_text': row[1],
+                'segment': row[2],
+                'segment_value': json.loads(row[3]) if row[3] else None,
+                'run_at': row[4],
+                'interval_hours': row[5],
+                'last_run': row[6],
+                'created_by': row[7]
+            })
+        return broadcasts
+
+    def mark_scheduled_broadcast_run(self, broadcast_id: int, next_run_at: str = None) -> bool:
+        """Record a run; reschedule recurring broadcasts or deactivate one-off ones"""
+        if next_run_at:
+            query = '''
+                UPDATE scheduled_broadcasts SET last_run = CURRENT_TIMESTAMP, run_at = ?
+                WHERE id = ?
+            '''
+            return self.execute_update(query, (next_run_at, broadcast_id)) > 0
+        query = '''
+            UPDATE scheduled_broadcasts SET last_run = CURRENT_TIMESTAMP, is_active = FALSE
+            WHERE id = ?
+        '''
+        return self.execute_update(query, (broadcast_id,)) > 0
+
+    def cancel_scheduled_broadcast(self, broadcast_id: int) -> bool:
+        """Cancel scheduled broadcast"""
+        query = 'UPDATE scheduled_broadcasts SET is_active = FALSE WHERE id = ?'
+        return self.execute_update(query, (broadcast_id,)) > 0
+
+    # Broadcast job methods
+    def create_broadcast_job(self, description: str, total: int, created_by: int = None) -> int:
+        query = 'INSERT INTO broadcast_jobs (description, total, created_by) VALUES (?, ?, ?)'
+        return self.execute_insert(query, (description, total, created_by))
+
+    def update_broadcast_job(self, job_id: int, sent: int, failed: int) -> bool:
+        """Store progress of a running job; returns True if an admin asked to stop it"""
+        self.execute_update(
+            'UPDATE broadcast_jobs SET sent = ?, failed = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (sent, failed, job_id)
+        )
+        result = self.execute_query('SELECT cancel_requested FROM broadcast_jobs WHERE id = ?', (job_id,))
+        return bool(result and result[0][0])
+
+    def finish_broadcast_job(self, job_id: int, sent: int, failed: int):
+        query = '''
+            UPDATE broadcast_jobs SET sent = ?, failed = ?, updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        '''
+        self.execute_update(query, (sent, failed, job_id))
+
+    def get_broadcast_job(self, job_id: int) -> Optional[Dict]:
+        result = self.execute_query('''
+            SELECT id, description, total, sent, failed, created_by, started_at, updated_at, finished_at, cancel_requested
+            FROM broadcast_jobs WHERE id = ?
+        ''', (job_id,))
+        if not result:
+            return None
+        row = result[0]
+        return {'id': row[0], 'description': row[1], 'total': row[2], 'sent': row[3], 'failed': row[4],
+                'created_by': row[5], 'started_at': row[6], 'updated_at': row[7], 'finished_at': row[8],
+                'cancel_requested': bool(row[9])}
+
+    def get_running_broadcast_jobs(self, stale_after: int) -> List[Dict]:
+        """Unfinished jobs that reported progress within `stale_after` seconds"""
+        cutoff = (datetime.utcnow() - timedelta(seconds=stale_after)).strftime('%Y-%m-%d %H:%M:%S')
+        query = '''
+            SELECT id, description, total, sent, failed
+            FROM broadcast_jobs WHERE finished_at IS NULL AND updated_at >= ?
+            ORDER BY id
+        '''
+        return [{'id': row[0], 'description': row[1], 'total': row[2], 'sent': row[3], 'failed': row[4]}
+                for row in self.execute_query(query, (cutoff,))]
+
+    def request_broadcast_cancel(self, job_id: int) -> bool:
+        query = 'UPDATE broadcast_jobs SET cancel_requested = TRUE WHERE id = ? AND finished_at IS NULL'
+        return self.execute_update(query, (job_id,)) > 0
+
 # Global database instance
 db = Database()
\ No newline at end of file
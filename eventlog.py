@@ -0,0 +1,188 @@
+import asyncio
+import glob
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import EVENT_LOG_DIR, EVENT_LOG_FLUSH_INTERVAL, EVENT_LOG_BATCH_SIZE, EVENT_LOG_RETENTION_DAYS
+
+PARTITION_PREFIX = 'events_'
+PARTITION_SUFFIX = '.db'
+
+# (timestamp, user_id, update type, handler)
+Event = Tuple[int, Optional[int], str, str]
+
+def partition_path(day: date, directory: str = EVENT_LOG_DIR) -> str:
+    return os.path.join(directory, f'{PARTITION_PREFIX}{day:%Y-%m-%d}{PARTITION_SUFFIX}')
+
+def _partition_day(path: str) -> date:
+    name = os.path.basename(path)
+    return datetime.strptime(name[len(PARTITION_PREFIX):-len(PARTITION_SUFFIX)], '%Y-%m-%d').date()
+
+def _open_partition(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            ts INTEGER NOT NULL,
+            user_id INTEGER,
+            kind INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS kinds (
+            id INTEGER PRIMARY KEY,
+            update_type TEXT NOT NULL,
+            handler TEXT NOT NULL,
+            UNIQUE (update_type, handler)
+        )
+    ''')
+    return conn
+
+class EventLog:
+    """Append-only log of handled updates, one SQLite file per day.
+
+    Events are buffered in memory and written in one executemany every
+    EVENT_LOG_FLUSH_INTERVAL seconds, as soon as EVENT_LOG_BATCH_SIZE are
+    waiting, and on close. Update type and handler are stored once per
+    partition in `kinds`, so an event row is three integers. Dropping a day
+    deletes its file; queries open only the days they cover.
+    """
+
+    def __init__(self, directory: str = EVENT_LOG_DIR, flush_interval: float = EVENT_LOG_FLUSH_INTERVAL,
+                 batch_size: int = EVENT_LOG_BATCH_SIZE):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer: List[Event] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+        self.retention_day: Optional[date] = None
+
+    def record(self, update_type: str, handler: str, user_id: Optional[int]):
+        self.buffer.append((int(time.time()), user_id, update_type, handler))
+        if len(self.buffer) >= self.batch_size:
+            asyncio.create_task(self.flush())
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Write buffered events to their day partitions"""
+        events, self.buffer = self.buffer, []
+        if not events:
+            return
+        async with self._write_lock:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write, events)
+            except Exception as e:
+                print(f"Error writing event log: {e}")
+
+    def _write(self, events: List[Event]):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.retention_day != date.today():
+            self.retention_day = date.today()
+            self.apply_retention()
+
+        by_day: Dict[date, List[Event]] = {}
+        for event in events:
+            by_day.setdefault(date.fromtimestamp(event[0]), []).append(event)
+
+        for day, day_events in by_day.items():
+            conn = _open_partition(partition_path(day, self.directory))
+            try:
+                kinds = {(update_type, handler): kind_id
+                         for kind_id, update_type, handler in conn.execute('SELECT id, update_type, handler FROM kinds')}
+                new_kinds = {(update_type, handler) for _, _, update_type, handler in day_events} - kinds.keys()
+                if new_kinds:
+                    conn.executemany('INSERT OR IGNORE INTO kinds (update_type, handler) VALUES (?, ?)', sorted(new_kinds))
+                    kinds = {(update_type, handler): kind_id
+                             for kind_id, update_type, handler in conn.execute('SELECT id, update_type, handler FROM kinds')}
+                conn.executemany(
+                    'INSERT INTO events (ts, user_id, kind) VALUES (?, ?, ?)',
+                    [(ts, user_id, kinds[(update_type, handler)]) for ts, user_id, update_type, handler in day_events]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush()
+
+    def partitions(self, start: Optional[date] = None, end: Optional[date] = None) -> List[Tuple[date, str]]:
+        """Existing partitions between two days, inclusive, oldest first"""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, f'{PARTITION_PREFIX}*{PARTITION_SUFFIX}')):
+            try:
+                day = _partition_day(path)
+            except ValueError:
+                continue
+            if (start is None or day >= start) and (end is None or day <= end):
+                found.append((day, path))
+        return sorted(found)
+
+    def drop_before(self, day: date) -> int:
+        """Delete whole partitions older than `day`"""
+        dropped = 0
+        for _, path in self.partitions(end=day - timedelta(days=1)):
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass  # Not created, or dropped by another worker
+            dropped += 1
+        return dropped
+
+    def apply_retention(self, days: int = EVENT_LOG_RETENTION_DAYS) -> int:
+        return self.drop_before(date.today() - timedelta(days=days - 1))
+
+    def scan(self, query: str, params: tuple = (), start: Optional[date] = None,
+             end: Optional[date] = None) -> Iterator[Tuple[date, list]]:
+        """Run a query against each partition in the range, yielding (day, rows)"""
+        for day, path in self.partitions(start, end):
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                yield day, conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+
+    def active_users(self, start: date, end: Optional[date] = None) -> int:
+        """Exact number of distinct users with events between two days"""
+        ids = [np.array([row[0] for row in rows], dtype=np.int64)
+               for _, rows in self.scan('SELECT DISTINCT user_id FROM events WHERE user_id IS NOT NULL',
+                                        start=start, end=end or date.today())]
+        return len(np.unique(np.concatenate(ids))) if ids else 0
+
+    def daily_summary(self, start: date, end: Optional[date] = None) -> List[Dict]:
+        """Events and distinct users per day"""
+        return [
+            {'date': day.isoformat(), 'events': rows[0][0], 'users': rows[0][1]}
+            for day, rows in self.scan('SELECT COUNT(*), COUNT(DISTINCT user_id) FROM events',
+                                       start=start, end=end or date.today())
+        ]
+
+    def handler_counts(self, start: date, end: Optional[date] = None) -> Dict[Tuple[str, str], int]:
+        """Events per (update type, handler) between two days"""
+        totals: Dict[Tuple[str, str], int] = {}
+        query = '''
+            SELECT k.update_type, k.handler, COUNT(*)
+            FROM events e JOIN kinds k ON k.id = e.kind
+            GROUP BY e.kind
+        '''
+        for _, rows in self.scan(query, start=start, end=end or date.today()):
+            for update_type, handler, count in rows:
+                totals[(update_type, handler)] = totals.get((update_type, handler), 0) + count
+        return totals
+
+# Global event log instance
+event_log = EventLog()
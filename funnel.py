@@ -0,0 +1,99 @@
+import sqlite3
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from database import db
+from config import COHORT_WEEKS
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+WEEK = np.timedelta64(7, 'D')
+
+# Funnel stages in order, each one a subset of the previous
+FUNNEL_STAGES = [
+    ('started', "🚀 /start bosgan"),
+    ('subscribed', "📢 Obuna bo'lgan"),
+    ('registered', "📱 Telefon kiritgan"),
+    ('referred', "👆 Birinchi referal"),
+]
+
+def build_report(weeks: int = COHORT_WEEKS) -> Dict:
+    """Registration funnel and weekly cohort retention.
+
+    Each table is read with a single query and everything else is computed
+    on whole columns. A user counts as retained in week k when their last
+    activity is at least k weeks after registration; cohorts whose week k
+    has not fully passed get no value there.
+    """
+    with sqlite3.connect(db.db_path) as conn:
+        users = pd.read_sql_query('''
+            SELECT user_id, registration_date, last_activity,
+                   subscribed_at IS NOT NULL AS subscribed, phone_number IS NOT NULL AS registered
+            FROM users
+        ''', conn)
+        referrers = pd.read_sql_query('SELECT DISTINCT referrer_id FROM referrals', conn)
+
+    registered_at = pd.to_datetime(users['registration_date'], format=TIMESTAMP_FORMAT, errors='coerce')
+    last_activity = pd.to_datetime(users['last_activity'], format=TIMESTAMP_FORMAT, errors='coerce')
+
+    # Later stages imply the earlier ones: a phone is only asked for after the subscription check
+    stages = pd.DataFrame({'started': np.ones(len(users), dtype=bool)})
+    stages['subscribed'] = users['subscribed'].astype(bool) | users['registered'].astype(bool)
+    stages['registered'] = stages['subscribed'] & users['registered'].astype(bool)
+    stages['referred'] = stages['registered'] & users['user_id'].isin(referrers['referrer_id']).to_numpy()
+
+    started = len(users)
+    funnel = []
+    previous = started
+    for key, title in FUNNEL_STAGES:
+        count = int(stages[key].sum())
+        funnel.append({
+            'stage': key,
+            'title': title,
+            'users': count,
+            'of_started': round(count / started * 100, 1) if started else 0.0,
+            'of_previous': round(count / previous * 100, 1) if previous else 0.0,
+        })
+        previous = count
+
+    valid = registered_at.notna().to_numpy()
+    registered = registered_at.to_numpy()[valid]
+    last_seen = last_activity.to_numpy()[valid]
+    last_seen = np.where(np.isnat(last_seen), registered, last_seen)
+    stages = stages.to_numpy()[valid]
+
+    # Cohort = Monday of the registration week; 1970-01-01 was a Thursday
+    days = registered.astype('datetime64[D]')
+    week_starts = days - (days.astype(np.int64) + 3) % 7
+    cohort_starts, cohort_index = np.unique(week_starts, return_inverse=True)
+
+    def per_cohort(values: np.ndarray) -> np.ndarray:
+        return np.bincount(cohort_index, weights=values, minlength=len(cohort_starts))
+
+    sizes = per_cohort(None).astype(int)
+    cohorts = pd.DataFrame({'users': sizes}, index=pd.Index(cohort_starts.astype(object), name='cohort'))
+    for column, (key, _) in enumerate(FUNNEL_STAGES[1:], 1):
+        cohorts[f'{key}_pct'] = (per_cohort(stages[:, column]) / sizes * 100).round(1)
+
+    age_weeks = (np.datetime64(datetime.now()) - registered) // WEEK
+    active_weeks = (last_seen - registered) // WEEK
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for week in range(1, weeks + 1):
+            # Week k is known only once it has fully passed
+            observed = age_weeks > week
+            eligible = per_cohort(observed)
+            retained = per_cohort(observed & (active_weeks >= week))
+            cohorts[f'w{week}'] = np.where(eligible > 0, retained / eligible * 100, np.nan).round(1)
+
+    return {'funnel': funnel, 'cohorts': cohorts.sort_index(ascending=False)}
+
+if __name__ == '__main__':
+    import time
+    started_at = time.perf_counter()
+    report = build_report()
+    for stage in report['funnel']:
+        print(f"{stage['title']}: {stage['users']} ({stage['of_started']}%, {stage['of_previous']}% of previous)")
+    print(report['cohorts'].head(12).to_string())
+    print(f"Computed in {time.perf_counter() - started_at:.2f}s")
@@ -1,19 +1,28 @@
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, User
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramAPIError
+import html
 import re
 import asyncio
 from typing import List, Dict
 
 from database import db
-from config import MESSAGES, REGISTRATION_BONUS, REFERRAL_BONUS, ADMIN_IDS
+from cache import LRUCache
+from leaderboard import leaderboard
+from middlewares import rate_limit
+from timeseries import event_counters
+from config import (MESSAGES, REGISTRATION_BONUS, REFERRAL_BONUS, ADMIN_IDS, REFERRAL_TEXT_CACHE_SIZE,
+                    REFERRAL_TEXT_TTL, POINT_REASONS, PHONE_PATTERN)
 
 # Router for user handlers
 router = Router()
 
+# Rendered "👆 Referal link" texts by user_id, dropped when the user gets a new referral
+referral_texts = LRUCache(REFERRAL_TEXT_CACHE_SIZE, ttl=REFERRAL_TEXT_TTL)
+
 # FSM States
 class UserStates(StatesGroup):
     waiting_phone = State()
@@ -39,7 +48,10 @@ async def check_user_subscriptions(bot: Bot, user_id: int) -> tuple[bool, List[D
                 
                 try:
                     member = await bot.get_chat_member(chat_id, user_id)
-                    if member.status in ['left', 'kicked', 'restricted']:
+                    is_joined = member.status not in ['left', 'kicked', 'restricted']
+                    # Remember membership for "not subscribed" broadcast segments
+                    db.set_user_subscription(user_id, sub['channel_id'], is_joined)
+                    if not is_joined:
                         not_subscribed.append(sub)
                 except TelegramAPIError:
                     # If we can't check, assume not subscribed
@@ -97,7 +109,7 @@ def create_main_menu_keyboard(is_admin: bool = False) -> ReplyKeyboardMarkup:
     
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
-@router.message(Command('start'))
+@router.message(Command('start'), flags=rate_limit('start', per_minute=6, burst=3))
 async def cmd_start(message: Message, state: FSMContext, bot: Bot):
     """Handle /start command"""
     user_id = message.from_user.id
@@ -133,6 +145,9 @@ async def cmd_start(message: Message, state: FSMContext, bot: Bot):
         await message.answer(MESSAGES['start_welcome'], reply_markup=keyboard)
         return
     
+    if not user['subscribed_at']:
+        db.mark_subscribed(user_id)
+    
     # Check if user has phone number
     if not user['phone_number']:
         await message.answer(MESSAGES['phone_request'])
@@ -145,7 +160,7 @@ async def cmd_start(message: Message, state: FSMContext, bot: Bot):
     await message.answer(MESSAGES['main_menu'], reply_markup=keyboard)
     await state.set_state(UserStates.main_menu)
 
-@router.callback_query(F.data == "check_subscriptions")
+@router.callback_query(F.data == "check_subscriptions", flags=rate_limit('subscriptions', per_minute=6, burst=2))
 async def callback_check_subscriptions(callback: CallbackQuery, state: FSMContext, bot: Bot):
     """Handle subscription check callback"""
     user_id = callback.from_user.id
@@ -164,6 +179,8 @@ async def callback_check_subscriptions(callback: CallbackQuery, state: FSMContex
     
     # Check if user has phone number
     user = db.get_user(user_id)
+    if not user['subscribed_at']:
+        db.mark_subscribed(user_id)
     if not user['phone_number']:
         await callback.message.delete()
         await callback.message.answer(MESSAGES['phone_request'])
@@ -184,19 +201,21 @@ async def handle_phone_input(message: Message, state: FSMContext):
     phone = message.text.strip()
     
     # Validate Uzbekistan phone number (+998)
-    if not re.match(r'^\+998\d{9}$', phone):
+    if not re.match(PHONE_PATTERN, phone):
         await message.answer(MESSAGES['invalid_phone'])
         return
     
     # Update user phone number
     if db.update_user_phone(user_id, phone):
-        # Add registration bonus
-        db.add_balance(user_id, REGISTRATION_BONUS)
-        
-        # Add referral bonus if there's a referrer
+        # Registration bonus, plus the referrer's bonus if there is one, in one batch
+        point_changes = [(user_id, REGISTRATION_BONUS, 'registration')]
         user = db.get_user(user_id)
         if user['referrer_id']:
-            db.add_referral(user['referrer_id'], user_id)
+            if db.add_referral(user['referrer_id'], user_id):
+                point_changes.append((user['referrer_id'], REFERRAL_BONUS, 'referral'))
+                event_counters.incr('referrals')
+                referral_texts.pop(user['referrer_id'])
+        db.apply_point_changes(point_changes)
         
         await message.answer(MESSAGES['registration_success'])
         
@@ -208,6 +227,7 @@ async def handle_phone_input(message: Message, state: FSMContext):
         
         # Update statistics
         db.update_daily_stats(new_users=1)
+        event_counters.incr('new_users')
     else:
         await message.answer("❌ Xatolik yuz berdi. Iltimos, qayta urinib ko'ring.")
 
@@ -218,17 +238,19 @@ async def handle_contest_info(message: Message):
     await message.answer(contest_text)
 
 @router.message(F.text == "👆 Referal link", StateFilter(UserStates.main_menu))
-async def handle_referral_link(message: Message, bot: Bot):
+async def handle_referral_link(message: Message, bot_info: User):
     """Handle referral link request"""
     user_id = message.from_user.id
-    bot_info = await bot.get_me()
-    referral_link = f"https://t.me/{bot_info.username}?start=ref_{user_id}"
-    
-    referral_count = db.get_referral_count(user_id)
+    text = referral_texts.get(user_id)
     
-    text = MESSAGES['referral_info'].format(referral_link=referral_link)
-    text += f"\n\n📊 Sizning referallaringiz: {referral_count} ta"
-    text += f"\n💰 Referal orqali olingan ball: {referral_count * REFERRAL_BONUS} ball"
+    if text is None:
+        referral_link = f"https://t.me/{bot_info.username}?start=ref_{user_id}"
+        referral_count = db.get_referral_count(user_id)
+        
+        text = MESSAGES['referral_info'].format(referral_link=referral_link)
+        text += f"\n\n📊 Sizning referallaringiz: {referral_count} ta"
+        text += f"\n💰 Referal orqali olingan ball: {referral_count * REFERRAL_BONUS} ball"
+        referral_texts.set(user_id, text)
     
     await message.answer(text)
 
@@ -252,16 +274,58 @@ async def handle_user_balance(message: Message):
     rank = db.get_user_rank(user_id)
     
     text = MESSAGES['user_balance'].format(balance=balance, rank=rank)
-    await message.answer(text)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📍 Atrofimdagilar", callback_data="around_me"),
+         InlineKeyboardButton(text="🧾 Ballar tarixi", callback_data="points_history")]
+    ])
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data == "around_me")
+async def callback_around_me(callback: CallbackQuery):
+    """Show users ranked right above and below the caller"""
+    await callback.answer()
+    
+    around = db.get_users_around(callback.from_user.id)
+    if not around:
+        await callback.message.answer("📊 Siz hali reytingda yo'qsiz.")
+        return
+    
+    text = "📍 Reytingda sizning atrofingiz:\n\n"
+    for user in around['above'] + [around['me']] + around['below']:
+        name = user['first_name'] or user['username'] or f"User {user['user_id']}"
+        if user['last_name']:
+            name += f" {user['last_name']}"
+        marker = "👉 " if user is around['me'] else ""
+        text += f"{marker}{user['rank']}. {html.escape(name)} - {user['balance']} ball\n"
+    
+    await callback.message.answer(text)
+
+@router.callback_query(F.data == "points_history")
+async def callback_points_history(callback: CallbackQuery):
+    """Show the caller's latest point changes"""
+    await callback.answer()
+    
+    history = db.get_point_history(callback.from_user.id, 10)
+    if not history:
+        await callback.message.answer("🧾 Hali ball o'zgarishlari yo'q.")
+        return
+    
+    text = "🧾 Ballar tarixi (oxirgi 10 ta):\n\n"
+    for entry in history:
+        reason = POINT_REASONS.get(entry['reason'], entry['reason'])
+        text += f"{entry['created_at'][:16]}  {entry['amount']:+d} ball — {reason}\n"
+    
+    await callback.message.answer(text)
 
 @router.message(F.text == "📊 Reyting", StateFilter(UserStates.main_menu))
 async def handle_rating(message: Message):
     """Handle rating request"""
-    top_users = db.get_top_users(20)
-    
+    await message.answer(leaderboard.render('rating', render_rating))
+
+def render_rating(top_users: List[Dict]) -> str:
+    """Rating message text for the top users"""
     if not top_users:
-        await message.answer("📊 Hali reyting mavjud emas.")
-        return
+        return "📊 Hali reyting mavjud emas."
     
     text = MESSAGES['rating_header'] + "\n\n"
     
@@ -283,7 +347,7 @@ async def handle_rating(message: Message):
         
         text += f"{emoji} {name} - {balance} ball\n"
     
-    await message.answer(text)
+    return text
 
 @router.message(F.text == "🗄 Admin paneli", StateFilter(UserStates.main_menu))
 async def handle_admin_panel(message: Message):
@@ -308,14 +372,25 @@ async def handle_unknown_command(message: Message):
 async def on_chat_member_updated(chat_member_update, bot: Bot):
     """Handle chat member updates (join/leave)"""
     try:
-        user_id = chat_member_update.from_user.id
+        # The member whose status changed; from_user is whoever made the change
+        user_id = chat_member_update.new_chat_member.user.id
         chat_id = str(chat_member_update.chat.id)
+        chat_username = chat_member_update.chat.username
         new_status = chat_member_update.new_chat_member.status
-        
+
         # Check if this is a mandatory subscription channel
         subscriptions = db.get_mandatory_subscriptions()
-        is_mandatory = any(sub['channel_id'] == chat_id for sub in subscriptions)
-        
+        matched = [
+            sub for sub in subscriptions
+            if sub['channel_id'] == chat_id or (chat_username and sub['channel_username'] == chat_username)
+        ]
+        is_mandatory = len(matched) > 0
+
+        # Remember membership for "not subscribed" broadcast segments
+        is_joined = new_status in ['member', 'administrator', 'creator']
+        for sub in matched:
+            db.set_user_subscription(user_id, sub['channel_id'], is_joined)
+
         if is_mandatory:
             if new_status in ['member', 'administrator', 'creator']:
                 # User joined, notify them
@@ -0,0 +1,174 @@
+import csv
+import os
+import re
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from database import db
+from config import PHONE_PATTERN, IMPORT_BATCH_SIZE
+
+# Imported columns in db.import_users order; only user_id is required
+IMPORT_COLUMNS = ('user_id', 'username', 'first_name', 'last_name', 'phone_number', 'registration_date')
+COLUMN_ALIASES = {
+    'id': 'user_id',
+    'phone': 'phone_number',
+    'telefon': 'phone_number',
+}
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d.%m.%Y %H:%M', '%d.%m.%Y')
+MAX_REPORTED_ERRORS = 10
+
+phone_re = re.compile(PHONE_PATTERN)
+phone_separators = re.compile(r'[\s\-()]')
+
+def read_rows(path: str) -> Iterator[Tuple[int, tuple]]:
+    """Stream (line number, cells) of a .csv or .xlsx file; the first row is the header"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            for line, cells in enumerate(csv.reader(file), 1):
+                yield line, cells
+    elif extension == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for line, cells in enumerate(workbook.active.iter_rows(values_only=True), 1):
+                yield line, cells
+        finally:
+            workbook.close()
+    else:
+        raise ValueError(f"Unsupported file type: {extension or path}")
+
+def column_positions(header: tuple) -> Dict[str, int]:
+    positions = {}
+    for index, name in enumerate(header):
+        name = str(name or '').strip().lower().replace(' ', '_')
+        name = COLUMN_ALIASES.get(name, name)
+        if name in IMPORT_COLUMNS and name not in positions:
+            positions[name] = index
+    if 'user_id' not in positions:
+        raise ValueError("Header has no user_id column")
+    return positions
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+def normalize_phone(value) -> Optional[str]:
+    """Phone in +998XXXXXXXXX form; spreadsheets often drop the + or add separators"""
+    phone = _text(value)
+    if phone is None:
+        return None
+    phone = phone_separators.sub('', phone)
+    if phone.startswith('998'):
+        phone = '+' + phone
+    if not phone_re.match(phone):
+        raise ValueError(f"invalid phone {value}")
+    return phone
+
+def parse_date(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    text = _text(value)
+    if text is None:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"invalid registration_date {value}")
+
+def parse_row(cells: tuple, positions: Dict[str, int]) -> tuple:
+    """One users row in IMPORT_COLUMNS order, or ValueError"""
+    def cell(name: str):
+        index = positions.get(name)
+        return cells[index] if index is not None and index < len(cells) else None
+
+    try:
+        user_id = int(_text(cell('user_id')))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid user_id {cell('user_id')}")
+    if user_id <= 0:
+        raise ValueError(f"invalid user_id {user_id}")
+
+    username = _text(cell('username'))
+    if username:
+        username = username.lstrip('@') or None
+    return (user_id, username, _text(cell('first_name')), _text(cell('last_name')),
+            normalize_phone(cell('phone_number')), parse_date(cell('registration_date')))
+
+def import_users(path: str, batch_size: int = IMPORT_BATCH_SIZE,
+                 progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Import users from a CSV or XLSX file.
+
+    Rows are streamed and validated one by one, and written `batch_size` at
+    a time, each batch one executemany in its own transaction. The first row
+    of a user_id wins: later rows with the same id are counted as duplicates,
+    and ids already in the database are left as they are. `progress` gets
+    the running totals after every batch.
+    """
+    result = {'rows': 0, 'inserted': 0, 'existing': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+    seen = set()
+    batch: List[tuple] = []
+
+    def write():
+        inserted = db.import_users(batch)
+        result['inserted'] += inserted
+        result['existing'] += len(batch) - inserted
+        batch.clear()
+        if progress:
+            progress(result)
+
+    rows = read_rows(path)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("File is empty")
+    positions = column_positions(header[1])
+
+    for line, cells in rows:
+        if not any(cell not in (None, '') for cell in cells):
+            continue  # Blank line
+        result['rows'] += 1
+        try:
+            row = parse_row(cells, positions)
+        except ValueError as e:
+            result['invalid'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append((line, str(e)))
+            continue
+
+        if row[0] in seen:
+            result['duplicates'] += 1
+            continue
+        seen.add(row[0])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            write()
+
+    if batch:
+        write()
+    return result
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if len(sys.argv) != 2:
+        print("Usage: python -m importer <users.csv|users.xlsx>")
+        sys.exit(2)
+
+    started_at = time.perf_counter()
+
+    def print_progress(totals: Dict):
+        print(f"{totals['rows']} rows read, {totals['inserted']} inserted "
+              f"({time.perf_counter() - started_at:.1f}s)")
+
+    report = import_users(sys.argv[1], progress=print_progress)
+    print(f"Rows: {report['rows']}  inserted: {report['inserted']}  already existed: {report['existing']}  "
+          f"duplicates: {report['duplicates']}  invalid: {report['invalid']}")
+    for line, error in report['errors']:
+        print(f"  line {line}: {error}")
+    print(f"Imported in {time.perf_counter() - started_at:.2f}s")
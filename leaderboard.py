@@ -0,0 +1,65 @@
+import time
+from typing import Callable, Dict, List, Optional
+
+from database import db
+from config import RATING_TOP_COUNT, LEADERBOARD_TTL
+
+class Leaderboard:
+    """Snapshot of the top RATING_TOP_COUNT users with texts rendered from it.
+
+    The version counter is bumped only when a balance change can affect the
+    top list: the user is in it, or their new balance reaches its lowest
+    balance. Texts rendered for the current version are served from a dict.
+    Changes made by other processes are picked up after LEADERBOARD_TTL.
+    """
+
+    def __init__(self, size: int = RATING_TOP_COUNT, ttl: float = LEADERBOARD_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.version = 0
+
+        self.users: List[Dict] = []
+        self.top_ids = set()
+        self.threshold = 0  # lowest balance in the snapshot
+        self.snapshot_version = -1
+        self.expires = 0.0
+        self.renders: Dict[str, str] = {}
+
+        db.balance_listeners.append(self.on_balances_changed)
+
+    def on_balances_changed(self, changes: Optional[Dict[int, int]]):
+        if changes is None or len(self.users) < self.size:
+            self.version += 1
+            return
+        for user_id, balance in changes.items():
+            if user_id in self.top_ids or balance >= self.threshold:
+                self.version += 1
+                return
+
+    def _is_fresh(self) -> bool:
+        return self.snapshot_version == self.version and time.monotonic() < self.expires
+
+    def get_top(self) -> List[Dict]:
+        """Current top users, reloaded only when the version moved or the snapshot expired"""
+        if not self._is_fresh():
+            version = self.version
+            self.users = db.get_top_users(self.size)
+            self.top_ids = {user['user_id'] for user in self.users}
+            self.threshold = self.users[-1]['balance'] if self.users else 0
+            self.renders = {}
+            self.snapshot_version = version
+            self.expires = time.monotonic() + self.ttl
+        return self.users
+
+    def render(self, name: str, renderer: Callable[[List[Dict]], str]) -> str:
+        """Text produced by `renderer` from the current snapshot, cached under `name`"""
+        if self._is_fresh():
+            text = self.renders.get(name)
+            if text is not None:
+                return text
+        users = self.get_top()
+        text = self.renders[name] = renderer(users)
+        return text
+
+# Global leaderboard instance
+leaderboard = Leaderboard()
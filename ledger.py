@@ -0,0 +1,112 @@
+import csv
+import hashlib
+import io
+import sqlite3
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from database import db
+
+MAX_REASON_LENGTH = 100
+MAX_REPORTED_ERRORS = 10
+
+# Parsed point files waiting for admin confirmation: admin_id -> (batch_id, changes)
+pending_point_batches: Dict[int, Tuple[str, List[Tuple[int, int, str]]]] = {}
+
+def verify_balances(repair: bool = False) -> Dict:
+    """Recompute balances from the points ledger and compare them with users.balance.
+
+    Only the current season's entries count, since a new season starts every
+    balance from zero. With repair, mismatched balances are overwritten with
+    the ledger sum.
+    """
+    with sqlite3.connect(db.db_path) as conn:
+        season_id = conn.execute('SELECT MAX(id) FROM contest_seasons').fetchone()[0]
+        ledger = pd.read_sql_query(
+            'SELECT user_id, amount FROM point_transactions WHERE season_id IS ?', conn, params=(season_id,)
+        )
+        users = pd.read_sql_query('SELECT user_id, balance FROM users', conn)
+
+    balances = users.set_index('user_id')['balance']
+    expected = ledger.groupby('user_id', sort=False)['amount'].sum().reindex(balances.index, fill_value=0)
+    difference = balances - expected
+    mismatched = difference[difference != 0]
+
+    result = {
+        'season_id': season_id,
+        'users': len(balances),
+        'transactions': len(ledger),
+        'mismatches': len(mismatched),
+        'difference': int(mismatched.abs().sum()),
+        'examples': [(int(user_id), int(balances[user_id]), int(expected[user_id]))
+                     for user_id in mismatched.index[:10]],
+        'repaired': 0,
+    }
+
+    if repair and len(mismatched):
+        rows = [(int(expected[user_id]), int(user_id)) for user_id in mismatched.index]
+        with db.lock:
+            with sqlite3.connect(db.db_path) as conn:
+                conn.executemany('UPDATE users SET balance = ? WHERE user_id = ?', rows)
+                conn.commit()
+        db.notify_balances({user_id: balance for balance, user_id in rows})
+        result['repaired'] = len(rows)
+
+    return result
+
+def parse_point_changes(data: bytes) -> Dict:
+    """Read (user_id, amount, reason) changes from a `user_id,amount,reason` CSV.
+
+    The header row is optional and an empty reason means an admin
+    adjustment. The batch id is the SHA-256 of the file, so uploading the
+    same file again gives the same batch.
+    """
+    result = {'batch_id': hashlib.sha256(data).hexdigest(), 'changes': [], 'invalid': 0, 'errors': []}
+    text = data.decode('utf-8-sig')
+    for line, cells in enumerate(csv.reader(io.StringIO(text)), 1):
+        if not any(cell.strip() for cell in cells):
+            continue
+        try:
+            user_id, amount = int(cells[0]), int(cells[1])
+        except (IndexError, ValueError):
+            if line == 1:
+                continue  # Header
+            error = f"expected user_id,amount,reason: {','.join(cells)[:50]}"
+        else:
+            if user_id > 0 and amount != 0:
+                reason = cells[2].strip()[:MAX_REASON_LENGTH] if len(cells) > 2 else ''
+                result['changes'].append((user_id, amount, reason or 'admin_adjustment'))
+                continue
+            error = f"invalid user_id or zero amount: {user_id},{amount}"
+        result['invalid'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append((line, error))
+    return result
+
+def preview_point_changes(changes: List[Tuple[int, int, str]], batch_id: str) -> Dict:
+    """Totals of a batch as it would be applied now, without changing anything"""
+    totals: Dict[int, int] = {}
+    for user_id, amount, _ in changes:
+        totals[user_id] = totals.get(user_id, 0) + amount
+    balances = db.get_balances(list(totals))
+    known = [user_id for user_id in totals if user_id in balances]
+    return {
+        'rows': len(changes),
+        'users': len(known),
+        'unknown_users': len(totals) - len(known),
+        'added': sum(amount for user_id, amount, _ in changes if amount > 0 and user_id in balances),
+        'deducted': -sum(amount for user_id, amount, _ in changes if amount < 0 and user_id in balances),
+        'negative_balances': sum(1 for user_id in known if balances[user_id] + totals[user_id] < 0),
+        'applied': db.get_point_batch(batch_id),
+    }
+
+if __name__ == '__main__':
+    import sys
+    report = verify_balances(repair='--repair' in sys.argv)
+    print(f"Season: {report['season_id']}  users: {report['users']}  transactions: {report['transactions']}")
+    print(f"Mismatched balances: {report['mismatches']} (total difference {report['difference']})")
+    for user_id, balance, expected in report['examples']:
+        print(f"  {user_id}: balance {balance}, ledger {expected}")
+    if report['repaired']:
+        print(f"Repaired: {report['repaired']}")
@@ -2,16 +2,28 @@ import asyncio
 import logging
 import sys
 import os
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Import modules
-from config import BOT_TOKEN, ADMIN_IDS
+from config import (BOT_TOKEN, ADMIN_IDS, USE_WEBHOOK, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                    WEBAPP_HOST, WEBAPP_PORT, WORKER_COUNT)
 from database import db
 from handlers import router, UserStates
 from admin_panel import admin_router, AdminStates
+from broadcast import broadcast_scheduler
+from middlewares import (TrafficMiddleware, EventCounterMiddleware, EventLogMiddleware, OutboundLaneMiddleware,
+                         throttling_middleware)
+from outbound import outbound_dispatcher, LANE_ADMIN
+from storage import SQLiteStorage
+from workers import run_sharded
+from referral_graph import referral_graph
+from timeseries import event_counters
+from eventlog import event_log
+from charts import chart_renderer
 
 # Configure logging
 logging.basicConfig(
@@ -38,14 +50,43 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-# Use memory storage for FSM
-storage = MemoryStorage()
+# Route every outgoing request through the priority-aware dispatcher
+bot.session.middleware(outbound_dispatcher)
+
+# Persistent FSM storage, survives restarts
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
 
+# Track interactive traffic for adaptive broadcast throttling
+dp.update.outer_middleware(TrafficMiddleware())
+
+# Hourly statistics of updates and active users
+dp.update.outer_middleware(EventCounterMiddleware())
+
+# Drop floods of messages and callbacks per user before they reach any handler
+dp.message.middleware(throttling_middleware)
+dp.callback_query.middleware(throttling_middleware)
+
+# Append-only log of which handler served which user; registered after the
+# throttler so dropped updates are not logged as handled
+event_log_middleware = EventLogMiddleware()
+for observer in (dp.message, dp.callback_query, dp.chat_member):
+    observer.middleware(event_log_middleware)
+
+# Admin panel replies and edits go through the admin lane
+admin_router.message.middleware(OutboundLaneMiddleware(LANE_ADMIN))
+admin_router.callback_query.middleware(OutboundLaneMiddleware(LANE_ADMIN))
+
 # Include routers
 dp.include_router(router)
 dp.include_router(admin_router)
 
+# Background task running scheduled broadcasts
+scheduler_task = None
+
+# Background task writing event counters, one per process
+counters_task = None
+
 async def setup_bot_commands(bot: Bot):
     """Setup bot commands for menu"""
     from aiogram.types import BotCommand, BotCommandScopeDefault
@@ -89,8 +130,28 @@ async def setup_initial_data():
     except Exception as e:
         logger.error(f"❌ Error setting up initial data: {e}")
 
-async def on_startup():
+async def on_startup(worker_index: int = 0):
     """Actions to perform on startup"""
+    # Resolve bot identity once, handlers receive it as `bot_info`
+    try:
+        bot_info = await bot.get_me()
+    except Exception as e:
+        logger.error(f"❌ Error getting bot info: {e}")
+        raise
+    dp['bot_info'] = bot_info
+    
+    # Build the referral graph index before the first admin asks for it
+    referral_graph.sync()
+    
+    # Every process writes its own event counters
+    global counters_task
+    counters_task = asyncio.create_task(event_counters.run())
+    
+    # One-time setup and the scheduler belong to the first worker only
+    if worker_index:
+        logger.info(f"👷 Worker {worker_index} is ready")
+        return
+    
     logger.info("🚀 Bot is starting...")
     
     # Setup database
@@ -103,33 +164,40 @@ async def on_startup():
     # Setup bot commands
     await setup_bot_commands(bot)
     
-    # Get bot info
-    try:
-        bot_info = await bot.get_me()
-        logger.info(f"✅ Bot started successfully!")
-        logger.info(f"📱 Bot name: {bot_info.first_name}")
-        logger.info(f"🆔 Bot username: @{bot_info.username}")
-        logger.info(f"🔢 Bot ID: {bot_info.id}")
-        
-        # Print admin info
-        if ADMIN_IDS:
-            logger.info(f"👑 Admins: {', '.join(map(str, ADMIN_IDS))}")
-        
-        print(f"\n🎉 Telegram Contest Bot is running!")
-        print(f"📱 Bot: @{bot_info.username}")
-        print(f"🔗 Start link: https://t.me/{bot_info.username}")
-        print(f"👑 Admins: {len(ADMIN_IDS)} configured")
-        print(f"📊 Database: Connected")
-        print("=" * 50)
-        
-    except Exception as e:
-        logger.error(f"❌ Error getting bot info: {e}")
-        raise
+    # Start scheduled broadcasts
+    global scheduler_task
+    scheduler_task = asyncio.create_task(broadcast_scheduler(bot))
+    
+    # Bot info
+    logger.info(f"✅ Bot started successfully!")
+    logger.info(f"📱 Bot name: {bot_info.first_name}")
+    logger.info(f"🆔 Bot username: @{bot_info.username}")
+    logger.info(f"🔢 Bot ID: {bot_info.id}")
+    
+    # Print admin info
+    if ADMIN_IDS:
+        logger.info(f"👑 Admins: {', '.join(map(str, ADMIN_IDS))}")
+    
+    print(f"\n🎉 Telegram Contest Bot is running!")
+    print(f"📱 Bot: @{bot_info.username}")
+    print(f"🔗 Start link: https://t.me/{bot_info.username}")
+    print(f"👑 Admins: {len(ADMIN_IDS)} configured")
+    print(f"📊 Database: Connected")
+    print("=" * 50)
 
 async def on_shutdown():
     """Actions to perform on shutdown"""
     logger.info("🛑 Bot is shutting down...")
     
+    if scheduler_task:
+        scheduler_task.cancel()
+    
+    if counters_task:
+        counters_task.cancel()
+    await event_counters.flush()
+    await event_log.close()
+    chart_renderer.close()
+    
     try:
         # Close bot session
         await bot.session.close()
@@ -137,21 +205,60 @@ async def on_shutdown():
     except Exception as e:
         logger.error(f"❌ Error during shutdown: {e}")
 
-async def main():
-    """Main function to run the bot"""
+# Register startup and shutdown handlers
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+async def run_webhook():
+    """Serve updates through an aiohttp webhook"""
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required when USE_WEBHOOK is enabled")
+    
+    app = web.Application()
+    
+    # Answer Telegram with 200 right away and process the update in a background task
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    await site.start()
+    logger.info(f"🌐 Webhook server listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    
     try:
-        # Register startup and shutdown handlers
-        dp.startup.register(on_startup)
-        dp.shutdown.register(on_shutdown)
-        
-        # Start polling
-        logger.info("🔄 Starting polling...")
-        await dp.start_polling(
-            bot,
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
             allowed_updates=dp.resolve_used_update_types(),
             drop_pending_updates=True
         )
         
+        # Serve until cancelled
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def main():
+    """Main function to run the bot"""
+    try:
+        if USE_WEBHOOK:
+            logger.info("🔄 Starting webhook...")
+            await run_webhook()
+        else:
+            # Start polling
+            logger.info("🔄 Starting polling...")
+            await dp.start_polling(
+                bot,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=True
+            )
+        
     except Exception as e:
         logger.error(f"❌ Critical error in main: {e}")
         raise
@@ -166,7 +273,10 @@ if __name__ == "__main__":
             sys.exit(1)
         
         # Run the bot
-        asyncio.run(main())
+        if WORKER_COUNT > 1:
+            run_sharded(bot, dp, WORKER_COUNT, use_webhook=USE_WEBHOOK)
+        else:
+            asyncio.run(main())
         
     except KeyboardInterrupt:
         logger.info("👋 Bot stopped by user")
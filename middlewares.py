@@ -0,0 +1,176 @@
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, TelegramObject
+
+from cache import LRUCache
+from config import (TRAFFIC_WINDOW_SECONDS, MAX_MESSAGES_PER_MINUTE, THROTTLE_DEFAULT_BURST, THROTTLE_CACHE_SIZE,
+                    THROTTLE_STATE_TTL, THROTTLE_ADMIN_CACHE_TTL, ADMIN_IDS)
+from database import db
+from outbound import lane, TokenBucket
+from timeseries import event_counters
+from eventlog import event_log
+
+class TrafficMonitor:
+    """Sliding window counter of incoming updates, bucketed per second"""
+
+    def __init__(self, window: int = TRAFFIC_WINDOW_SECONDS):
+        self.window = window
+        self.buckets = deque()  # (second, count)
+
+    def _expire(self, now: int):
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+
+    def record(self):
+        """Count one incoming update"""
+        now = int(time.monotonic())
+        self._expire(now)
+        if self.buckets and self.buckets[-1][0] == now:
+            self.buckets[-1] = (now, self.buckets[-1][1] + 1)
+        else:
+            self.buckets.append((now, 1))
+
+    def updates_per_second(self) -> float:
+        """Average update rate over the window"""
+        self._expire(int(time.monotonic()))
+        return sum(count for _, count in self.buckets) / self.window
+
+# Global traffic monitor instance
+traffic_monitor = TrafficMonitor()
+
+class TrafficMiddleware(BaseMiddleware):
+    """Outer update middleware feeding the traffic monitor"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        traffic_monitor.record()
+        return await handler(event, data)
+
+class EventCounterMiddleware(BaseMiddleware):
+    """Outer update middleware feeding the hourly event counters"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        event_counters.record_update(event.event_type, user.id if user else None)
+        return await handler(event, data)
+
+class EventLogMiddleware(BaseMiddleware):
+    """Inner middleware appending every handled update to the event log"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        handler_object = data.get('handler')
+        event_log.record(
+            data['event_update'].event_type,
+            handler_object.callback.__name__ if handler_object else '',
+            user.id if user else None
+        )
+        return await handler(event, data)
+
+class OutboundLaneMiddleware(BaseMiddleware):
+    """Inner middleware sending everything a router's handlers do through one outbound lane"""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        with lane(self.priority):
+            return await handler(event, data)
+
+def rate_limit(key: str, per_minute: float, burst: int = 1) -> Dict[str, Any]:
+    """Handler flags giving the handler its own throttling bucket per user"""
+    return {'rate_limit': {'key': key, 'per_minute': per_minute, 'burst': burst}}
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Inner middleware dropping a user's updates beyond their token bucket.
+
+    Handlers share the default bucket unless flagged with `rate_limit(...)`.
+    Buckets live in an LRU that forgets idle users, so memory stays bounded
+    under a flood of distinct accounts. Admins are never throttled; their ids
+    are cached, reloaded when this process changes the admin list and at
+    least every THROTTLE_ADMIN_CACHE_TTL seconds. Dropped callback queries
+    are answered so the client stops its loading spinner.
+    """
+
+    def __init__(self, per_minute: float = MAX_MESSAGES_PER_MINUTE, burst: int = THROTTLE_DEFAULT_BURST):
+        self.default = {'key': 'default', 'per_minute': per_minute, 'burst': burst}
+        self.buckets = LRUCache(THROTTLE_CACHE_SIZE, ttl=THROTTLE_STATE_TTL)  # (user_id, key) -> TokenBucket
+        self.throttled = Counter()
+        self.admin_ids = None
+        self.admins_expire = 0.0
+        db.admin_listeners.append(self.invalidate_admins)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        rule = get_flag(data, 'rate_limit') or self.default
+        bucket_key = (user.id, rule['key'])
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(rule['per_minute'] / 60, rule['burst'])
+        # Re-store on every update so only idle buckets expire
+        self.buckets.set(bucket_key, bucket)
+
+        if bucket.take() and not self._is_admin(user.id):
+            self.throttled[rule['key']] += 1
+            if isinstance(event, CallbackQuery):
+                try:
+                    await event.answer("⏳ Juda tez! Biroz kuting.")
+                except TelegramAPIError:
+                    pass  # Expired or already answered
+            return None
+        return await handler(event, data)
+
+    def invalidate_admins(self):
+        self.admin_ids = None
+
+    def _is_admin(self, user_id: int) -> bool:
+        # Only looked up for updates that are about to be dropped
+        if user_id in ADMIN_IDS:
+            return True
+        if self.admin_ids is None or time.monotonic() >= self.admins_expire:
+            self.admin_ids = db.get_admin_ids()
+            self.admins_expire = time.monotonic() + THROTTLE_ADMIN_CACHE_TTL
+        return user_id in self.admin_ids
+
+    def get_metrics(self) -> Dict:
+        """Dropped updates per bucket and number of users currently tracked"""
+        return {
+            'throttled': dict(self.throttled),
+            'total': sum(self.throttled.values()),
+            'tracked': len(self.buckets),
+        }
+
+# Global throttling middleware instance
+throttling_middleware = ThrottlingMiddleware()
@@ -0,0 +1,246 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE,
+                    OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES)
+
+# Priority lanes, lower value is served first
+LANE_INTERACTIVE = 0
+LANE_ADMIN = 1
+LANE_BULK = 2
+
+LANE_NAMES = {
+    LANE_INTERACTIVE: 'interactive',
+    LANE_ADMIN: 'admin',
+    LANE_BULK: 'bulk',
+}
+
+# Methods that count against Telegram's message flood limits
+LIMITED_METHOD_PREFIXES = ('send', 'copy', 'forward', 'edit')
+
+# Chat buckets are dropped once the table grows past this size
+CHAT_BUCKETS_SWEEP_SIZE = 10000
+
+_current_lane: ContextVar[int] = ContextVar('outbound_lane', default=LANE_INTERACTIVE)
+
+@contextmanager
+def lane(priority: int):
+    """Send every request made inside this block through the given lane"""
+    token = _current_lane.set(priority)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; return 0 on success or seconds to wait otherwise"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        """True if the bucket would be full now, i.e. it holds no state worth keeping"""
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+    def refund(self):
+        """Return a token that was taken but not used"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class SharedTokenBucket:
+    """Token bucket in shared memory, drawn from by every forked worker process.
+
+    Created before the workers are forked, so all of them see the same
+    tokens; CLOCK_MONOTONIC is system-wide, so refill times agree. The lock
+    is only held for the arithmetic.
+    """
+
+    def __init__(self, rate: float, capacity: float, context):
+        self.rate = rate
+        self.capacity = capacity
+        self._state = context.RawArray('d', [capacity, time.monotonic()])  # tokens, updated
+        self._lock = context.Lock()
+
+    def take(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+            self._state[1] = now
+            if tokens >= 1:
+                self._state[0] = tokens - 1
+                return 0.0
+            self._state[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def refund(self):
+        with self._lock:
+            self._state[0] = min(self.capacity, self._state[0] + 1)
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """Session middleware that schedules every outgoing send by priority lane.
+
+    A single pump task hands out global rate-limit tokens to the waiting
+    request of the highest priority lane, so handler replies overtake
+    queued broadcast traffic. Each chat additionally has its own bucket,
+    and RetryAfter pauses the whole dispatcher before retrying.
+    """
+
+    def __init__(self, rate: float = OUTBOUND_GLOBAL_RATE, burst: float = OUTBOUND_GLOBAL_BURST,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.queues = {priority: deque() for priority in LANE_NAMES}
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+
+        # Metrics
+        self.sent = {priority: 0 for priority in LANE_NAMES}
+        self.max_depth = {priority: 0 for priority in LANE_NAMES}
+        self.retry_after_count = 0
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+
+    def share_between_processes(self, context):
+        """Move the global limit into shared memory; call before forking processes that send with the same token.
+
+        A single bucket lets whichever worker is busy, e.g. the one running
+        a broadcast, use the whole limit instead of a fixed 1/N slice.
+        """
+        self.global_bucket = SharedTokenBucket(self.global_bucket.rate, self.global_bucket.capacity, context)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not method.__api_method__.startswith(LIMITED_METHOD_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = _current_lane.get()
+        chat_id = getattr(method, 'chat_id', None)
+
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._wait_chat(chat_id)
+            await self._acquire(priority)
+
+            try:
+                response = await make_request(bot, method)
+                self.sent[priority] += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+
+    async def _wait_chat(self, chat_id):
+        """Respect per-chat limits, stricter for groups and channels"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= CHAT_BUCKETS_SWEEP_SIZE:
+                self.chat_buckets = {key: b for key, b in self.chat_buckets.items() if not b.is_full()}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(OUTBOUND_GROUP_RATE if is_group else OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+
+        delay = bucket.take()
+        while delay:
+            await asyncio.sleep(delay)
+            delay = bucket.take()
+
+    async def _acquire(self, priority: int):
+        """Wait until the pump grants this request a global token"""
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.create_task(self._pump())
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues[priority]
+        queue.append(future)
+        self.max_depth[priority] = max(self.max_depth[priority], len(queue))
+        self._wakeup.set()
+        await future
+
+    def _has_waiters(self) -> bool:
+        for queue in self.queues.values():
+            while queue and queue[0].done():
+                queue.popleft()  # Cancelled by its caller
+            if queue:
+                return True
+        return False
+
+    def _pop_waiter(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    return future
+        return None
+
+    async def _pump(self):
+        while True:
+            if not self._has_waiters():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay = self.global_bucket.take()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            # Pick the waiter only now, so requests that arrived meanwhile can jump ahead
+            future = self._pop_waiter()
+            if future is None:
+                self.global_bucket.refund()
+                continue
+            future.set_result(None)
+
+    def get_metrics(self) -> Dict:
+        """Queue depth and throughput counters per lane"""
+        return {
+            'queue_depth': {LANE_NAMES[p]: sum(not f.done() for f in q) for p, q in self.queues.items()},
+            'max_queue_depth': {LANE_NAMES[p]: depth for p, depth in self.max_depth.items()},
+            'sent': {LANE_NAMES[p]: count for p, count in self.sent.items()},
+            'retry_after': self.retry_after_count,
+            'paused': max(0.0, self.paused_until - time.monotonic()),
+        }
+
+# Global outbound dispatcher instance
+outbound_dispatcher = OutboundDispatcher()
@@ -0,0 +1,132 @@
+import threading
+from typing import Dict, List, Optional
+
+from database import db
+
+class ReferralGraph:
+    """In-memory adjacency index over the referrals table.
+
+    Built on first use and kept current by reading only referrals with an
+    id above the last one seen. Subtree size and depth are computed for all
+    users in one pass and, like per-level counts, cached until new
+    referrals arrive. Reports read it from executor threads, so public
+    methods hold a re-entrant lock.
+    """
+
+    def __init__(self):
+        self.children: Dict[int, List[int]] = {}
+        self.parent: Dict[int, int] = {}
+        self.last_id = 0
+        self.lock = threading.RLock()
+
+        # Cleared whenever the graph changes
+        self.sizes: Optional[Dict[int, int]] = None
+        self.depths: Optional[Dict[int, int]] = None
+        self.levels: Dict[int, List[int]] = {}
+
+    def sync(self):
+        """Add referrals inserted since the last sync"""
+        with self.lock:
+            rows = db.execute_query(
+                'SELECT id, referrer_id, referred_id FROM referrals WHERE id > ? ORDER BY id', (self.last_id,)
+            )
+            if not rows:
+                return
+
+            for _, referrer_id, referred_id in rows:
+                # A user is brought in once; later duplicates and self-referrals are ignored
+                if referred_id in self.parent or referrer_id == referred_id:
+                    continue
+                self.parent[referred_id] = referrer_id
+                self.children.setdefault(referrer_id, []).append(referred_id)
+
+            self.last_id = rows[-1][0]
+            self.sizes = None
+            self.depths = None
+            self.levels = {}
+
+    def _compute_all(self):
+        """Subtree size and depth of every referrer in one iterative post-order pass"""
+        sizes: Dict[int, int] = {}
+        depths: Dict[int, int] = {}
+        for start in self.children:
+            if start in sizes:
+                continue
+            stack = [(start, False)]
+            on_path = set()
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    on_path.discard(node)
+                    size = depth = 0
+                    for child in self.children.get(node, ()):
+                        if child in sizes:
+                            size += sizes[child] + 1
+                            depth = max(depth, depths[child] + 1)
+                    sizes[node] = size
+                    depths[node] = depth
+                    continue
+                if node in sizes or node in on_path:
+                    continue  # Done already, or a cycle in bad data
+                on_path.add(node)
+                stack.append((node, True))
+                for child in self.children.get(node, ()):
+                    if child not in sizes:
+                        stack.append((child, False))
+        self.sizes = sizes
+        self.depths = depths
+
+    def get_subtree(self, user_id: int) -> Dict:
+        """Descendant count, depth and descendants per level of a user's network"""
+        with self.lock:
+            self.sync()
+            if self.sizes is None:
+                self._compute_all()
+
+            levels = self.levels.get(user_id)
+            if levels is None:
+                levels = []
+                seen = {user_id}
+                frontier = [user_id]
+                while frontier:
+                    next_frontier = []
+                    for node in frontier:
+                        for child in self.children.get(node, ()):
+                            if child not in seen:
+                                seen.add(child)
+                                next_frontier.append(child)
+                    if next_frontier:
+                        levels.append(len(next_frontier))
+                    frontier = next_frontier
+                self.levels[user_id] = levels
+
+            return {
+                'user_id': user_id,
+                'referrer_id': self.parent.get(user_id),
+                'size': self.sizes.get(user_id, 0),
+                'depth': self.depths.get(user_id, 0),
+                'levels': levels,
+            }
+
+    def get_top_networks(self, limit: int = 10) -> List[Dict]:
+        """Users with the largest referral networks"""
+        with self.lock:
+            self.sync()
+            if self.sizes is None:
+                self._compute_all()
+            top = sorted(self.sizes, key=self.sizes.get, reverse=True)[:limit]
+            return [self.get_subtree(user_id) for user_id in top]
+
+    def get_upline(self, user_id: int) -> List[int]:
+        """Chain of referrers above a user, nearest first"""
+        with self.lock:
+            self.sync()
+            upline = []
+            node = self.parent.get(user_id)
+            while node is not None and node not in upline and node != user_id:
+                upline.append(node)
+                node = self.parent.get(node)
+            return upline
+
+# Global referral graph instance
+referral_graph = ReferralGraph()
@@ -1,15 +1,91 @@
+import asyncio
 import pandas as pd
-from datetime import datetime, timedelta
-from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
 import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile
 
 from database import db
-from config import EXCEL_MAX_ROWS
+from leaderboard import leaderboard
+from referral_graph import referral_graph
+from timeseries import get_timeseries
+from funnel import build_report
+from config import (EXCEL_MAX_ROWS, DASHBOARD_TTL, EXPORT_DIR, EXPORT_MAX_AGE_DAYS, EXPORT_MAX_TOTAL_MB,
+                    EXPORT_STATS_MAX_AGE)
+
+# Export kind -> data_versions groups its content is read from
+EXPORT_SOURCES = {
+    'users': ('users', 'referrals'),
+    'statistics': ('users', 'referrals', 'statistics'),
+}
+
+def cleanup_exports(directory: str = EXPORT_DIR, max_age_days: int = EXPORT_MAX_AGE_DAYS,
+                    max_total_mb: int = EXPORT_MAX_TOTAL_MB, keep: Iterable[str] = ()) -> int:
+    """Delete export files older than `max_age_days`, then the oldest ones above `max_total_mb` in total"""
+    if not os.path.isdir(directory):
+        return 0
+    keep = {os.path.abspath(path) for path in keep}
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            info = entry.stat()
+            files.append((info.st_mtime, info.st_size, entry.path))
+
+    cutoff = time.time() - max_age_days * 86400
+    limit = max_total_mb * 1024 * 1024
+    total = 0
+    removed = 0
+    # Newest first, so the size limit drops the oldest files
+    for mtime, size, path in sorted(files, reverse=True):
+        if os.path.abspath(path) not in keep and (mtime < cutoff or total + size > limit):
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass  # Removed by another worker
+            continue
+        total += size
+    return removed
 
 class StatsManager:
     def __init__(self):
         self.db = db
 
+        # Admin dashboard snapshot shared by all panel views
+        self.dashboard: Optional[Dict] = None
+        self.dashboard_expires = 0.0
+        self.dashboard_refresh: Optional[asyncio.Task] = None
+
+        self.export_locks = {kind: asyncio.Lock() for kind in EXPORT_SOURCES}
+
+    async def get_dashboard(self) -> Dict:
+        """Snapshot of all admin panel counters.
+
+        Fresh for DASHBOARD_TTL seconds. After that the old snapshot is still
+        served while a single background refresh runs; only the first call
+        waits for the query.
+        """
+        if self.dashboard_refresh is None and (self.dashboard is None or time.monotonic() >= self.dashboard_expires):
+            self.dashboard_refresh = asyncio.create_task(self._refresh_dashboard())
+        if self.dashboard is None:
+            await asyncio.shield(self.dashboard_refresh)
+        return self.dashboard
+
+    async def _refresh_dashboard(self):
+        try:
+            loop = asyncio.get_running_loop()
+            dashboard = await loop.run_in_executor(None, self.db.get_dashboard_counts)
+            participants = dashboard['total_users']
+            dashboard['average_points'] = round(dashboard['total_points'] / participants, 2) if participants else 0
+            self.dashboard = dashboard
+            self.dashboard_expires = time.monotonic() + DASHBOARD_TTL
+        finally:
+            self.dashboard_refresh = None
+
     def get_daily_stats(self, days_ago: int = 0) -> Dict:
         """Get statistics for a specific day"""
         target_date = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d')
@@ -72,26 +148,18 @@ class StatsManager:
         }
 
     def get_growth_dynamics(self, days: int = 30) -> List[Dict]:
-        """Get user growth dynamics for specified period"""
-        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        
-        query = '''
-            SELECT date, new_users, active_users
-            FROM bot_statistics 
-            WHERE date >= ?
-            ORDER BY date ASC
-        '''
-        results = self.db.execute_query(query, (start_date,))
+        """Get user growth dynamics for specified period, one bucket per day or coarser"""
+        results = get_timeseries(datetime.now() - timedelta(days=days), max_points=days + 1)
         
         dynamics = []
         cumulative_users = 0
         
         for row in results:
-            cumulative_users += row[1] or 0
+            cumulative_users += row['new_users']
             dynamics.append({
-                'date': row[0],
-                'new_users': row[1] or 0,
-                'active_users': row[2] or 0,
+                'date': row['bucket'],
+                'new_users': row['new_users'],
+                'active_users': row['active_users'],
                 'cumulative_users': cumulative_users
             })
         
@@ -173,10 +241,10 @@ class StatsManager:
         # Create filename with timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'users_export_{timestamp}.xlsx'
-        filepath = os.path.join('exports', filename)
+        filepath = os.path.join(EXPORT_DIR, filename)
         
         # Create exports directory if it doesn't exist
-        os.makedirs('exports', exist_ok=True)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
         
         # Create Excel file with formatting
         with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
@@ -208,10 +276,17 @@ class StatsManager:
         # Create filename with timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'statistics_export_{timestamp}.xlsx'
-        filepath = os.path.join('exports', filename)
+        filepath = os.path.join(EXPORT_DIR, filename)
         
         # Create exports directory if it doesn't exist
-        os.makedirs('exports', exist_ok=True)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        
+        # The graph walk and the funnel report scan whole tables; keep them off the event loop
+        loop = asyncio.get_running_loop()
+        networks, report = await asyncio.gather(
+            loop.run_in_executor(None, referral_graph.get_top_networks, 50),
+            loop.run_in_executor(None, build_report),
+        )
         
         with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
             
@@ -244,6 +319,33 @@ class StatsManager:
                 })
                 referrers_df.to_excel(writer, sheet_name='Top referrallar', index=False)
             
+            # Multi-level referral networks
+            if networks:
+                max_levels = max(len(network['levels']) for network in networks)
+                networks_df = pd.DataFrame([{
+                    'Foydalanuvchi ID': network['user_id'],
+                    'Taklif qilgan': network['referrer_id'],
+                    'Tarmoq hajmi': network['size'],
+                    'Chuqurlik': network['depth'],
+                    **{f'{level}-daraja': (network['levels'][level - 1] if level <= len(network['levels']) else 0)
+                       for level in range(1, max_levels + 1)}
+                } for network in networks])
+                networks_df.to_excel(writer, sheet_name='Referal tarmoqlari', index=False)
+            
+            # Registration funnel and weekly cohort retention
+            funnel_df = pd.DataFrame(report['funnel'])[['title', 'users', 'of_started', 'of_previous']]
+            funnel_df.columns = ['Bosqich', 'Foydalanuvchilar', "Boshlaganlardan %", 'Oldingi bosqichdan %']
+            funnel_df.to_excel(writer, sheet_name='Voronka', index=False)
+            cohorts_df = report['cohorts'].rename(columns={
+                'users': 'Foydalanuvchilar',
+                'subscribed_pct': "Obuna %",
+                'registered_pct': "Telefon %",
+                'referred_pct': "Referal %",
+                **{column: f'{column[1:]}-hafta %' for column in report['cohorts'].columns if column.startswith('w')}
+            })
+            cohorts_df.index.name = 'Kogorta (hafta)'
+            cohorts_df.to_excel(writer, sheet_name='Kogortalar')
+            
             # All-time statistics
             all_time = self.get_all_time_stats()
             stats_data = {
@@ -283,24 +385,67 @@ class StatsManager:
         
         return filepath
 
-    def get_contest_statistics(self) -> Dict:
+    def _export_is_current(self, kind: str, cached: Optional[Dict], data_version: str) -> bool:
+        if not cached or cached['data_version'] != data_version:
+            return False
+        if not cached['file_id'] and not os.path.exists(cached['file_path']):
+            return False
+        if kind == 'statistics':
+            created_at = datetime.strptime(cached['created_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            if (datetime.now(timezone.utc) - created_at).total_seconds() > EXPORT_STATS_MAX_AGE:
+                return False
+        return True
+
+    async def get_export(self, kind: str, force: bool = False) -> Dict:
+        """Latest export of a kind, generated again only when its tables were written since.
+
+        Every write to users, referrals or bot_statistics bumps a counter in
+        data_versions from a trigger, so equal counters mean equal content.
+        The statistics export also counts activity in rolling windows, so it
+        is keyed by day and kept at most EXPORT_STATS_MAX_AGE seconds.
+        """
+        async with self.export_locks[kind]:
+            data_version = self.db.get_data_version(EXPORT_SOURCES[kind])
+            if kind == 'statistics':
+                data_version += f";{datetime.now():%Y-%m-%d}"
+            cached = None if force else self.db.get_cached_export(kind)
+            if self._export_is_current(kind, cached, data_version):
+                return cached
+
+            if kind == 'users':
+                file_path = await self.export_users_to_excel()
+            else:
+                file_path = await self.export_statistics_to_excel()
+            self.db.save_cached_export(kind, data_version, file_path)
+
+            current = [export['file_path'] for export in map(self.db.get_cached_export, EXPORT_SOURCES) if export]
+            cleanup_exports(keep=current)
+            return {'data_version': data_version, 'file_path': file_path, 'file_id': None}
+
+    async def send_export(self, bot: Bot, chat_id: int, kind: str, caption: str):
+        """Send an export, reusing the Telegram file_id of an earlier upload of the same file"""
+        export = await self.get_export(kind)
+        if export['file_id']:
+            try:
+                await bot.send_document(chat_id, export['file_id'], caption=caption)
+                return
+            except TelegramAPIError:
+                self.db.set_export_file_id(kind, export['file_path'], None)  # Expired on Telegram's side
+                if not os.path.exists(export['file_path']):
+                    export = await self.get_export(kind, force=True)
+
+        message = await bot.send_document(chat_id, FSInputFile(export['file_path']), caption=caption)
+        self.db.set_export_file_id(kind, export['file_path'], message.document.file_id)
+
+    async def get_contest_statistics(self) -> Dict:
         """Get contest-specific statistics"""
-        top_users = self.db.get_top_users(20)
-        total_participants = self.db.get_total_users()
-        
-        # Calculate total points distributed
-        query = 'SELECT SUM(balance) FROM users WHERE balance > 0'
-        result = self.db.execute_query(query)
-        total_points = result[0][0] if result and result[0][0] else 0
-        
-        # Get average points
-        avg_points = total_points / total_participants if total_participants > 0 else 0
+        dashboard = await self.get_dashboard()
         
         return {
-            'total_participants': total_participants,
-            'total_points_distributed': total_points,
-            'average_points': round(avg_points, 2),
-            'top_20_users': top_users,
+            'total_participants': dashboard['total_users'],
+            'total_points_distributed': dashboard['total_points'],
+            'average_points': dashboard['average_points'],
+            'top_20_users': leaderboard.get_top(),
             'contest_active': self.is_contest_active()
         }
 
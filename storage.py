@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import DATABASE_PATH, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in SQLite with a bounded in-memory LRU in front.
+
+    Reads are served from the LRU and fall back to one primary key lookup.
+    Writes only mark the record dirty; changed records are written in one
+    executemany every FSM_FLUSH_INTERVAL seconds, on eviction and on close.
+    Records without state and data are deleted instead of stored.
+    """
+
+    def __init__(self, db_path: str = DATABASE_PATH, cache_size: int = FSM_CACHE_SIZE,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, key_builder: Optional[KeyBuilder] = None):
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # StorageKey -> [state, data]
+        self.cache: "OrderedDict[StorageKey, list]" = OrderedDict()
+        self.dirty = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection of the current process, opened on first use so the storage survives a fork"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT
+                ) WITHOUT ROWID
+            ''')
+            self._conn.commit()
+        return self._conn
+
+    def _record(self, key: StorageKey) -> list:
+        """Get cached record, loading it from SQLite on a miss"""
+        record = self.cache.get(key)
+        if record is not None:
+            self.cache.move_to_end(key)
+            return record
+
+        row = self.conn.execute(
+            'SELECT state, data FROM fsm_storage WHERE key = ?', (self.key_builder.build(key),)
+        ).fetchone()
+        if row:
+            record = [row[0], json.loads(row[1]) if row[1] else {}]
+        else:
+            record = [None, {}]
+        self.cache[key] = record
+        self._evict()
+        return record
+
+    def _mark_dirty(self, key: StorageKey):
+        self.dirty.add(key)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _evict(self):
+        """Drop least recently used records, writing changed ones in one batch"""
+        if len(self.cache) <= self.cache_size:
+            return
+
+        # Evict a tenth of the cache at once so writes of dirty records are batched
+        target = self.cache_size - self.cache_size // 10
+        evicted = []
+        while len(self.cache) > target:
+            key, record = self.cache.popitem(last=False)
+            if key in self.dirty:
+                evicted.append((key, record))
+        if not evicted:
+            return
+        try:
+            self._write(evicted)
+        except Exception as e:
+            print(f"Error writing evicted FSM records: {e}")
+            # Keep them cached and dirty, so the next flush retries them
+            for key, record in evicted:
+                self.cache[key] = record
+                self.cache.move_to_end(key, last=False)
+            self._mark_dirty(evicted[0][0])
+            return
+        self.dirty.difference_update(key for key, _ in evicted)
+
+    def _write(self, items):
+        """Persist (key, record) pairs in one transaction"""
+        upserts = []
+        deletes = []
+        for key, (state, data) in items:
+            storage_key = self.key_builder.build(key)
+            if state is None and not data:
+                deletes.append((storage_key,))
+            else:
+                upserts.append((storage_key, state, json.dumps(data, ensure_ascii=False)))
+
+        try:
+            if upserts:
+                self.conn.executemany('INSERT OR REPLACE INTO fsm_storage (key, state, data) VALUES (?, ?, ?)', upserts)
+            if deletes:
+                self.conn.executemany('DELETE FROM fsm_storage WHERE key = ?', deletes)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def flush(self):
+        """Write all changed records; they stay dirty if the write fails"""
+        if not self.dirty:
+            return
+        items = [(key, self.cache[key]) for key in self.dirty if key in self.cache]
+        self._write(items)
+        self.dirty.clear()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing FSM storage: {e}")
+            # Retry after another interval
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key)[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = self._record(key)
+        record[1] = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._record(key)[1].copy()
+
+    async def close(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self.flush()
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+            self._conn = None
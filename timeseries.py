@@ -0,0 +1,136 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from database import db
+from hyperloglog import HyperLogLog
+from config import (STATS_FLUSH_INTERVAL, STATS_HOURLY_RETENTION_DAYS, STATS_DAILY_RETENTION_DAYS,
+                    TIMESERIES_MAX_POINTS)
+
+HOUR_FORMAT = '%Y-%m-%d %H:00'
+
+# Resolution -> (bucket key format, bucket length), finest first
+RESOLUTIONS = {
+    'hour': (HOUR_FORMAT, timedelta(hours=1)),
+    'day': ('%Y-%m-%d', timedelta(days=1)),
+    'month': ('%Y-%m', timedelta(days=30)),
+}
+
+# Oldest data each resolution still holds
+RETENTION = {
+    'hour': timedelta(days=STATS_HOURLY_RETENTION_DAYS),
+    'day': timedelta(days=STATS_DAILY_RETENTION_DAYS),
+}
+
+class EventCounters:
+    """Per-hour event counters of this process, written to stats_hourly periodically.
+
+    Active users are counted exactly per hour, keeping only the ids of the
+    current hour; updates are sharded by user across workers, so flushed
+    hourly counts simply add up. Per day they go into a HyperLogLog sketch
+    of constant size, which is merged into the stored one on flush, so
+    restarts and several workers never count a user twice.
+    """
+
+    def __init__(self):
+        self.hours: Dict[str, Counter] = {}
+        self.active_hours: Dict[str, Set[int]] = {}
+        self.day_sketches: Dict[str, HyperLogLog] = {}
+
+    def incr(self, name: str, amount: int = 1):
+        """Add to a counter of the current hour"""
+        hour = datetime.now().strftime(HOUR_FORMAT)
+        self.hours.setdefault(hour, Counter())[name] += amount
+
+    def record_update(self, event_type: str, user_id: Optional[int]):
+        """Count one incoming update and mark its user active"""
+        hour = datetime.now().strftime(HOUR_FORMAT)
+        counts = self.hours.setdefault(hour, Counter())
+        counts['updates'] += 1
+        if event_type == 'message':
+            counts['messages'] += 1
+        elif event_type == 'callback_query':
+            counts['callbacks'] += 1
+        if not user_id:
+            return
+
+        seen = self.active_hours.setdefault(hour, set())
+        if user_id not in seen:
+            seen.add(user_id)
+            counts['active_users'] += 1
+            day = hour[:10]
+            sketch = self.day_sketches.get(day)
+            if sketch is None:
+                sketch = self.day_sketches[day] = HyperLogLog()
+            sketch.add(user_id)
+
+    def _merge(self, hours: Dict[str, Counter], day_sketches: Dict[str, HyperLogLog]):
+        """Put counts back after a failed write"""
+        for hour, counts in hours.items():
+            self.hours.setdefault(hour, Counter()).update(counts)
+        for day, sketch in day_sketches.items():
+            self.day_sketches.setdefault(day, HyperLogLog()).merge(sketch)
+
+    async def flush(self):
+        """Write counts collected since the last flush"""
+        hours, self.hours = self.hours, {}
+        day_sketches, self.day_sketches = self.day_sketches, {}
+
+        # Ids are only needed while their hour is still running
+        current = datetime.now().strftime(HOUR_FORMAT)
+        self.active_hours = {hour: ids for hour, ids in self.active_hours.items() if hour >= current}
+
+        if not hours and not day_sketches:
+            return
+        loop = asyncio.get_running_loop()
+        written = await loop.run_in_executor(
+            None, db.add_event_counts, hours, day_sketches, STATS_HOURLY_RETENTION_DAYS, STATS_DAILY_RETENTION_DAYS
+        )
+        if not written:
+            self._merge(hours, day_sketches)
+
+    async def run(self, interval: float = STATS_FLUSH_INTERVAL):
+        """Flush counters every `interval` seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing event counters: {e}")
+
+def pick_resolution(start: datetime, end: datetime, max_points: int = TIMESERIES_MAX_POINTS) -> str:
+    """Finest resolution that still holds `start` and needs at most `max_points` buckets"""
+    now = datetime.now()
+    for resolution, (_, length) in RESOLUTIONS.items():
+        retention = RETENTION.get(resolution)
+        if retention is not None and start < now - retention:
+            continue
+        if (end - start) / length <= max_points:
+            return resolution
+    return 'month'
+
+def get_timeseries(start: datetime, end: Optional[datetime] = None,
+                   max_points: int = TIMESERIES_MAX_POINTS) -> List[Dict]:
+    """Event counts between two moments from the best matching resolution"""
+    end = end or datetime.now()
+    resolution = pick_resolution(start, end, max_points)
+    key_format = RESOLUTIONS[resolution][0]
+    return db.get_timeseries(resolution, start.strftime(key_format), end.strftime(key_format))
+
+def get_active_users(days: int = 1) -> int:
+    """Estimated distinct active users over the last `days` calendar days, today included.
+
+    Merges the stored daily sketches with the ones this process has not
+    flushed yet; other workers' latest activity shows up after their flush.
+    """
+    today = datetime.now()
+    start_day = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    merged = db.get_active_sketch(start_day, today.strftime('%Y-%m-%d'))
+    for day, sketch in event_counters.day_sketches.items():
+        if day >= start_day:
+            merged.merge(sketch)
+    return merged.count()
+
+# Global event counters instance
+event_counters = EventCounters()
@@ -0,0 +1,204 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import queue as queue_module
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT
+from outbound import outbound_dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Long polling settings of the front process
+POLLING_TIMEOUT = 30
+POLLING_RETRY_DELAY = 5
+
+# Updates taken from the worker queue per executor round trip
+QUEUE_BATCH_SIZE = 100
+
+def extract_user_id(update: Dict[str, Any]) -> int:
+    """User the update belongs to; chat id for anonymous updates, 0 if there is neither"""
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+def shard_for(user_id: int, count: int) -> int:
+    """Worker index serving this user"""
+    return user_id % count
+
+class ShardRouter:
+    """Puts raw updates on worker queues so one user is always served by the same worker"""
+
+    def __init__(self, queues: List):
+        self.queues = queues
+
+    def route(self, update: Dict[str, Any]):
+        self.queues[shard_for(extract_user_id(update), len(self.queues))].put(update)
+
+    def stop(self):
+        """Tell every worker to finish its queue and exit"""
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+
+def _next_batch(worker_queue) -> List[Optional[Dict]]:
+    """Block for one update, then take whatever else is already queued"""
+    batch = [worker_queue.get()]
+    while batch[-1] is not None and len(batch) < QUEUE_BATCH_SIZE:
+        try:
+            batch.append(worker_queue.get_nowait())
+        except queue_module.Empty:
+            break
+    return batch
+
+async def serve_queue(worker_queue, handle: Callable[[Dict[str, Any]], Awaitable[Any]]):
+    """Feed updates from a worker queue to `handle` until the stop marker.
+
+    Updates of one user are chained so they run strictly in arrival order,
+    different users are handled concurrently.
+    """
+    loop = asyncio.get_running_loop()
+    chains: Dict[int, asyncio.Task] = {}
+
+    async def run_after(previous: Optional[asyncio.Task], update: Dict[str, Any]):
+        if previous is not None:
+            await asyncio.wait({previous})
+        try:
+            await handle(update)
+        except Exception as e:
+            logger.error(f"❌ Error handling update {update.get('update_id')}: {e}")
+
+    def release(user_id: int, task: asyncio.Task):
+        if chains.get(user_id) is task:
+            del chains[user_id]
+
+    running = True
+    while running:
+        for update in await loop.run_in_executor(None, _next_batch, worker_queue):
+            if update is None:
+                running = False
+                break
+            user_id = extract_user_id(update)
+            task = asyncio.create_task(run_after(chains.get(user_id), update))
+            chains[user_id] = task
+            task.add_done_callback(lambda t, user_id=user_id: release(user_id, t))
+
+    # The last task of each user waits for all earlier ones
+    if chains:
+        await asyncio.wait(list(chains.values()))
+
+async def _run_worker(index: int, worker_queue, bot: Bot, dp: Dispatcher):
+    workflow_data = {'dispatcher': dp, **dp.workflow_data, 'worker_index': index}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await serve_queue(worker_queue, lambda update: dp.feed_raw_update(bot, update))
+    finally:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+
+def _worker_main(index: int, worker_queue, bot: Bot, dp: Dispatcher):
+    """Worker process entry point"""
+    # Ctrl+C reaches the whole process group; workers stop through their queue instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, worker_queue, bot, dp))
+
+async def _front_polling(bot: Bot, dp: Dispatcher, router: ShardRouter):
+    """Long poll Telegram and hand every update to its worker"""
+    allowed_updates = dp.resolve_used_update_types()
+    await bot.delete_webhook(drop_pending_updates=True)
+
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=POLLING_TIMEOUT,
+                allowed_updates=allowed_updates,
+                request_timeout=int(bot.session.timeout + POLLING_TIMEOUT)
+            )
+        except Exception as e:
+            logger.error(f"❌ Failed to fetch updates: {e}")
+            await asyncio.sleep(POLLING_RETRY_DELAY)
+            continue
+
+        for update in updates:
+            router.route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+async def _front_webhook(bot: Bot, dp: Dispatcher, router: ShardRouter):
+    """Accept webhook requests and hand every update to its worker"""
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required when USE_WEBHOOK is enabled")
+
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return web.Response(status=401)
+        router.route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT).start()
+    logger.info(f"🌐 Webhook server listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def _run_front(bot: Bot, dp: Dispatcher, router: ShardRouter, use_webhook: bool):
+    try:
+        if use_webhook:
+            await _front_webhook(bot, dp, router)
+        else:
+            await _front_polling(bot, dp, router)
+    finally:
+        await bot.session.close()
+
+def run_sharded(bot: Bot, dp: Dispatcher, count: int, use_webhook: bool = False):
+    """Receive updates in this process and handle them in `count` worker processes.
+
+    Updates are sharded by user_id, so each user's FSM state and update order
+    live in exactly one worker. Other per-process state follows from that:
+    an admin's pending segment lives in the worker serving that admin, and
+    running broadcasts are shared through the broadcast_jobs table. Must be called before any event loop runs:
+    workers are forked and inherit the configured bot and dispatcher.
+    """
+    context = multiprocessing.get_context('fork')
+    # All workers send with the same token and draw from one global limit
+    outbound_dispatcher.share_between_processes(context)
+    queues = [context.Queue() for _ in range(count)]
+    processes = [
+        context.Process(target=_worker_main, args=(index, queues[index], bot, dp), name=f'worker-{index}')
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"👷 Started {count} workers")
+
+    router = ShardRouter(queues)
+    try:
+        asyncio.run(_run_front(bot, dp, router, use_webhook))
+    finally:
+        router.stop()
+        for process in processes:
+            process.join()